@@ -0,0 +1,76 @@
+# Copyright 2015 mysqlapi authors. All rights reserved.
+# Use of this source code is governed by a BSD-style
+# license that can be found in the LICENSE file.
+
+# Compares the snapshot, logical (mysqldump) and physical (xtrabackup) export
+# engines against the local MySQL server. Chunks are compressed exactly like
+# "manage.py export" does but kept in memory instead of uploaded, so the
+# numbers measure dumping, chunking and compression only. Run it from the
+# project root, on the database host, with:
+#
+#     $ python -m benchmarks.export [parallel]
+
+import os
+import sys
+import time
+
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "mysqlapi.settings")
+
+from mysqlapi.api import database, physical, snapshot  # noqa
+from mysqlapi.api.management.commands import s3  # noqa
+
+
+class NullBucket(object):
+
+    def __init__(self):
+        self.keys = set()
+
+    def get_key(self, name):
+        return name if name in self.keys else None
+
+    def new_key(self, name):
+        self.keys.add(name)
+        return self
+
+
+class NullKey(object):
+
+    def __init__(self, bucket, name):
+        bucket.new_key(name)
+
+    def set_contents_from_string(self, data):
+        pass
+
+
+def bench(label, data, workers):
+    import boto.s3.key
+
+    bucket = NullBucket()
+    original = boto.s3.key.Key
+    boto.s3.key.Key = NullKey
+    try:
+        started = time.time()
+        stored = s3.store_chunks(bucket, data, workers=workers)
+        elapsed = time.time() - started
+    finally:
+        boto.s3.key.Key = original
+    mb = stored["size"] / 1024.0 / 1024.0
+    print "%-30s %8.1f MiB %8.1f MiB stored %7.1fs %7.1f MiB/s" % (
+        label, mb, stored["stored"] / 1024.0 / 1024.0, elapsed,
+        mb / elapsed if elapsed else 0)
+
+
+def main():
+    parallel = int(sys.argv[1]) if len(sys.argv) > 1 else 4
+    cmd = ["mysqldump", "-u", "root", "--quick", "--all-databases",
+           "--compact"]
+    bench("logical (mysqldump)", database.stream(cmd), 1)
+    bench("logical, %d workers" % parallel, database.stream(cmd), parallel)
+    dump = snapshot.SnapshotDump(workers=parallel)
+    bench("snapshot, %d workers" % parallel, dump.stream(), parallel)
+    hot = physical.Backup(parallel=parallel)
+    bench("physical, %d workers" % parallel, hot.stream(), parallel)
+
+
+if __name__ == "__main__":
+    main()
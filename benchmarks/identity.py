@@ -0,0 +1,43 @@
+# Copyright 2015 mysqlapi authors. All rights reserved.
+# Use of this source code is governed by a BSD-style
+# license that can be found in the LICENSE file.
+
+# Microbenchmark for the identity derivations that run on every bind/status
+# request. Run it from the project root with:
+#
+#     $ python -m benchmarks.identity
+
+import os
+import timeit
+
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "mysqlapi.settings")
+
+from mysqlapi.api import models  # noqa
+
+NAMES = ["myapp", "my-app-with-dashes", "some very long application name"]
+NUMBER = 100000
+
+
+def bench(label, fn, cache=None):
+    def run():
+        for name in NAMES:
+            if cache is not None:
+                cache.clear()
+            fn(name)
+    seconds = min(timeit.repeat(run, number=NUMBER / len(NAMES), repeat=3))
+    print "%-40s %8.3f us/call" % (label, seconds * 1e6 / NUMBER)
+
+
+def main():
+    canonicalize = models.canonicalize_db_name
+    salted = models._salted_sha1.cache
+    bench("canonicalize_db_name (cold)", canonicalize, canonicalize.cache)
+    bench("canonicalize_db_name (memoized)", canonicalize)
+    bench("generate_password (cold)", models.generate_password, salted)
+    bench("generate_password (memoized)", models.generate_password)
+    bench("generate_user (cold)", models.generate_user, salted)
+    bench("generate_user (memoized)", models.generate_user)
+
+
+if __name__ == "__main__":
+    main()
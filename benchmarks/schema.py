@@ -0,0 +1,48 @@
+# Copyright 2015 mysqlapi authors. All rights reserved.
+# Use of this source code is governed by a BSD-style
+# license that can be found in the LICENSE file.
+
+# Compares the schema export of /resources/<name>/export, read over the
+# pooled connection, with forking "mysqldump -d --compact" for every
+# request, as it used to. Run it from the project root, on the database
+# host, with:
+#
+#     $ python -m benchmarks.schema <database> [requests]
+
+import os
+import subprocess
+import sys
+import time
+
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "mysqlapi.settings")
+
+from mysqlapi.api.models import DatabaseManager  # noqa
+
+
+def mysqldump(name):
+    cmd = ["mysqldump", "-u", "root", "-d", name, "--compact"]
+    return subprocess.check_output(cmd, stderr=subprocess.STDOUT)
+
+
+def native(name):
+    return "".join(DatabaseManager(name).export())
+
+
+def bench(label, fn, name, requests):
+    started = time.time()
+    for i in xrange(requests):
+        size = len(fn(name))
+    elapsed = time.time() - started
+    print "%-30s %8d bytes %8.2f ms/request" % (label, size,
+                                                elapsed * 1000 / requests)
+
+
+def main():
+    name = sys.argv[1]
+    requests = int(sys.argv[2]) if len(sys.argv) > 2 else 50
+    bench("mysqldump -d --compact", mysqldump, name, requests)
+    bench("native", native, name, requests)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,58 @@
+# Copyright 2015 mysqlapi authors. All rights reserved.
+# Use of this source code is governed by a BSD-style
+# license that can be found in the LICENSE file.
+
+import hashlib
+import zlib
+
+MIN_CHUNK_SIZE = 256 * 1024
+MAX_CHUNK_SIZE = 4 * 1024 * 1024
+# A boundary is cut after a line whose crc32 has these bits clear, so on
+# average every 16th line past MIN_CHUNK_SIZE ends a chunk.
+BOUNDARY_MASK = 0xf
+
+
+class ChecksumMismatch(Exception):
+
+    def __init__(self, name):
+        self.args = [u"Checksum mismatch for %s." % name]
+
+
+def lines(data):
+    if isinstance(data, basestring):
+        return data.splitlines(True)
+    return data
+
+
+def split(data, min_size=MIN_CHUNK_SIZE, max_size=MAX_CHUNK_SIZE,
+          mask=BOUNDARY_MASK):
+    # Dumps are split on line boundaries chosen by their content, so a
+    # change only affects the chunks around it and the rest deduplicate
+    # against previous backups.
+    buf = []
+    size = 0
+    for line in lines(data):
+        buf.append(line)
+        size += len(line)
+        if size >= max_size or \
+                (size >= min_size and zlib.crc32(line) & mask == 0):
+            yield "".join(buf)
+            buf = []
+            size = 0
+    if buf:
+        yield "".join(buf)
+
+
+def address(chunk):
+    return hashlib.sha256(chunk).hexdigest()
+
+
+def pack(chunk):
+    return zlib.compress(chunk, 6)
+
+
+def unpack(name, data):
+    chunk = zlib.decompress(data)
+    if address(chunk) != name:
+        raise ChecksumMismatch(name)
+    return chunk
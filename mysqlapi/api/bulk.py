@@ -0,0 +1,95 @@
+# Copyright 2015 mysqlapi authors. All rights reserved.
+# Use of this source code is governed by a BSD-style
+# license that can be found in the LICENSE file.
+
+import csv
+import time
+
+from mysqlapi.api import snapshot
+from mysqlapi.api.snapshot import quote
+
+FORMATS = ("csv", "tsv", "sql")
+BLOCK_SIZE = 64 * 1024
+# Like LOAD DATA, \N stands for NULL.
+NULL = "\\N"
+
+
+class InvalidImport(Exception):
+    pass
+
+
+def rows(lines, format):
+    if format == "tsv":
+        return csv.reader(lines, delimiter="\t", quoting=csv.QUOTE_NONE)
+    return csv.reader(lines)
+
+
+def insert(conn, database, table, rows, columns=None, null=NULL):
+    # Rows are written in extended INSERTs of about snapshot.INSERT_SIZE
+    # bytes, each committed on its own, so neither the upload nor a single
+    # huge transaction is held in memory. Values equal to null are written
+    # as NULL. Returns the number of rows.
+    target = "%s.%s" % (quote(database), quote(table))
+    if columns:
+        target += " (%s)" % ",".join(quote(c) for c in columns)
+    cursor = conn.cursor()
+    count = 0
+    values = []
+    size = 0
+    for row in rows:
+        if not row:
+            continue
+        value = "(%s)" % ",".join(
+            "NULL" if v == null else cursor.connection.literal(v)
+            for v in row)
+        values.append(value)
+        size += len(value)
+        count += 1
+        if size >= snapshot.INSERT_SIZE:
+            write(cursor, target, values)
+            values = []
+            size = 0
+    if values:
+        write(cursor, target, values)
+    return count
+
+
+def write(cursor, target, values):
+    cursor.execute("INSERT INTO %s VALUES %s" % (target, ",".join(values)))
+    cursor.connection.commit()
+
+
+def load(db, upload, format, table=None, header=False):
+    # Imports the file-like upload into the database of the DatabaseManager
+    # db: SQL is piped to the mysql client, CSV and TSV rows are inserted
+    # into table. Returns what was imported and how fast. Uploaded SQL runs
+    # as the user binds get, which only has privileges on this database.
+    if format not in FORMATS:
+        raise InvalidImport(u"Format must be one of %s." % ", ".join(FORMATS))
+    started = time.time()
+    result = {"format": format}
+    if format == "sql":
+        counted = [0]
+
+        def blocks():
+            for block in iter(lambda: upload.read(BLOCK_SIZE), ""):
+                counted[0] += len(block)
+                yield block
+        user, password = db.create_user(db.name, None)
+        db.as_user(user, password).load(blocks())
+        result["bytes"] = counted[0]
+    else:
+        if not table:
+            raise InvalidImport(u"Table name is missing.")
+        lines = rows(upload, format)
+        columns = next(lines, None) if header else None
+        db.conn.open()
+        try:
+            result["rows"] = insert(db.conn, db.name, table, lines, columns)
+        finally:
+            db.conn.close()
+    result["seconds"] = round(time.time() - started, 3)
+    unit = "bytes" if format == "sql" else "rows"
+    result["%s_per_second" % unit] = (
+        int(result[unit] / result["seconds"]) if result["seconds"] else None)
+    return result
@@ -0,0 +1,51 @@
+# Copyright 2015 mysqlapi authors. All rights reserved.
+# Use of this source code is governed by a BSD-style
+# license that can be found in the LICENSE file.
+
+import functools
+import time
+
+_missing = object()
+
+
+def memoize(maxsize=1024):
+    # Like the re module cache: a plain dict that is dropped once it grows
+    # past maxsize, so hits cost a single dict lookup.
+    def decorator(fn):
+        cache = {}
+
+        @functools.wraps(fn)
+        def wrapper(*args):
+            value = cache.get(args, _missing)
+            if value is _missing:
+                value = fn(*args)
+                if len(cache) >= maxsize:
+                    cache.clear()
+                cache[args] = value
+            return value
+        wrapper.cache = cache
+        return wrapper
+    return decorator
+
+
+class TTLCache(object):
+
+    def __init__(self, ttl, maxsize=1024):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self._data = {}
+
+    def get(self, key, default=None):
+        item = self._data.get(key)
+        if item is None or item[1] < time.time():
+            return default
+        return item[0]
+
+    def set(self, key, value, ttl=None):
+        if len(self._data) >= self.maxsize:
+            self._data.clear()
+        expires = time.time() + (self.ttl if ttl is None else ttl)
+        self._data[key] = (value, expires)
+
+    def clear(self):
+        self._data.clear()
@@ -0,0 +1,118 @@
+# Copyright 2015 mysqlapi authors. All rights reserved.
+# Use of this source code is governed by a BSD-style
+# license that can be found in the LICENSE file.
+
+from multiprocessing.pool import ThreadPool
+
+import MySQLdb.cursors
+
+from mysqlapi.api import bulk, schema, snapshot
+from mysqlapi.api.database import Connection
+from mysqlapi.api.snapshot import quote
+
+
+def same_server(source, target):
+    return (source.conn.hostname, str(source.port)) == \
+        (target.conn.hostname, str(target.port))
+
+
+def connect(db, database=""):
+    conn = Connection(db.conn.hostname, db.port, db.conn.username,
+                      db.conn.password, database)
+    conn.open()
+    return conn
+
+
+def server(db):
+    # Rows are copied as bytes, so they're read and written in utf8 over
+    # connections of their own, not the pooled ones.
+    return snapshot.connect(db.host, db.conn.username, db.conn.password)
+
+
+def copy(source, target, progress=None, workers=4):
+    # Copies the database of the source DatabaseManager into the (empty)
+    # database of the target one on the same server, several tables at
+    # once, and progress is reported in bytes of table data copied. The
+    # tables are read like snapshot exports read them: with non-locking
+    # reads of a single snapshot, so the copy is consistent and writes to
+    # the source go on meanwhile. Objects are created over connections to
+    # the target database, so the statements from SHOW CREATE, which only
+    # qualify other databases, end up in it.
+    conn = connect(target, target.name)
+    try:
+        cursor = conn.cursor()
+        cursor.execute("SELECT table_name, table_type, "
+                       "COALESCE(data_length, 0) "
+                       "FROM information_schema.tables "
+                       "WHERE table_schema = %s ORDER BY 3 DESC",
+                       (source.name,))
+        rows = list(cursor.fetchall())
+        tables = [(name, size) for name, kind, size in rows
+                  if kind != "VIEW"]
+        done = 0
+        dump = snapshot.SnapshotDump(lambda: server(source), workers=workers)
+        pool = ThreadPool(workers)
+        try:
+            dump.begin()
+            for size in pool.imap_unordered(
+                    lambda table: copy_table(dump, source, target, *table),
+                    tables):
+                done += size
+                if progress is not None:
+                    progress(done)
+        finally:
+            pool.terminate()
+            pool.join()
+            dump.end()
+        copy_objects(cursor, source.name, target.name,
+                     [name for name, kind, size in rows if kind == "VIEW"])
+        return done
+    finally:
+        conn.close()
+
+
+def copy_table(dump, source, target, name, size):
+    writer = server(target)
+    try:
+        cursor = writer.cursor()
+        # Tables are filled in any order, so foreign keys are only checked
+        # by the source.
+        cursor.execute("SET SESSION foreign_key_checks = 0")
+        original = "%s.%s" % (quote(source.name), quote(name))
+        cursor.execute("CREATE TABLE %s.%s LIKE %s" % (quote(target.name),
+                                                       quote(name),
+                                                       original))
+        with dump.connection() as reader:
+            rows = reader.cursor(MySQLdb.cursors.SSCursor)
+            try:
+                rows.execute("SELECT * FROM %s" % original)
+                bulk.insert(writer, target.name, name, rows, null=None)
+            finally:
+                rows.close()
+        return size
+    finally:
+        writer.close()
+
+
+def copy_objects(cursor, source, target, views):
+    # Views, triggers and routines refer to the source database by name
+    # when they use it explicitly, so those references are renamed.
+    def rename(sql):
+        return sql.replace(quote(source) + ".", quote(target) + ".")
+    qualified = quote(source) + ".%s"
+    definitions = []
+    for name in views:
+        cursor.execute("SHOW CREATE VIEW " + qualified % quote(name))
+        definitions.append((name, cursor.fetchone()[1]))
+    for name, create in schema.ordered(definitions):
+        cursor.execute(rename(create))
+    cursor.execute("SHOW TRIGGERS FROM %s" % quote(source))
+    for trigger in [row[0] for row in cursor.fetchall()]:
+        cursor.execute("SHOW CREATE TRIGGER " + qualified % quote(trigger))
+        cursor.execute(rename(cursor.fetchone()[2]))
+    cursor.execute("SELECT routine_name, routine_type "
+                   "FROM information_schema.routines "
+                   "WHERE routine_schema = %s", (source,))
+    for name, kind in list(cursor.fetchall()):
+        cursor.execute("SHOW CREATE %s %s" % (kind, qualified % quote(name)))
+        cursor.execute(rename(cursor.fetchone()[2]))
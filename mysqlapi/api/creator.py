@@ -3,7 +3,17 @@
 # license that can be found in the LICENSE file.
 
 import Queue
+import datetime
+import logging
+import signal
+import sys
 import threading
+import time
+import traceback
+
+from django.conf import settings
+from django.db import connection
+from django.utils import timezone
 
 model_class = None
 
@@ -14,6 +24,8 @@ class InstanceQueue(object):
         self._queue = Queue.Queue()
         self._closed = False
         self._sem = threading.Semaphore()
+        self._known = set()
+        self._wakeup = threading.Event()
 
     @property
     def closed(self):
@@ -26,53 +38,207 @@ class InstanceQueue(object):
         self._sem.acquire()
         self._closed = True
         self._sem.release()
+        self.wake()
+
+    def wake(self):
+        self._wakeup.set()
+
+    def wait(self, timeout):
+        self._wakeup.wait(timeout)
+        self._wakeup.clear()
 
     def get(self, *args, **kwargs):
         return self._queue.get(*args, **kwargs)
 
-    def put(self, *args, **kwargs):
-        self._queue.put(*args, **kwargs)
+    def put(self, instance, *args, **kwargs):
+        self._sem.acquire()
+        self._known.add(instance.pk)
+        self._sem.release()
+        self._queue.put(instance, *args, **kwargs)
+
+    def drain(self):
+        instances = []
+        while True:
+            try:
+                instances.append(self._queue.get_nowait())
+            except Queue.Empty:
+                return instances
+
+    def done(self, instance):
+        self._sem.acquire()
+        self._known.discard(instance.pk)
+        self._sem.release()
+
+    def __contains__(self, instance):
+        self._sem.acquire()
+        known = instance.pk in self._known
+        self._sem.release()
+        return known
+
+
+class Notifications(object):
+    # Instances reported running by an instance state notification (see
+    # mysqlapi.api.views.ec2_event), which records ec2_running_at and the
+    # host of the pending instance. One query for the whole batch.
+
+    def ready(self, instances):
+        rows = model_class.objects.filter(
+            pk__in=[i.pk for i in instances],
+            ec2_running_at__isnull=False).values_list("pk", "host",
+                                                      "ec2_running_at")
+        notified = dict((pk, (host, at)) for pk, host, at in rows)
+        ready = []
+        for instance in instances:
+            if instance.pk in notified:
+                instance.host, instance.ec2_running_at = notified[instance.pk]
+                instance.state = "running"
+                ready.append(instance)
+        return ready
+
+
+class Poller(object):
+    # A single describe call for all pending instances, at most once every
+    # interval seconds. Filtering by id, rather than passing instance_ids,
+    # keeps an instance that no longer exists from failing the whole batch.
+
+    def __init__(self, ec2_client, interval):
+        self.ec2_client = ec2_client
+        self.interval = interval
+        self._polled_at = 0
+
+    def ready(self, instances):
+        now = time.time()
+        if now - self._polled_at < self.interval:
+            return []
+        self._polled_at = now
+        by_id = dict((i.ec2_id, i) for i in instances)
+        try:
+            reservations = self.ec2_client.ec2_conn.get_all_instances(
+                filters={"instance-id": by_id.keys()})
+        except Exception as exc:
+            logging.error("Error getting instances: %s" % exc)
+            return []
+        ready = []
+        for reservation in reservations:
+            for ec2_instance in reservation.instances:
+                instance = by_id.get(ec2_instance.id)
+                # Same test as crane_ec2's Client.get: the instance is up
+                # once it has a public address.
+                if instance is not None and \
+                        ec2_instance.ip_address != \
+                        ec2_instance.private_ip_address:
+                    instance.state = ec2_instance.state
+                    instance.host = ec2_instance.ip_address
+                    ready.append(instance)
+        return ready
 
 
 class DatabaseCreator(threading.Thread):
 
-    def __init__(self, manager_cls, ec2_client, user="root", password=""):
+    def __init__(self, manager_cls, ec2_client, user="root", password="",
+                 sources=None, interval=None):
         super(DatabaseCreator, self).__init__()
         self.DatabaseManager = manager_cls
         self.ec2_client = ec2_client
         self.user = user
         self.password = password
+        self.interval = interval or settings.EC2_POLL_INTERVAL
+        self.boot_timeout = settings.EC2_BOOT_TIMEOUT
+        if sources is None:
+            sources = [Notifications(), Poller(ec2_client, self.interval)]
+        self.sources = sources
         self.daemon = True
 
-    def _error(self, exc, instance):
-        self.ec2_client.unauthorize(instance)
-        self.ec2_client.terminate(instance)
-        instance.state = "error"
-        instance.reason = unicode(exc)
-        instance.save()
+    def _save(self, instance, **fields):
+        # The instance may have been dropped while it was pending, and a
+        # save() would insert it again. Returns whether it's still there.
+        for name, value in fields.items():
+            setattr(instance, name, value)
+        return bool(model_class.objects.filter(
+            pk=instance.pk, state="pending").update(**fields))
+
+    def _error(self, exc, instance, stage=None):
+        if self._save(instance, state="error", reason=unicode(exc),
+                      failed_stage=stage):
+            self.ec2_client.unauthorize(instance)
+            self.ec2_client.terminate(instance)
+
+    def ready(self, instances):
+        # Every source is asked about the instances the previous ones didn't
+        # report, so the cheaper ones go first.
+        ready = []
+        for source in self.sources:
+            found = set(i.pk for i in ready)
+            waiting = [i for i in instances if i.pk not in found]
+            if not waiting:
+                break
+            ready.extend(source.ready(waiting))
+        return ready
 
     def run(self):
+        # Instances wait here until they're running. Readiness is checked
+        # for all of them at once, every interval or when an event source
+        # wakes the queue up, so EC2 calls don't grow with pending instances.
+        pending = {}
         while not _instance_queue.closed:
             try:
-                instance = _instance_queue.get(timeout=2)
-            except Queue.Empty:
-                continue
-            if not self.ec2_client.get(instance):
-                _instance_queue.put(instance)
-                continue
-            if not self.ec2_client.authorize(instance):
-                self._error("Failed to authorize access to the instance.",
-                            instance)
-                continue
-            try:
-                db = self.DatabaseManager(instance.name,
-                                          host=instance.host,
-                                          user=self.user,
-                                          password=self.password)
-                db.create_database()
-                instance.save()
-            except Exception as exc:
-                self._error(exc, instance)
+                self.run_once(pending)
+            except Exception:
+                sys.stderr.write("Failed to create pending databases\n")
+                traceback.print_exc(file=sys.stderr)
+            finally:
+                connection.close()
+            _instance_queue.wait(self.interval)
+
+    def run_once(self, pending):
+        # An instance leaves pending once it's handled, so one that fails
+        # unexpectedly is tried again on the next round.
+        for instance in _instance_queue.drain():
+            pending[instance.pk] = instance
+        if not pending:
+            return
+        for instance in self.ready(pending.values()):
+            self.create(instance)
+            del pending[instance.pk]
+        for instance in self.expired(pending.values()):
+            self._error("EC2 instance didn't start in %d seconds." %
+                        self.boot_timeout, instance, "ec2_boot")
+            del pending[instance.pk]
+            _instance_queue.done(instance)
+
+    def expired(self, instances):
+        if not self.boot_timeout:
+            return []
+        deadline = timezone.now() - datetime.timedelta(
+            seconds=self.boot_timeout)
+        return [i for i in instances
+                if i.requested_at is not None and i.requested_at < deadline]
+
+    def create(self, instance):
+        if instance.ec2_running_at is None:
+            instance.ec2_running_at = timezone.now()
+        if not self.ec2_client.authorize(instance):
+            self._error("Failed to authorize access to the instance.",
+                        instance, "authorize")
+            _instance_queue.done(instance)
+            return
+        instance.authorized_at = timezone.now()
+        stage = "create_database"
+        try:
+            db = self.DatabaseManager(instance.name,
+                                      host=instance.host,
+                                      user=self.user,
+                                      password=self.password)
+            db.create_database()
+            now = timezone.now()
+            self._save(instance, state="running", host=instance.host,
+                       ec2_running_at=instance.ec2_running_at,
+                       authorized_at=instance.authorized_at,
+                       database_created_at=now, ready_at=now)
+        except Exception as exc:
+            self._error(exc, instance, stage)
+        finally:
+            _instance_queue.done(instance)
 
     def stop(self):
         _instance_queue.close()
@@ -83,7 +249,8 @@ _instance_queue = InstanceQueue()
 
 def build_queue():
     for instance in model_class.objects.filter(state="pending", shared=False):
-        enqueue(instance)
+        if instance not in _instance_queue:
+            enqueue(instance)
 
 
 def reset_queue():
@@ -96,10 +263,18 @@ def enqueue(instance):
     _instance_queue.put(instance)
 
 
+def wake():
+    _instance_queue.wake()
+
+
 def close_queue():
     _instance_queue.close()
 
 
+def queue_closed():
+    return _instance_queue.closed
+
+
 def set_model(cls):
     global model_class
     model_class = cls
@@ -109,3 +284,19 @@ def start_creator(manager_class, ec2_client):
     t = DatabaseCreator(manager_class, ec2_client)
     t.start()
     return t
+
+
+def huphandler(signum, frame):
+    reset_queue()
+
+
+def termhandler(signum, frame):
+    close_queue()
+
+
+def start(manager_class, model, ec2_client):
+    signal.signal(signal.SIGHUP, huphandler)
+    signal.signal(signal.SIGTERM, termhandler)
+    set_model(model)
+    build_queue()
+    return start_creator(manager_class, ec2_client)
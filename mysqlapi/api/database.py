@@ -4,8 +4,10 @@
 # Use of this source code is governed by a BSD-style
 # license that can be found in the LICENSE file.
 
-import MySQLdb
 import subprocess
+import tempfile
+
+from mysqlapi.api import keepalive
 
 
 class Connection(object):
@@ -15,24 +17,30 @@ class Connection(object):
                  port="3306",
                  username="",
                  password="",
-                 database=""):
+                 database="",
+                 connect_timeout=None):
         self.hostname = hostname
         self.username = username
         self.password = password
         self.database = database
         self.port = port
+        self.connect_timeout = connect_timeout
         self._connection = None
 
+    def _key(self):
+        return (self.hostname, self.username, self.password, self.database)
+
     def open(self):
         if not self._connection:
-            self._connection = MySQLdb.connect(self.hostname,
-                                               self.username,
-                                               self.password,
-                                               self.database)
+            self._connection = keepalive.checkout(self._key())
+        if not self._connection:
+            self._connection = keepalive.connect(self._key(),
+                                                 self.connect_timeout)
 
     def close(self):
         if self._connection:
-            self._connection.close()
+            if not keepalive.checkin(self._key(), self._connection):
+                self._connection.close()
             self._connection = None
 
     def cursor(self):
@@ -44,6 +52,59 @@ def export():
                 "-u",
                 "root",
                 "--quick",
+                "--single-transaction",
                 "--all-databases",
                 "--compact"]
     return subprocess.check_output(dump_cmd, stderr=subprocess.STDOUT)
+
+
+def restore(chunks):
+    pipe(["mysql", "-u", "root"], chunks)
+
+
+def _failed(proc, cmd, errors):
+    errors.seek(0)
+    return subprocess.CalledProcessError(proc.returncode, cmd[0],
+                                         errors.read())
+
+
+def stream(cmd, env=None, block_size=None):
+    # Yields the command output by lines, or by blocks of block_size bytes
+    # for binary formats, and raises CalledProcessError if it fails.
+    with tempfile.TemporaryFile() as errors:
+        proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=errors,
+                                env=env)
+        try:
+            if block_size:
+                output = iter(lambda: proc.stdout.read(block_size), "")
+            else:
+                output = proc.stdout
+            for data in output:
+                yield data
+        except GeneratorExit:
+            # The consumer gave up, so nobody will read the rest.
+            proc.kill()
+            proc.wait()
+            raise
+        if proc.wait() != 0:
+            raise _failed(proc, cmd, errors)
+
+
+def pipe(cmd, chunks, env=None):
+    with tempfile.TemporaryFile() as errors:
+        proc = subprocess.Popen(cmd, stdin=subprocess.PIPE, stdout=errors,
+                                stderr=subprocess.STDOUT, env=env)
+        try:
+            for chunk in chunks:
+                proc.stdin.write(chunk)
+        except IOError:
+            # The command exited early, its output says why.
+            pass
+        except Exception:
+            proc.kill()
+            proc.wait()
+            raise
+        finally:
+            proc.stdin.close()
+        if proc.wait() != 0:
+            raise _failed(proc, cmd, errors)
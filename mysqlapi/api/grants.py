@@ -0,0 +1,82 @@
+# Copyright 2015 mysqlapi authors. All rights reserved.
+# Use of this source code is governed by a BSD-style
+# license that can be found in the LICENSE file.
+
+import MySQLdb
+
+GRANT_TABLES = ("user", "db", "tables_priv", "columns_priv", "procs_priv")
+# Accounts that are never dropped, besides the one the API connects with.
+PROTECTED = ("root", "mysql.sys", "mysql.session", "mysql.infoschema", "")
+
+
+def sizes(cursor):
+    result = {}
+    for table in GRANT_TABLES:
+        try:
+            cursor.execute("SELECT COUNT(*) FROM mysql.%s" % table)
+        except MySQLdb.Error:
+            continue
+        result[table] = int(cursor.fetchone()[0])
+    return result
+
+
+def orphans(cursor, databases, keep=()):
+    # Users created by binds only have privileges on instance databases,
+    # so those whose every database is gone, from the server and from the
+    # names databases() returns, are orphans. Users with privileges on a
+    # pattern, or on anything but a database, weren't created by the API
+    # and are left alone. databases() is called once the grants are read,
+    # so instances created meanwhile aren't missed.
+    cursor.execute("SELECT User, Host, Db FROM mysql.db")
+    grants = {}
+    for user, host, db in cursor.fetchall():
+        grants.setdefault((user, host), set()).add(db.replace("\\_", "_"))
+    cursor.execute("SELECT DISTINCT User, Host FROM mysql.tables_priv")
+    others = set(cursor.fetchall())
+    cursor.execute("SELECT schema_name FROM information_schema.schemata")
+    databases = set(databases()) | set(row[0] for row in cursor.fetchall())
+    protected = set(PROTECTED) | set(keep)
+    found = []
+    for account, dbs in sorted(grants.items()):
+        if account[0] in protected or account in others:
+            continue
+        if any("%" in db or db in databases for db in dbs):
+            continue
+        found.append(account)
+    return found
+
+
+def drop(cursor, accounts, batch_size=100):
+    # A single DROP USER per batch keeps the grant tables from being
+    # rewritten and reloaded once per user.
+    for i in xrange(0, len(accounts), batch_size):
+        batch = accounts[i:i + batch_size]
+        args = [value for account in batch for value in account]
+        cursor.execute("DROP USER " + ", ".join(["%s@%s"] * len(batch)),
+                       args)
+    return len(accounts)
+
+
+def granted(cursor, user, database, password):
+    # Whether user already has all privileges on database with password,
+    # as a bind leaves it. Only reads the grant tables, so rebinding the
+    # same app doesn't rewrite them and reload the privileges.
+    cursor.execute("SELECT * FROM mysql.db WHERE User = %s AND Host = '%%' "
+                   "AND Db = %s", (user, database))
+    row = cursor.fetchone()
+    if row is None:
+        return False
+    columns = [c[0] for c in cursor.description]
+    if any(value != "Y" for column, value in zip(columns, row)
+           if column.endswith("_priv") and column != "Grant_priv"):
+        return False
+    cursor.execute("SELECT * FROM mysql.user WHERE User = %s AND Host = '%%'",
+                   (user,))
+    row = cursor.fetchone()
+    if row is None:
+        return False
+    stored = dict(zip([c[0] for c in cursor.description], row))
+    cursor.execute("SELECT PASSWORD(%s)", (password,))
+    expected = cursor.fetchone()[0]
+    return expected in (stored.get("authentication_string"),
+                        stored.get("Password"))
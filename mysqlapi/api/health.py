@@ -0,0 +1,196 @@
+# Copyright 2015 mysqlapi authors. All rights reserved.
+# Use of this source code is governed by a BSD-style
+# license that can be found in the LICENSE file.
+
+import datetime
+import json
+import sys
+import threading
+import time
+import traceback
+
+from multiprocessing.pool import ThreadPool
+
+import MySQLdb
+
+from django.conf import settings
+from django.db import connection
+from django.utils import timezone
+
+from mysqlapi.api.cache import TTLCache
+from mysqlapi.api.models import HealthSnapshot
+
+
+class Snapshot(object):
+    # Sweep results are saved in the database, so the workers answer from
+    # those of the single sweeper process. They are only loaded again
+    # after the next sweep.
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._statuses = {}
+        self.updated_at = None
+
+    def update(self, statuses):
+        updated_at = time.time()
+        data = json.dumps(statuses)
+        rows = HealthSnapshot.objects.filter(pk=1)
+        if not rows.update(updated_at=updated_at, statuses=data):
+            HealthSnapshot.objects.create(pk=1, updated_at=updated_at,
+                                          statuses=data)
+        with self._lock:
+            self._statuses = statuses
+            self.updated_at = updated_at
+
+    def refresh(self):
+        rows = HealthSnapshot.objects.filter(pk=1)
+        with self._lock:
+            if self.updated_at is not None:
+                rows = rows.filter(updated_at__gt=self.updated_at)
+        for row in rows:
+            statuses = json.loads(row.statuses)
+            with self._lock:
+                self._statuses = statuses
+                self.updated_at = row.updated_at
+
+    def get(self, name, max_age):
+        self.refresh()
+        with self._lock:
+            status = self._statuses.get(name)
+        if status is None or time.time() - status["checked_at"] > max_age:
+            return None
+        return status
+
+    def all(self):
+        self.refresh()
+        with self._lock:
+            return self.updated_at, dict(self._statuses)
+
+
+def probe(instance, timeout):
+    started = time.time()
+    if instance.state == "pending":
+        status = "pending"
+    elif instance.is_up(timeout):
+        status = "up"
+    else:
+        status = "down"
+    return instance.name, {
+        "status": status,
+        "checked_at": time.time(),
+        "elapsed": round(time.time() - started, 4),
+    }
+
+
+class Sweeper(threading.Thread):
+
+    def __init__(self, model, snapshot, interval, workers=16, timeout=2):
+        super(Sweeper, self).__init__()
+        self.model = model
+        self.snapshot = snapshot
+        self.interval = interval
+        self.workers = workers
+        self.timeout = timeout
+        self.daemon = True
+        self._stopped = threading.Event()
+
+    def sweep(self):
+        queryset = self.model.objects.filter(state__in=["pending", "running"])
+        instances = list(queryset.select_related("provisionedinstance",
+                                                 "pool_host"))
+        pool = ThreadPool(self.workers)
+        try:
+            results = pool.map(lambda i: probe(i, self.timeout), instances)
+        finally:
+            pool.close()
+            pool.join()
+        self.snapshot.update(dict(results))
+
+    def run(self):
+        while not self._stopped.is_set():
+            try:
+                self.sweep()
+            except Exception:
+                sys.stderr.write("Failed to sweep instances health\n")
+                traceback.print_exc(file=sys.stderr)
+            finally:
+                connection.close()
+            self._stopped.wait(self.interval)
+
+    def stop(self):
+        self._stopped.set()
+        self.join()
+
+
+snapshot = Snapshot()
+_sweeper = None
+
+
+def max_age():
+    interval = settings.HEALTH_SWEEP_INTERVAL
+    return settings.HEALTH_SNAPSHOT_MAX_AGE or 2 * interval
+
+
+def status(instance):
+    if not settings.HEALTH_SWEEP_INTERVAL:
+        return None
+    swept = snapshot.get(instance.name, max_age())
+    # Results like "pending", or taken before the instance was ready, say
+    # nothing about it now.
+    if swept is None or swept["status"] not in ("up", "down"):
+        return None
+    checked_at = datetime.datetime.fromtimestamp(swept["checked_at"],
+                                                 timezone.utc)
+    if instance.ready_at is not None and checked_at < instance.ready_at:
+        return None
+    return swept
+
+
+def start(model):
+    global _sweeper
+    if _sweeper is None:
+        _sweeper = Sweeper(model, snapshot,
+                           interval=settings.HEALTH_SWEEP_INTERVAL,
+                           workers=settings.HEALTH_SWEEP_WORKERS,
+                           timeout=settings.HEALTH_PROBE_TIMEOUT)
+        _sweeper.start()
+    return _sweeper
+
+
+_deep_results = TTLCache(ttl=30)
+_deep_locks = {}
+_deep_lock = threading.Lock()
+
+
+def replica_status(db):
+    result = {"host": db.public_host}
+    try:
+        probe = db.probe(settings.HEALTH_PROBE_TIMEOUT)
+    except MySQLdb.Error as e:
+        result.update(status="down", error=e.args[-1])
+        return result
+    result.update(status="up", replication_lag=probe["replication_lag"])
+    return result
+
+
+def deep_status(instance):
+    # Deep probes describe the backend server, so instances sharing it also
+    # share the cached result, and concurrent callers wait for one probe.
+    db = instance.db_manager()
+    key = (db.conn.hostname, db.port)
+    with _deep_lock:
+        lock = _deep_locks.setdefault(key, threading.Lock())
+    with lock:
+        result = _deep_results.get(key)
+        if result is None:
+            try:
+                result = db.probe(settings.HEALTH_PROBE_TIMEOUT)
+                result["status"] = "up"
+            except MySQLdb.Error as e:
+                result = {"status": "down", "error": e.args[-1]}
+            result["replicas"] = [replica_status(r)
+                                  for r in instance.read_replicas()]
+            result["checked_at"] = time.time()
+            _deep_results.set(key, result,
+                              ttl=settings.HEALTH_DEEP_CACHE_TTL)
+    return result
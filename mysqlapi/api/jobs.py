@@ -0,0 +1,242 @@
+# Copyright 2015 mysqlapi authors. All rights reserved.
+# Use of this source code is governed by a BSD-style
+# license that can be found in the LICENSE file.
+
+import datetime
+import subprocess
+import sys
+import threading
+import time
+import traceback
+
+from django.conf import settings
+from django.db import connection
+from django.utils import timezone
+
+from mysqlapi.api import clone, purge
+from mysqlapi.api.management.commands import s3
+from mysqlapi.api.models import Instance, Job
+
+handlers = {}
+# Kinds of jobs that outlive their instance.
+detached = set()
+
+
+class NotReady(Exception):
+    # Raised by handlers that have to wait for the instance, so the job is
+    # tried again on the next poll.
+    pass
+
+
+def handler(kind, instance=True):
+    def decorator(fn):
+        handlers[kind] = fn
+        if not instance:
+            detached.add(kind)
+        return fn
+    return decorator
+
+
+class Progress(object):
+    # Saves the progress of a running job, which also renews its lease:
+    # a thread keeps it alive while the handler waits without progressing.
+
+    def __init__(self, job, interval=5):
+        self.job = job
+        self.interval = interval
+        self._saved_at = 0
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def __call__(self, done):
+        # Progress is written at most once per interval, with an update()
+        # so it never overwrites the job state.
+        self.job.bytes_done = done
+        if time.time() - self._saved_at >= self.interval:
+            self.save()
+
+    def save(self):
+        self._saved_at = time.time()
+        Job.objects.filter(pk=self.job.pk, state="running").update(
+            bytes_done=self.job.bytes_done, updated_at=timezone.now())
+
+    def beat(self):
+        while not self._stopped.wait(max(self.interval, 1)):
+            try:
+                self.save()
+            except Exception:
+                sys.stderr.write("Failed to renew job {0}\n".format(
+                    self.job.pk))
+                traceback.print_exc(file=sys.stderr)
+            finally:
+                connection.close()
+
+    def start(self):
+        self._thread = threading.Thread(target=self.beat)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+
+
+def counted(chunks, progress):
+    done = 0
+    for chunk in chunks:
+        done += len(chunk)
+        progress(done)
+        yield chunk
+
+
+@handler("backup")
+def run_backup(job, instance, progress):
+    db = instance.db_manager()
+    with s3.session():
+        key = s3.store_data(db.dump(), databases=[instance.name],
+                            prefix=s3.instance_prefix(instance.name),
+                            progress=progress)
+    job.backup = key.name
+    job.bytes_total = job.bytes_done
+
+
+@handler("restore")
+def run_restore(job, instance, progress):
+    db = instance.db_manager()
+    with s3.session():
+        chunks = s3.iter_data(s3.bucket(), job.backup)
+        db.load(counted(chunks, progress))
+
+
+@handler("clone")
+def run_clone(job, instance, progress):
+    if instance.state == "pending":
+        raise NotReady()
+    if instance.state != "running":
+        raise Exception(u"Instance %s is not running." % instance.name)
+    source = Instance.objects.select_related(
+        "provisionedinstance", "pool_host").get(name=job.source)
+    src, dst = source.db_manager(), instance.db_manager()
+    if clone.same_server(src, dst):
+        clone.copy(src, dst, progress, workers=settings.CLONE_PARALLEL)
+    else:
+        dst.load(counted(src.dump(), progress))
+    job.bytes_total = job.bytes_done
+
+
+@handler("purge", instance=False)
+def run_purge(job, instance, progress):
+    load, limiter = purge.shared_throttle()
+    conn = purge.shared_connection()
+    conn.open()
+    try:
+        if job.bytes_total is None:
+            job.bytes_total = sum(size for table, size in
+                                  purge.tables(conn.cursor(), job.source))
+            Job.objects.filter(pk=job.pk).update(bytes_total=job.bytes_total)
+        purge.purge(conn, job.source, limiter, progress)
+    finally:
+        conn.close()
+        load.close()
+
+
+def failure_reason(exc):
+    if isinstance(exc, subprocess.CalledProcessError):
+        # The client tools print "program: error", keep only the error.
+        reason = exc.output.split(":", 1)[-1].strip()
+    else:
+        reason = exc.args[-1] if exc.args else repr(exc)
+    return unicode(reason)[:1000]
+
+
+def claim(job):
+    # Several runners may poll the same table, only one wins the update.
+    now = timezone.now()
+    claimed = Job.objects.filter(pk=job.pk, state="pending").update(
+        state="running", started_at=now)
+    if claimed:
+        job.state = "running"
+        job.started_at = now
+    return bool(claimed)
+
+
+def requeue():
+    # Running jobs whose lease wasn't renewed were left by a runner that
+    # died or was redeployed, they are run again from the start.
+    stale = timezone.now() - datetime.timedelta(
+        seconds=settings.JOB_LEASE_TIMEOUT)
+    return Job.objects.filter(state="running", updated_at__lt=stale).update(
+        state="pending", started_at=None, updated_at=timezone.now())
+
+
+def execute(job):
+    progress = Progress(job, settings.JOB_PROGRESS_INTERVAL)
+    progress.start()
+    try:
+        instance = None
+        if job.kind not in detached:
+            instance = Instance.objects.select_related(
+                "provisionedinstance", "pool_host").get(
+                    name=job.instance_name)
+        handlers[job.kind](job, instance, progress)
+        job.state = "done"
+    except NotReady:
+        job.state = "pending"
+        job.started_at = None
+    except Exception as e:
+        job.state = "error"
+        job.reason = failure_reason(e)
+        sys.stderr.write("Job {0} ({1}) failed\n".format(job.pk, job.kind))
+        traceback.print_exc(file=sys.stderr)
+    finally:
+        progress.stop()
+    job.save()
+    return job
+
+
+class JobRunner(threading.Thread):
+
+    def __init__(self, interval):
+        super(JobRunner, self).__init__()
+        self.interval = interval
+        self.daemon = True
+        self._stopped = threading.Event()
+
+    def run_once(self):
+        requeue()
+        pending = Job.objects.filter(state="pending").order_by("pk")
+        done = 0
+        for job in list(pending):
+            if self._stopped.is_set():
+                break
+            if claim(job):
+                execute(job)
+                done += 1
+        return done
+
+    def run(self):
+        while not self._stopped.is_set():
+            try:
+                self.run_once()
+            except Exception:
+                sys.stderr.write("Failed to run pending jobs\n")
+                traceback.print_exc(file=sys.stderr)
+            finally:
+                connection.close()
+            self._stopped.wait(self.interval)
+
+    def stop(self):
+        self._stopped.set()
+        self.join()
+
+
+_runner = None
+
+
+def start():
+    global _runner
+    if _runner is None:
+        _runner = JobRunner(settings.JOB_POLL_INTERVAL)
+        _runner.start()
+    return _runner
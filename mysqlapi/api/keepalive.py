@@ -0,0 +1,189 @@
+# Copyright 2015 mysqlapi authors. All rights reserved.
+# Use of this source code is governed by a BSD-style
+# license that can be found in the LICENSE file.
+
+import random
+import socket
+import threading
+import time
+
+import MySQLdb
+
+from django.conf import settings
+
+from mysqlapi.api.cache import TTLCache
+
+_hosts = TTLCache(ttl=60)
+
+
+def resolve(hostname):
+    # "localhost" means the unix socket to MySQLdb, so it's kept as is.
+    if not settings.DNS_CACHE_TTL or hostname in ("localhost", "", None):
+        return hostname
+    address = _hosts.get(hostname)
+    if address is None:
+        try:
+            address = socket.gethostbyname(hostname)
+        except socket.error:
+            return hostname
+        _hosts.set(hostname, address, ttl=settings.DNS_CACHE_TTL)
+    return address
+
+
+def connect(key, timeout=None):
+    # Pooled connections are shared by every caller, so their session is
+    # set up here, the same for all, and never changed afterwards: utf8,
+    # which exports need, is the connection charset.
+    hostname, username, password, database = key
+    kwargs = {"charset": "utf8", "use_unicode": False}
+    if timeout:
+        kwargs["connect_timeout"] = timeout
+    return MySQLdb.connect(resolve(hostname), username, password, database,
+                           **kwargs)
+
+
+class Pool(object):
+
+    def __init__(self, size=1, idle_timeout=600, connect_timeout=5):
+        self.size = size
+        self.idle_timeout = idle_timeout
+        self.connect_timeout = connect_timeout
+        self._idle = {}
+        self._last_used = {}
+        self._lock = threading.Lock()
+
+    def checkout(self, key):
+        with self._lock:
+            self._last_used[key] = time.time()
+            conns = self._idle.get(key)
+            conn = conns.pop() if conns else None
+        if conn is not None:
+            try:
+                conn.ping()
+            except MySQLdb.Error:
+                _close(conn)
+                conn = None
+        return conn
+
+    def checkin(self, key, conn):
+        try:
+            conn.rollback()
+        except MySQLdb.Error:
+            return False
+        with self._lock:
+            conns = self._idle.setdefault(key, [])
+            if len(conns) < self.size:
+                conns.append(conn)
+                return True
+        return False
+
+    def backends(self):
+        with self._lock:
+            return self._last_used.keys()
+
+    def keepalive(self):
+        now = time.time()
+        with self._lock:
+            idle, self._idle = self._idle, {}
+            expired = [k for k, used in self._last_used.items()
+                       if now - used > self.idle_timeout]
+            for key in expired:
+                del self._last_used[key]
+            active = self._last_used.keys()
+        for key, conns in idle.items():
+            for conn in conns:
+                if key in expired:
+                    _close(conn)
+                    continue
+                try:
+                    conn.ping()
+                except MySQLdb.Error:
+                    _close(conn)
+                    continue
+                if not self.checkin(key, conn):
+                    _close(conn)
+        for key in active:
+            resolve(key[0])
+            with self._lock:
+                missing = self.size - len(self._idle.get(key, []))
+            for i in xrange(missing):
+                try:
+                    conn = connect(key, self.connect_timeout)
+                except MySQLdb.Error:
+                    break
+                if not self.checkin(key, conn):
+                    _close(conn)
+
+    def close(self):
+        with self._lock:
+            idle, self._idle = self._idle, {}
+            self._last_used.clear()
+        for conns in idle.values():
+            for conn in conns:
+                _close(conn)
+
+
+def _close(conn):
+    try:
+        conn.close()
+    except MySQLdb.Error:
+        pass
+
+
+class KeepaliveScheduler(threading.Thread):
+
+    def __init__(self, pool, interval, jitter=0.2):
+        super(KeepaliveScheduler, self).__init__()
+        self.pool = pool
+        self.interval = interval
+        self.jitter = jitter
+        self.daemon = True
+        self._stopped = threading.Event()
+
+    def run(self):
+        while not self._stopped.is_set():
+            # Jitter keeps workers from pinging every backend in lockstep.
+            spread = self.interval * self.jitter
+            self._stopped.wait(self.interval +
+                               random.uniform(-spread, spread))
+            if not self._stopped.is_set():
+                self.pool.keepalive()
+
+    def stop(self):
+        self._stopped.set()
+        self.join()
+        self.pool.close()
+
+
+pool = None
+_scheduler = None
+
+
+def checkout(key):
+    if pool is None:
+        return None
+    return pool.checkout(key)
+
+
+def checkin(key, conn):
+    if pool is None:
+        return False
+    return pool.checkin(key, conn)
+
+
+def start():
+    global pool, _scheduler
+    if _scheduler is None:
+        pool = Pool(size=settings.KEEPALIVE_POOL_SIZE,
+                    idle_timeout=settings.KEEPALIVE_IDLE_TIMEOUT,
+                    connect_timeout=settings.KEEPALIVE_CONNECT_TIMEOUT)
+        _scheduler = KeepaliveScheduler(pool, settings.KEEPALIVE_INTERVAL)
+        _scheduler.start()
+    return _scheduler
+
+
+def stop():
+    global pool, _scheduler
+    if _scheduler is not None:
+        _scheduler.stop()
+        pool = _scheduler = None
@@ -0,0 +1,146 @@
+# Copyright 2015 mysqlapi authors. All rights reserved.
+# Use of this source code is governed by a BSD-style
+# license that can be found in the LICENSE file.
+
+import contextlib
+import threading
+import time
+
+from django.conf import settings
+
+
+class LimitExceeded(Exception):
+
+    def __init__(self, operation, status, retry_after):
+        self.args = [u"Too many concurrent %s operations, try again later."
+                     % operation]
+        self.status = status
+        self.retry_after = retry_after
+
+
+class Limiter(object):
+
+    def __init__(self, operation, max_global=4, max_per_host=2, queue=16,
+                 timeout=30, retry_after=30):
+        self.operation = operation
+        self.max_global = max_global
+        self.max_per_host = max_per_host
+        self.queue = queue
+        self.timeout = timeout
+        self.retry_after = retry_after
+        self._cond = threading.Condition()
+        self._running = 0
+        self._waiting = 0
+        self._per_host = {}
+        self._admitted = 0
+        self._rejected = 0
+        self._timed_out = 0
+
+    def _has_room(self, host):
+        return (self._running < self.max_global and
+                self._per_host.get(host, 0) < self.max_per_host)
+
+    def acquire(self, host):
+        with self._cond:
+            if not self._has_room(host):
+                if self._waiting >= self.queue:
+                    self._rejected += 1
+                    raise LimitExceeded(self.operation, 429, self.retry_after)
+                self._waiting += 1
+                deadline = time.time() + self.timeout
+                try:
+                    while not self._has_room(host):
+                        remaining = deadline - time.time()
+                        if remaining <= 0:
+                            self._timed_out += 1
+                            raise LimitExceeded(self.operation, 503,
+                                                self.retry_after)
+                        self._cond.wait(remaining)
+                finally:
+                    self._waiting -= 1
+            self._running += 1
+            self._per_host[host] = self._per_host.get(host, 0) + 1
+            self._admitted += 1
+
+    def release(self, host):
+        with self._cond:
+            self._running -= 1
+            if self._per_host[host] > 1:
+                self._per_host[host] -= 1
+            else:
+                del self._per_host[host]
+            self._cond.notify_all()
+
+    @contextlib.contextmanager
+    def slot(self, host):
+        self.acquire(host)
+        try:
+            yield
+        finally:
+            self.release(host)
+
+    def held(self, host, chunks):
+        # For streaming responses, which are sent after the view returns.
+        # The slot must already be acquired.
+        return Held(self, host, chunks)
+
+    def metrics(self):
+        with self._cond:
+            return {
+                "running": self._running,
+                "waiting": self._waiting,
+                "per_host": dict(self._per_host),
+                "admitted": self._admitted,
+                "rejected": self._rejected,
+                "timed_out": self._timed_out,
+                "max_global": self.max_global,
+                "max_per_host": self.max_per_host,
+                "queue": self.queue,
+                "timeout": self.timeout,
+            }
+
+
+class Held(object):
+    # Iterates over chunks and releases the slot when closed, which Django
+    # does once the response is sent, or dropped.
+
+    def __init__(self, limiter, host, chunks):
+        self.limiter = limiter
+        self.host = host
+        self.chunks = chunks
+
+    def __iter__(self):
+        return iter(self.chunks)
+
+    def close(self):
+        if self.limiter is None:
+            return
+        limiter, self.limiter = self.limiter, None
+        try:
+            if hasattr(self.chunks, "close"):
+                self.chunks.close()
+        finally:
+            limiter.release(self.host)
+
+
+_limiters = {}
+_lock = threading.Lock()
+
+
+def limiter(operation):
+    with _lock:
+        if operation not in _limiters:
+            config = settings.CONCURRENCY_LIMITS.get(operation, {})
+            _limiters[operation] = Limiter(operation, **config)
+        return _limiters[operation]
+
+
+def metrics():
+    with _lock:
+        limiters = _limiters.values()
+    return dict((l.operation, l.metrics()) for l in limiters)
+
+
+def reset():
+    with _lock:
+        _limiters.clear()
@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+
+# Copyright 2015 mysqlapi authors. All rights reserved.
+# Use of this source code is governed by a BSD-style
+# license that can be found in the LICENSE file.
+
+from optparse import make_option
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from mysqlapi.api import grants
+from mysqlapi.api.database import Connection
+from mysqlapi.api.models import Instance, ProvisionedInstance
+
+
+def servers():
+    if settings.SHARED_SERVER:
+        yield Connection(settings.SHARED_SERVER, "3306",
+                         settings.SHARED_USER, settings.SHARED_PASSWORD)
+    seen = set()
+    # Replicas get the drops through replication, which would stop if they
+    # had dropped the users already.
+    pis = ProvisionedInstance.objects.filter(replica_of__isnull=True)
+    for pi in pis.order_by("pk"):
+        if (pi.host, pi.port) not in seen:
+            seen.add((pi.host, pi.port))
+            yield Connection(pi.host, pi.port, pi.admin_user,
+                             pi.admin_password)
+
+
+def kept():
+    users = set([settings.DATABASES["default"]["USER"], settings.SHARED_USER,
+                 settings.PROXY_ADMIN_USER])
+    users.update(settings.KEEP_USERS)
+    pis = ProvisionedInstance.objects.all()
+    users.update(pis.values_list("admin_user", flat=True))
+    return users
+
+
+def databases():
+    names = set(Instance.objects.values_list("name", flat=True))
+    names.update(settings.RESERVED_NAMES)
+    names.add(settings.DATABASES["default"]["NAME"])
+    return names
+
+
+def fmt(sizes):
+    return u", ".join(u"{0} {1}".format(sizes[t], t)
+                      for t in grants.GRANT_TABLES if t in sizes)
+
+
+class Command(BaseCommand):
+
+    can_import_settings = True
+    option_list = BaseCommand.option_list + (
+        make_option("--dry-run", action="store_true", default=False,
+                    help="Only list the orphaned users."),
+        make_option("--batch-size", type="int", default=100,
+                    help="Users dropped by each DROP USER."),
+    )
+
+    def handle(self, *args, **options):
+        # Users are orphans when none of their databases belongs to an
+        # instance or exists, on the shared server and on the pool servers.
+        keep = kept()
+        lines = []
+        for conn in servers():
+            conn.open()
+            try:
+                cursor = conn.cursor()
+                before = grants.sizes(cursor)
+                found = grants.orphans(cursor, databases,
+                                       keep=keep | set([conn.username]))
+                if options["dry_run"]:
+                    for user, host in found:
+                        lines.append(u"{0}: {1}@{2}".format(
+                            conn.hostname, user, host))
+                    lines.append(u"{0}: {1} orphaned users ({2}).".format(
+                        conn.hostname, len(found), fmt(before)))
+                    continue
+                grants.drop(cursor, found, options["batch_size"])
+                after = grants.sizes(cursor)
+            finally:
+                conn.close()
+            lines.append(u"{0}: dropped {1} orphaned users. Before: {2}. "
+                         u"After: {3}.".format(conn.hostname, len(found),
+                                               fmt(before), fmt(after)))
+        return u"\n".join(lines)
@@ -4,8 +4,12 @@
 # Use of this source code is governed by a BSD-style
 # license that can be found in the LICENSE file.
 
-from django.core.management.base import NoArgsCommand
+from optparse import make_option
 
+from django.conf import settings
+from django.core.management.base import CommandError, NoArgsCommand
+
+from mysqlapi.api import physical, snapshot, throttle
 from mysqlapi.api.database import export
 from mysqlapi.api.management.commands import s3
 
@@ -13,11 +17,64 @@ from mysqlapi.api.management.commands import s3
 class Command(NoArgsCommand):
 
     can_import_settings = True
+    option_list = NoArgsCommand.option_list + (
+        make_option("--engine", choices=["snapshot", "logical", "physical"],
+                    default=None,
+                    help="Parallel consistent snapshot, mysqldump "
+                         "(logical) or xtrabackup (physical)."),
+        make_option("--incremental", action="store_true", default=False,
+                    help="Physical only: back up the changes since the "
+                         "last physical backup."),
+        make_option("--parallel", type="int", default=None,
+                    help="Tables or files dumped and chunks uploaded at "
+                         "once."),
+    )
 
     def handle_noargs(self, **options):
+        engine = options.get("engine") or settings.BACKUP_ENGINE
+        parallel = options.get("parallel") or settings.BACKUP_PARALLEL
+        if engine == "physical":
+            with s3.session():
+                self.send_physical(options.get("incremental"), parallel)
+            return u"Successfully exported!"
+        if engine == "snapshot":
+            load = throttle.Load(snapshot.connect)
+            limiter = throttle.from_settings(load.sample)
+            try:
+                with s3.session():
+                    self.send_snapshot(parallel, limiter)
+            finally:
+                load.close()
+            stats = limiter.stats()
+            return (u"Successfully exported! Paused {0} times for "
+                    u"{1}s under load.".format(stats["pauses"],
+                                               stats["paused"]))
         data = export()
-        self.send_data(data)
+        with s3.session():
+            self.send_data(data)
         return u"Successfully exported!"
 
     def send_data(self, data):
         s3.store_data(data)
+
+    def send_physical(self, incremental, parallel):
+        b = s3.bucket()
+        base = None
+        if incremental:
+            base = s3.last_physical(s3.catalog(b))
+            if base is None:
+                raise CommandError(u"There is no physical backup to "
+                                   u"take an incremental backup from.")
+        hot = physical.Backup(parallel=parallel,
+                              incremental_lsn=base and base["to_lsn"],
+                              rate=settings.BACKUP_RATE_LIMIT)
+        stored = s3.store_chunks(b, hot.stream(), workers=parallel)
+        return s3.store_manifest(b, stored,
+                                 meta=hot.meta(base and base["manifest"]))
+
+    def send_snapshot(self, parallel, limiter=None):
+        b = s3.bucket()
+        dump = snapshot.SnapshotDump(workers=parallel, throttle=limiter)
+        stored = s3.store_chunks(b, dump.stream(), workers=parallel)
+        return s3.store_manifest(b, stored, databases=dump.databases,
+                                 meta=dump.meta())
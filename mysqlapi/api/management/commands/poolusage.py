@@ -0,0 +1,45 @@
+# -*- coding: utf-8 -*-
+
+# Copyright 2015 mysqlapi authors. All rights reserved.
+# Use of this source code is governed by a BSD-style
+# license that can be found in the LICENSE file.
+
+import MySQLdb
+
+from django.core.management.base import NoArgsCommand
+from django.db.models import Count
+
+from mysqlapi.api.models import ProvisionedInstance
+
+
+def fmt(used, limit):
+    return u"{0}/{1}".format("-" if used is None else used, limit or "-")
+
+
+class Command(NoArgsCommand):
+
+    can_import_settings = True
+
+    def handle_noargs(self, **options):
+        # Measures the disk and connections used on every pool host, for
+        # placing new instances, and lists them against the host limits.
+        hosts = ProvisionedInstance.objects.filter(
+            replica_of__isnull=True).annotate(
+                databases=Count("tenants")).order_by("pk")
+        lines = [u"{0:<24} {1:>10} {2:>24} {3:>12}".format(
+            "host", "databases", "disk", "connections")]
+        for host in hosts:
+            name = u"{0}:{1}".format(host.host, host.port)
+            try:
+                host.refresh_usage()
+            except MySQLdb.Error as e:
+                lines.append(u"{0:<24} unreachable: {1}".format(name,
+                                                                e.args[-1]))
+                continue
+            max_databases, max_disk, max_connections = host.limits()
+            databases = host.databases or (1 if host.instance_id else 0)
+            lines.append(u"{0:<24} {1:>10} {2:>24} {3:>12}".format(
+                name, fmt(databases, max_databases),
+                fmt(host.disk_used, max_disk),
+                fmt(host.connections_used, max_connections)))
+        return u"\n".join(lines)
@@ -0,0 +1,47 @@
+# -*- coding: utf-8 -*-
+
+# Copyright 2015 mysqlapi authors. All rights reserved.
+# Use of this source code is governed by a BSD-style
+# license that can be found in the LICENSE file.
+
+from optparse import make_option
+
+from django.core.management.base import BaseCommand
+
+from mysqlapi.api import report
+from mysqlapi.api.models import Instance
+
+
+def fmt(value, pattern="{0:.1f}"):
+    return "-" if value is None else pattern.format(value)
+
+
+class Command(BaseCommand):
+
+    can_import_settings = True
+    option_list = BaseCommand.option_list + (
+        make_option("--days", type="int", default=7,
+                    help="Instances requested in the last DAYS days."),
+    )
+
+    def handle(self, *args, **options):
+        data = report.provisioning(Instance, days=options["days"])
+        lines = [
+            u"{0} instances requested in the last {1} days, {2} ready, "
+            u"{3} failed.".format(data["requested"], data["days"],
+                                  data["ready"], data["failed"]),
+            u"",
+            u"{0:<16} {1:>6} {2:>8} {3:>8} {4:>8} {5:>8} {6:>8}".format(
+                "stage (s)", "count", "p50", "p90", "p99", "max", "failed"),
+        ]
+        rows = [(stage, data["stages"][stage])
+                for stage, started, finished in report.STAGES]
+        rows.append(("time_to_ready", data["time_to_ready"]))
+        for stage, summary in rows:
+            failure_rate = fmt(summary.get("failure_rate"), "{0:.1%}")
+            lines.append(
+                u"{0:<16} {1:>6} {2:>8} {3:>8} {4:>8} {5:>8} {6:>8}".format(
+                    stage, summary["count"], fmt(summary["p50"]),
+                    fmt(summary["p90"]), fmt(summary["p99"]),
+                    fmt(summary["max"]), failure_rate))
+        return u"\n".join(lines)
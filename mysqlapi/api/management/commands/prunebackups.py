@@ -0,0 +1,45 @@
+# -*- coding: utf-8 -*-
+
+# Copyright 2015 mysqlapi authors. All rights reserved.
+# Use of this source code is governed by a BSD-style
+# license that can be found in the LICENSE file.
+
+from optparse import make_option
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from mysqlapi.api.management.commands import s3
+
+
+class Command(BaseCommand):
+
+    can_import_settings = True
+    option_list = BaseCommand.option_list + (
+        make_option("--keep", type="int", default=None,
+                    help="Number of backups always kept."),
+        make_option("--max-age-days", type="int", default=None,
+                    help="Older backups beyond --keep are deleted."),
+        make_option("--legacy", action="store_true", default=False,
+                    help="Also delete old pre-catalog backups."),
+    )
+
+    def handle(self, *args, **options):
+        keep = options["keep"]
+        if keep is None:
+            keep = settings.BACKUP_KEEP
+        max_age_days = options["max_age_days"]
+        if max_age_days is None:
+            max_age_days = settings.BACKUP_MAX_AGE_DAYS
+        max_age = max_age_days * 24 * 3600
+        with s3.session():
+            bucket = s3.bucket()
+            expired = s3.prune(keep, max_age)
+            for prefix in s3.instance_prefixes(bucket):
+                expired += s3.prune(keep, max_age, prefix=prefix)
+            legacy = []
+            if options["legacy"]:
+                legacy = list(s3.legacy_keys(bucket, max_age))
+                s3.delete_keys(bucket, legacy)
+        return u"Pruned {0} backups and {1} legacy dumps.".format(
+            len(expired), len(legacy))
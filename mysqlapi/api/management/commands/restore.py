@@ -4,12 +4,51 @@
 # Use of this source code is governed by a BSD-style
 # license that can be found in the LICENSE file.
 
-from django.core.management.base import NoArgsCommand
+from optparse import make_option
+
+from django.core.management.base import CommandError, NoArgsCommand
+
+from mysqlapi.api import database, physical
+from mysqlapi.api.management.commands import s3
 
 
 class Command(NoArgsCommand):
 
     can_import_settings = True
+    option_list = NoArgsCommand.option_list + (
+        make_option("--backup", default=None,
+                    help="Manifest to restore, the latest backup by "
+                         "default."),
+        make_option("--target-dir", default=None,
+                    help="Physical only: where the prepared data "
+                         "directory is written."),
+    )
 
     def handle_noargs(self, **options):
+        name = options.get("backup")
+        with s3.session():
+            b = s3.bucket()
+            backups = s3.catalog(b)
+            if name:
+                entry = s3.find_entry(backups, name)
+            else:
+                entry = backups[-1] if backups else None
+            if entry is not None and entry.get("engine") == "physical":
+                return self.restore_physical(b, backups, entry,
+                                             options.get("target_dir"))
+            if entry is not None:
+                database.restore(s3.iter_data(b, entry["manifest"]))
+            else:
+                # Dumps taken before the catalog existed.
+                database.restore([s3.get_data(name)])
         return u"Successfully restored!"
+
+    def restore_physical(self, b, backups, entry, target_dir):
+        if not target_dir:
+            raise CommandError(u"--target-dir is required to restore "
+                               u"physical backups.")
+        chain = s3.backup_chain(backups, entry)
+        data_dir = physical.restore(
+            chain, lambda e: s3.iter_data(b, e["manifest"]), target_dir)
+        return (u"Prepared {0} backups in {1}, stop MySQL and copy it "
+                u"back to the data directory.".format(len(chain), data_dir))
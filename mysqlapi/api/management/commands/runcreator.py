@@ -0,0 +1,30 @@
+# -*- coding: utf-8 -*-
+
+# Copyright 2015 mysqlapi authors. All rights reserved.
+# Use of this source code is governed by a BSD-style
+# license that can be found in the LICENSE file.
+
+import time
+
+from django.conf import settings
+from django.core.management.base import NoArgsCommand
+
+from mysqlapi.api import creator
+from mysqlapi.api.models import DatabaseManager, Instance
+
+
+class Command(NoArgsCommand):
+
+    can_import_settings = True
+
+    def handle_noargs(self, **options):
+        import crane_ec2
+
+        t = creator.start(DatabaseManager, Instance, crane_ec2.Client())
+        # In standalone mode web workers only save pending instances, so the
+        # queue is refilled from the database on every poll.
+        while t.is_alive():
+            time.sleep(settings.EC2_POLL_INTERVAL)
+            if not creator.queue_closed():
+                creator.build_queue()
+        return u"Creator stopped."
@@ -0,0 +1,25 @@
+# -*- coding: utf-8 -*-
+
+# Copyright 2015 mysqlapi authors. All rights reserved.
+# Use of this source code is governed by a BSD-style
+# license that can be found in the LICENSE file.
+
+from django.conf import settings
+from django.core.management.base import CommandError, NoArgsCommand
+
+from mysqlapi.api import health
+from mysqlapi.api.models import Instance
+
+
+class Command(NoArgsCommand):
+
+    can_import_settings = True
+
+    def handle_noargs(self, **options):
+        if not settings.HEALTH_SWEEP_INTERVAL:
+            raise CommandError(u"MYSQLAPI_HEALTH_SWEEP_INTERVAL is not set.")
+        # Standalone mode: the only sweeper, instead of one per web worker.
+        t = health.start(Instance)
+        while t.is_alive():
+            t.join(1)
+        return u"Health sweeper stopped."
@@ -0,0 +1,21 @@
+# -*- coding: utf-8 -*-
+
+# Copyright 2015 mysqlapi authors. All rights reserved.
+# Use of this source code is governed by a BSD-style
+# license that can be found in the LICENSE file.
+
+from django.core.management.base import NoArgsCommand
+
+from mysqlapi.api import jobs
+
+
+class Command(NoArgsCommand):
+
+    can_import_settings = True
+
+    def handle_noargs(self, **options):
+        # Standalone mode: the only runner, instead of one per web worker.
+        t = jobs.start()
+        while t.is_alive():
+            t.join(1)
+        return u"Job runner stopped."
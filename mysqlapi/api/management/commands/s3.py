@@ -2,8 +2,34 @@
 # Use of this source code is governed by a BSD-style
 # license that can be found in the LICENSE file.
 
+import bisect
+import calendar
+import collections
+import contextlib
+import hashlib
+import json
+import re
+import threading
+import time
+
+from multiprocessing.pool import ThreadPool
+
 from django.conf import settings
 
+from mysqlapi.api import backup
+
+CHUNK_PREFIX = "chunks/"
+MANIFEST_PREFIX = "manifests/"
+INSTANCES_PREFIX = "instances/"
+CATALOG_PREFIX = "catalog/"
+CATALOG = "catalog.json"
+POINTERS = ("lastmanifest", "lastkey", CATALOG)
+DELETE_BATCH_SIZE = 1000
+
+USE_DATABASE = re.compile(r"^USE `([^`]+)`;$", re.M)
+
+_local = threading.local()
+
 
 def connect():
     from boto.s3.connection import S3Connection
@@ -15,27 +41,302 @@ def connect():
 
 
 def bucket():
-    conn = connect()
-    return conn.get_bucket(settings.S3_BUCKET)
+    b = getattr(_local, "bucket", None)
+    if b is None:
+        conn = connect()
+        b = conn.get_bucket(settings.S3_BUCKET)
+        if getattr(_local, "session", False):
+            _local.bucket = b
+    return b
+
+
+@contextlib.contextmanager
+def session():
+    # Every bucket() call inside a session reuses the same S3 connection,
+    # opened on first use.
+    _local.session = True
+    try:
+        yield
+    finally:
+        _local.session = False
+        _local.bucket = None
 
 
 def last_key():
-    key = bucket().get_key("lastkey")
+    b = bucket()
+    # Backups taken before manifests existed are only pointed by "lastkey".
+    key = b.get_key("lastmanifest") or b.get_key("lastkey")
     return key.get_contents_as_string()
 
 
-def store_data(data):
+def instance_prefix(name):
+    return "{0}{1}/".format(INSTANCES_PREFIX, name)
+
+
+def instance_prefixes(b):
+    # Listing with a delimiter yields one common prefix per instance.
+    for item in b.list(prefix=INSTANCES_PREFIX, delimiter="/"):
+        if item.name.endswith("/"):
+            yield item.name
+
+
+def is_manifest(name):
+    return name.startswith(MANIFEST_PREFIX) or "/" + MANIFEST_PREFIX in name
+
+
+def chunk_prefix(manifest):
+    # Chunks live next to the manifests of the same prefix.
+    return manifest.rsplit(MANIFEST_PREFIX, 1)[0] + CHUNK_PREFIX
+
+
+def modified_at(key):
+    # Listings report ISO 8601 timestamps, HEAD requests RFC 1123 ones.
+    from boto.utils import parse_ts
+    from email.utils import mktime_tz, parsedate_tz
+
+    parsed = parsedate_tz(key.last_modified)
+    if parsed is not None:
+        return mktime_tz(parsed)
+    return calendar.timegm(parse_ts(key.last_modified).timetuple())
+
+
+def store_chunks(b, data, prefix="", progress=None, workers=1):
+    from boto.s3.key import Key
+
+    grace = settings.BACKUP_CHUNK_GRACE_HOURS * 3600
+
+    def upload(key_name, chunk):
+        key = b.get_key(key_name)
+        if key is not None:
+            # A reused chunk must outlive this export even if prune finds
+            # it unreferenced meanwhile: copying it onto itself restarts
+            # its grace period.
+            if time.time() - modified_at(key) > grace / 2:
+                b.copy_key(key_name, b.name, key_name, metadata={})
+            return 0
+        packed = backup.pack(chunk)
+        Key(b, key_name).set_contents_from_string(packed)
+        return len(packed)
+
+    # With several workers chunks are compressed and uploaded concurrently
+    # (zlib and sockets release the GIL), keeping at most 2 * workers of
+    # them in memory.
+    pool = ThreadPool(workers) if workers > 1 else None
+    pending = collections.deque()
+    digest = hashlib.sha256()
+    names = []
+    size = stored = 0
+    seen = set()
+    try:
+        for chunk in backup.split(data):
+            digest.update(chunk)
+            size += len(chunk)
+            name = backup.address(chunk)
+            names.append(name)
+            if name not in seen:
+                seen.add(name)
+                key_name = prefix + CHUNK_PREFIX + name
+                if pool is None:
+                    stored += upload(key_name, chunk)
+                else:
+                    pending.append(pool.apply_async(upload,
+                                                    (key_name, chunk)))
+                    if len(pending) >= 2 * workers:
+                        stored += pending.popleft().get()
+            if progress is not None:
+                progress(size)
+        while pending:
+            stored += pending.popleft().get()
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+    return {
+        "chunks": names,
+        "size": size,
+        "stored": stored,
+        "checksum": digest.hexdigest(),
+    }
+
+
+def store_data(data, databases=None, prefix="", progress=None, workers=1,
+               meta=None):
+    b = bucket()
+    if databases is None and isinstance(data, basestring):
+        databases = USE_DATABASE.findall(data)
+    stored = store_chunks(b, data, prefix, progress, workers)
+    return store_manifest(b, stored, databases, prefix, meta)
+
+
+def store_manifest(b, manifest, databases=None, prefix="", meta=None):
     from boto.s3.key import Key
     from uuid import uuid4
 
-    key = Key(bucket(), uuid4().hex)
-    key.set_contents_from_string(data)
+    manifest.update(meta or {})
+    manifest["version"] = 1
+    manifest["created_at"] = time.time()
+    name = prefix + MANIFEST_PREFIX + uuid4().hex
+    key = Key(b, name)
+    key.set_contents_from_string(json.dumps(manifest))
 
-    last_key = Key(bucket(), "lastkey")
+    entry = dict(meta or {})
+    entry.update({
+        "manifest": name,
+        "created_at": manifest["created_at"],
+        "size": manifest["size"],
+        "stored": manifest["stored"],
+        "checksum": manifest["checksum"],
+        "databases": databases or [],
+    })
+    add_to_catalog(b, prefix, entry)
+    last_key = Key(b, prefix + "lastmanifest")
     last_key.set_contents_from_string(key.name)
     return key
 
 
-def get_data():
-    key = bucket().get_key(last_key())
-    return key.get_contents_as_string()
+def pending_entries(b, prefix=""):
+    # Exports add their entry as an object of its own, so concurrent ones
+    # never overwrite each other; prune folds them into the catalog.
+    entries = {}
+    for key in b.list(prefix=prefix + CATALOG_PREFIX):
+        entries[key.name] = json.loads(key.get_contents_as_string())
+    return entries
+
+
+def catalog(b, prefix="", pending=None):
+    if pending is None:
+        pending = pending_entries(b, prefix)
+    key = b.get_key(prefix + CATALOG)
+    backups = []
+    if key is not None:
+        backups = json.loads(key.get_contents_as_string())["backups"]
+    names = set(e["manifest"] for e in backups)
+    backups.extend(e for e in pending.values() if e["manifest"] not in names)
+    return sorted(backups, key=lambda e: e["created_at"])
+
+
+def save_catalog(b, prefix, backups):
+    from boto.s3.key import Key
+
+    backups = sorted(backups, key=lambda e: e["created_at"])
+    data = json.dumps({"backups": backups})
+    Key(b, prefix + CATALOG).set_contents_from_string(data)
+
+
+def add_to_catalog(b, prefix, entry):
+    from boto.s3.key import Key
+
+    name = prefix + CATALOG_PREFIX + entry["manifest"].rsplit("/", 1)[1]
+    Key(b, name).set_contents_from_string(json.dumps(entry))
+
+
+def find_backup(b, at=None, prefix=""):
+    # Latest backup taken at or before the given timestamp.
+    backups = catalog(b, prefix)
+    if at is None:
+        return backups[-1] if backups else None
+    index = bisect.bisect_right([e["created_at"] for e in backups], at)
+    return backups[index - 1] if index else None
+
+
+def find_entry(backups, name):
+    for entry in backups:
+        if entry["manifest"] == name:
+            return entry
+    return None
+
+
+def last_physical(backups):
+    physical = [e for e in backups if e.get("engine") == "physical"]
+    return physical[-1] if physical else None
+
+
+def backup_chain(backups, entry):
+    # From the full backup down to entry, following incremental bases.
+    chain = [entry]
+    while chain[0].get("base"):
+        chain.insert(0, find_entry(backups, chain[0]["base"]))
+    return chain
+
+
+def delete_keys(b, names):
+    names = list(names)
+    for i in xrange(0, len(names), DELETE_BATCH_SIZE):
+        b.delete_keys(names[i:i + DELETE_BATCH_SIZE], quiet=True)
+
+
+def manifest_chunks(b, name):
+    manifest = json.loads(b.get_key(name).get_contents_as_string())
+    return set(manifest["chunks"])
+
+
+def prune(keep, max_age, now=None, prefix=""):
+    # Keeps the newest ``keep`` backups plus every backup younger than
+    # ``max_age`` seconds, and deletes the rest together with the chunks
+    # no kept backup references.
+    now = now or time.time()
+    b = bucket()
+    pending = pending_entries(b, prefix)
+    backups = catalog(b, prefix, pending)
+    cut = max(len(backups) - max(keep, 1), 0)
+    expired = [e for e in backups[:cut] if now - e["created_at"] > max_age]
+    # Incremental backups can only be restored on top of their base.
+    bases = dict((e["manifest"], e.get("base")) for e in backups)
+    needed = set()
+    for entry in backups:
+        base = entry.get("base") if entry not in expired else None
+        while base and base not in needed:
+            needed.add(base)
+            base = bases.get(base)
+    expired = [e for e in expired if e["manifest"] not in needed]
+    kept = [e for e in backups if e not in expired]
+    if expired or pending:
+        save_catalog(b, prefix, kept)
+    delete_keys(b, sorted(pending) + [e["manifest"] for e in expired])
+    referenced = set()
+    for entry in kept:
+        referenced.update(manifest_chunks(b, entry["manifest"]))
+    # Chunks of exports still running are referenced by no manifest yet.
+    grace = settings.BACKUP_CHUNK_GRACE_HOURS * 3600
+    chunks = prefix + CHUNK_PREFIX
+    garbage = [key.name for key in b.list(prefix=chunks)
+               if key.name[len(chunks):] not in referenced and
+               now - modified_at(key) > grace]
+    delete_keys(b, garbage)
+    return expired
+
+
+def legacy_keys(b, max_age, now=None):
+    # Full dumps stored under bare uuid keys before the catalog existed.
+    # The one "lastkey" points to is kept, restore falls back to it.
+    now = now or time.time()
+    pointer = b.get_key("lastkey")
+    last = pointer.get_contents_as_string() if pointer is not None else None
+    for key in b.list():
+        if key.name in POINTERS or key.name == last or \
+                key.name.startswith((CHUNK_PREFIX, MANIFEST_PREFIX,
+                                     CATALOG_PREFIX, INSTANCES_PREFIX)):
+            continue
+        if now - modified_at(key) > max_age:
+            yield key.name
+
+
+def iter_data(b, name):
+    manifest = json.loads(b.get_key(name).get_contents_as_string())
+    digest = hashlib.sha256()
+    chunks = chunk_prefix(name)
+    for chunk_name in manifest["chunks"]:
+        data = b.get_key(chunks + chunk_name).get_contents_as_string()
+        chunk = backup.unpack(chunk_name, data)
+        digest.update(chunk)
+        yield chunk
+    if digest.hexdigest() != manifest["checksum"]:
+        raise backup.ChecksumMismatch(name)
+
+
+def get_data(name=None):
+    name = name or last_key()
+    b = bucket()
+    if not is_manifest(name):
+        return b.get_key(name).get_contents_as_string()
+    return "".join(iter_data(b, name))
@@ -0,0 +1,61 @@
+# -*- coding: utf-8 -*-
+
+# Copyright 2015 mysqlapi authors. All rights reserved.
+# Use of this source code is governed by a BSD-style
+# license that can be found in the LICENSE file.
+
+from django.core.management.base import CommandError, NoArgsCommand
+from django.core.management.color import no_style
+from django.db import connection
+from django.db.utils import DatabaseError
+
+from mysqlapi.api.models import Instance, Job, ProvisionedInstance
+
+
+class Command(NoArgsCommand):
+
+    can_import_settings = True
+
+    # syncdb only creates missing tables, so schema changes to existing ones
+    # are applied here. Every step must be safe to run more than once.
+    models = (Instance, ProvisionedInstance, Job)
+
+    def handle_noargs(self, **options):
+        cursor = connection.cursor()
+        added = 0
+        for model in self.models:
+            added += self.add_columns(cursor, model)
+        created = 0
+        for model in self.models:
+            for sql in connection.creation.sql_indexes_for_model(model,
+                                                                 no_style()):
+                try:
+                    cursor.execute(sql)
+                    created += 1
+                except DatabaseError as e:
+                    if not self.already_exists(e):
+                        raise
+        msg = u"Added {0} columns and created {1} indexes."
+        return msg.format(added, created)
+
+    def add_columns(self, cursor, model):
+        # New fields have to be nullable, so existing rows need no value.
+        table = model._meta.db_table
+        existing = set(c[0] for c in connection.introspection.
+                       get_table_description(cursor, table))
+        qn = connection.ops.quote_name
+        added = 0
+        for field in model._meta.local_fields:
+            if field.column in existing:
+                continue
+            if not field.null:
+                raise CommandError(u"Can't add {0}.{1}, it isn't "
+                                   u"nullable.".format(table, field.column))
+            cursor.execute("ALTER TABLE {0} ADD COLUMN {1} {2} NULL".format(
+                qn(table), qn(field.column), field.db_type(connection)))
+            added += 1
+        return added
+
+    def already_exists(self, exc):
+        # MySQL reports ER_DUP_KEYNAME (1061), SQLite "already exists".
+        return exc.args[0] == 1061 or "already exists" in unicode(exc)
@@ -5,16 +5,20 @@
 import hashlib
 import os
 import re
-import subprocess
+import time
 
 import MySQLdb
 
 from django.conf import settings
-from django.db import models
+from django.db import models, transaction
+from django.utils import timezone
 
-from mysqlapi.api import creator
+from mysqlapi.api import creator, database, grants, schema
+from mysqlapi.api.cache import memoize
 from mysqlapi.api.database import Connection
 
+INVALID_NAME_CHARS = re.compile(r"[\W\s]")
+
 
 class InvalidInstanceName(Exception):
 
@@ -32,8 +36,19 @@ class DatabaseCreationError(Exception):
     pass
 
 
+class UserNotReplicated(Exception):
+
+    def __init__(self, user, host):
+        self.args = [u"User %s was not replicated to %s yet." % (user, host)]
+
+
 def generate_password(string):
-    return hashlib.sha1(string + settings.SALT).hexdigest()
+    return _salted_sha1(string, settings.SALT)
+
+
+@memoize(maxsize=4096)
+def _salted_sha1(string, salt):
+    return hashlib.sha1(string + salt).hexdigest()
 
 
 def generate_user(username):
@@ -84,12 +99,35 @@ class DatabaseManager(object):
         cursor = self.conn.cursor()
         username = generate_user(username)
         password = generate_password(username)
-        sql = ("grant all privileges on {0}.* to '{1}'@'%'"
-               " identified by '{2}'")
-        cursor.execute(sql.format(self.name, username, password))
+        # Credentials are deterministic, so a user that is already there
+        # with its grants is returned as is.
+        if not grants.granted(cursor, username, self.name, password):
+            sql = ("grant all privileges on {0}.* to '{1}'@'%'"
+                   " identified by '{2}'")
+            cursor.execute(sql.format(self.name, username, password))
         self.conn.close()
         return username, password
 
+    def wait_for_user(self, username, timeout, interval=0.5):
+        # Replicas get users through replication, writing to them directly
+        # would fail on read only ones or diverge them, so they're only
+        # checked until the grant shows up.
+        self.conn.open()
+        try:
+            cursor = self.conn.cursor()
+            username = generate_user(username)
+            password = generate_password(username)
+            deadline = time.time() + timeout
+            while not grants.granted(cursor, username, self.name, password):
+                if time.time() >= deadline:
+                    raise UserNotReplicated(username, self.public_host)
+                time.sleep(interval)
+                # Ends the transaction, so the next read sees new grants.
+                cursor.execute("ROLLBACK")
+        finally:
+            self.conn.close()
+        return username, password
+
     def drop_user(self, username, host):
         self.conn.open()
         cursor = self.conn.cursor()
@@ -98,10 +136,59 @@ class DatabaseManager(object):
         self.conn.close()
 
     def export(self):
-        cmd = ["mysqldump", "-u", "root", "-d", self.name, "--compact"]
-        return subprocess.check_output(cmd, stderr=subprocess.STDOUT)
+        # The schema is read over the pooled connection and streamed, like
+        # "mysqldump -d --compact" would write it. A missing database is
+        # reported right away, before anything is streamed.
+        self.conn.open()
+        try:
+            cursor = self.conn.cursor()
+            schema.check(cursor, self.name)
+        except Exception:
+            self.conn.close()
+            raise
+        return self._export(cursor)
+
+    def schema_fingerprint(self):
+        self.conn.open()
+        try:
+            return schema.fingerprint(self.conn.cursor(), self.name)
+        finally:
+            self.conn.close()
+
+    def _export(self, cursor):
+        try:
+            for statement in schema.dump(cursor, self.name):
+                yield statement
+        finally:
+            self.conn.close()
+
+    def _client(self, program, *args):
+        # The password goes through the environment so it doesn't show up
+        # in the process list.
+        cmd = [program, "-h", self.host, "-P", str(self.port),
+               "-u", self.conn.username] + list(args) + [self.name]
+        env = dict(os.environ, MYSQL_PWD=self.conn.password)
+        return cmd, env
+
+    def dump(self):
+        cmd, env = self._client("mysqldump", "--single-transaction",
+                                "--quick", "--routines", "--triggers")
+        return database.stream(cmd, env)
+
+    def load(self, chunks):
+        cmd, env = self._client("mysql")
+        database.pipe(cmd, chunks, env)
 
-    def is_up(self):
+    def as_user(self, user, password):
+        return DatabaseManager(self.name,
+                               host=self._host,
+                               port=self.port,
+                               user=user,
+                               password=password,
+                               public_host=self._public_host)
+
+    def is_up(self, timeout=None):
+        self.conn.connect_timeout = timeout
         try:
             self.conn.open()
             return True
@@ -110,6 +197,43 @@ class DatabaseManager(object):
         finally:
             self.conn.close()
 
+    def probe(self, timeout=None):
+        self.conn.connect_timeout = timeout
+        started = time.time()
+        self.conn.open()
+        try:
+            result = {"connect_latency": time.time() - started}
+            cursor = self.conn.cursor()
+            started = time.time()
+            cursor.execute("SELECT 1")
+            cursor.fetchone()
+            result["query_latency"] = time.time() - started
+            cursor.execute("SHOW GLOBAL STATUS WHERE Variable_name IN "
+                           "('Threads_connected', 'Threads_running', "
+                           "'Innodb_buffer_pool_reads', "
+                           "'Innodb_buffer_pool_read_requests')")
+            status = dict((k, int(v)) for k, v in cursor.fetchall())
+            result["threads_connected"] = status.get("Threads_connected")
+            result["threads_running"] = status.get("Threads_running")
+            requests = status.get("Innodb_buffer_pool_read_requests")
+            result["buffer_pool_hit_ratio"] = None
+            if requests:
+                reads = status.get("Innodb_buffer_pool_reads", 0)
+                result["buffer_pool_hit_ratio"] = 1 - float(reads) / requests
+            result["replication_lag"] = None
+            try:
+                cursor.execute("SHOW SLAVE STATUS")
+                row = cursor.fetchone()
+            except MySQLdb.Error:
+                row = None
+            if row:
+                columns = [c[0] for c in cursor.description]
+                slave = dict(zip(columns, row))
+                result["replication_lag"] = slave["Seconds_Behind_Master"]
+            return result
+        finally:
+            self.conn.close()
+
     @property
     def host(self):
         if self._host == "localhost":
@@ -136,9 +260,34 @@ class Instance(models.Model):
     host = models.CharField(max_length=50, null=True, blank=True)
     port = models.CharField(max_length=5, default="3306")
     shared = models.BooleanField(default=False)
-
-    def is_up(self):
-        return self.state == "running" and self.db_manager().is_up()
+    # Provisioning stages, see mysqlapi.api.report.
+    requested_at = models.DateTimeField(null=True, blank=True, db_index=True)
+    ec2_running_at = models.DateTimeField(null=True, blank=True)
+    authorized_at = models.DateTimeField(null=True, blank=True)
+    database_created_at = models.DateTimeField(null=True, blank=True)
+    ready_at = models.DateTimeField(null=True, blank=True)
+    failed_stage = models.CharField(max_length=50, null=True, blank=True)
+    # Pool host holding this instance among others, see POOL_MAX_DATABASES.
+    pool_host = models.ForeignKey("ProvisionedInstance", null=True,
+                                  blank=True, related_name="tenants",
+                                  on_delete=models.PROTECT)
+
+    class Meta:
+        # The creator rebuilds its queue from (state, shared) lookups.
+        index_together = [["state", "shared"]]
+
+    def is_up(self, timeout=None):
+        return self.state == "running" and self.db_manager().is_up(timeout)
+
+    def provisioned(self):
+        # Views load the instance with select_related("provisionedinstance",
+        # "pool_host"), in which case this doesn't hit the database at all.
+        if self.pool_host_id is not None:
+            return self.pool_host
+        try:
+            return self.provisionedinstance
+        except ProvisionedInstance.DoesNotExist:
+            return None
 
     def db_manager(self):
         host = self.host
@@ -151,10 +300,11 @@ class Instance(models.Model):
             user = settings.SHARED_USER
             password = settings.SHARED_PASSWORD
             public_host = settings.SHARED_SERVER_PUBLIC_HOST
-        elif ProvisionedInstance.objects.filter(instance=self).exists():
-            pi = ProvisionedInstance.objects.get(instance=self)
-            user = pi.admin_user
-            password = pi.admin_password
+        else:
+            pi = self.provisioned()
+            if pi is not None:
+                user = pi.admin_user
+                password = pi.admin_password
         return DatabaseManager(self.name,
                                host=host,
                                port=port,
@@ -162,15 +312,52 @@ class Instance(models.Model):
                                password=password,
                                public_host=public_host)
 
+    def read_replicas(self):
+        # Replicas of the server the instance lives on, as DatabaseManagers
+        # of the instance database on each of them.
+        if self.shared:
+            return [DatabaseManager(self.name,
+                                    host=host,
+                                    user=settings.SHARED_USER,
+                                    password=settings.SHARED_PASSWORD)
+                    for host in settings.SHARED_READ_HOSTS]
+        pi = self.provisioned()
+        if pi is None:
+            return []
+        return [DatabaseManager(self.name,
+                                host=replica.host,
+                                port=replica.port,
+                                user=replica.admin_user,
+                                password=replica.admin_password)
+                for replica in pi.replicas.order_by("pk")]
+
 
 class ProvisionedInstance(models.Model):
-    instance = models.ForeignKey(Instance, null=True, blank=True, unique=True)
+    instance = models.OneToOneField(Instance, null=True, blank=True)
     host = models.CharField(max_length=500)
     port = models.IntegerField(default=3306)
     admin_user = models.CharField(max_length=255, default="root")
     admin_password = models.CharField(max_length=255, blank=True)
+    # Replicas serve reads of the instance their primary is allocated to,
+    # and are never allocated themselves.
+    replica_of = models.ForeignKey("self", null=True, blank=True,
+                                   related_name="replicas")
+    # Limits of a host holding several instances, the POOL_MAX_* settings
+    # when unset, and its usage as last measured.
+    max_databases = models.IntegerField(null=True, blank=True)
+    max_disk = models.BigIntegerField(null=True, blank=True)
+    max_connections = models.IntegerField(null=True, blank=True)
+    disk_used = models.BigIntegerField(null=True, blank=True)
+    connections_used = models.IntegerField(null=True, blank=True)
+    usage_updated_at = models.DateTimeField(null=True, blank=True)
 
     def _manager(self, name=None):
+        if name is not None:
+            return DatabaseManager(name=name,
+                                   host=self.host,
+                                   port=self.port,
+                                   user=self.admin_user,
+                                   password=self.admin_password)
         if not hasattr(self, "_db_manager"):
             self._db_manager = DatabaseManager(name=self.instance.name,
                                                host=self.host,
@@ -192,6 +379,7 @@ class ProvisionedInstance(models.Model):
         instance.shared = False
         instance.ec2_id = None
         instance.state = "running"
+        instance.ready_at = timezone.now()
         instance.save()
         self.instance = instance
         self.save()
@@ -204,12 +392,148 @@ class ProvisionedInstance(models.Model):
         self.instance = None
         self.save()
 
+    def limits(self):
+        def limit(value, default):
+            return default if value is None else value
+        return (limit(self.max_databases, settings.POOL_MAX_DATABASES),
+                limit(self.max_disk, settings.POOL_MAX_DISK),
+                limit(self.max_connections, settings.POOL_MAX_CONNECTIONS))
+
+    def fits(self, databases):
+        max_databases, max_disk, max_connections = self.limits()
+        return ((not max_databases or databases < max_databases) and
+                (not max_disk or (self.disk_used or 0) < max_disk) and
+                (not max_connections or
+                 (self.connections_used or 0) < max_connections))
+
+    def place(self, instance):
+        try:
+            self._manager(instance.name).create_database()
+        except Exception as exc:
+            raise DatabaseCreationError(*exc.args)
+        instance.host = self.host
+        instance.port = str(self.port)
+        instance.shared = False
+        instance.ec2_id = None
+        instance.state = "running"
+        instance.ready_at = timezone.now()
+        instance.pool_host = self
+        instance.save()
+
+    def remove(self, instance):
+        self._manager(instance.name).drop_database()
+        instance.pool_host = None
+
+    def refresh_usage(self):
+        conn = self._manager("").conn
+        conn.open()
+        try:
+            cursor = conn.cursor()
+            cursor.execute("SELECT COALESCE(SUM(data_length + "
+                           "index_length), 0) FROM information_schema.tables "
+                           "WHERE table_schema NOT IN ('mysql', "
+                           "'information_schema', 'performance_schema', "
+                           "'sys')")
+            self.disk_used = int(cursor.fetchone()[0])
+            cursor.execute("SHOW GLOBAL STATUS LIKE 'Threads_connected'")
+            self.connections_used = int(cursor.fetchone()[1])
+        finally:
+            conn.close()
+        self.usage_updated_at = timezone.now()
+        self.save(update_fields=["disk_used", "connections_used",
+                                 "usage_updated_at"])
+
+
+class Job(models.Model):
+    KIND_CHOICES = (
+        ("backup", "backup"),
+        ("restore", "restore"),
+        ("clone", "clone"),
+        ("purge", "purge"),
+    )
+    STATE_CHOICES = (
+        ("pending", "pending"),
+        ("running", "running"),
+        ("done", "done"),
+        ("error", "error"),
+    )
+
+    # Jobs refer to instances by name so their history survives them.
+    instance_name = models.CharField(max_length=100)
+    kind = models.CharField(max_length=50, choices=KIND_CHOICES)
+    state = models.CharField(max_length=50,
+                             default="pending",
+                             choices=STATE_CHOICES)
+    backup = models.CharField(max_length=255, null=True, blank=True)
+    # Clones are jobs of the new instance, copying this one. Purges drop
+    # this database, where the instance tables were moved to.
+    source = models.CharField(max_length=100, null=True, blank=True)
+    bytes_done = models.BigIntegerField(default=0)
+    bytes_total = models.BigIntegerField(null=True, blank=True)
+    reason = models.CharField(max_length=1000,
+                              null=True,
+                              blank=True,
+                              default=None)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        # Runners poll for pending jobs.
+        index_together = [["state", "kind"]]
+
+    def throughput(self):
+        # updated_at of running jobs is their last heartbeat, so they are
+        # measured up to now.
+        if self.started_at is None:
+            return None
+        finished = timezone.now() if self.state == "running" \
+            else self.updated_at
+        elapsed = (finished - self.started_at).total_seconds()
+        if elapsed <= 0:
+            return None
+        return int(self.bytes_done / elapsed)
+
+    def as_dict(self):
+        return {
+            "id": self.pk,
+            "instance": self.instance_name,
+            "kind": self.kind,
+            "state": self.state,
+            "backup": self.backup,
+            "source": self.source,
+            "bytes_done": self.bytes_done,
+            "bytes_total": self.bytes_total,
+            "bytes_per_second": self.throughput(),
+            "reason": self.reason,
+            "created_at": self.created_at.isoformat(),
+            "started_at": self.started_at and self.started_at.isoformat(),
+            "updated_at": self.updated_at.isoformat(),
+        }
+
+
+class HealthSnapshot(models.Model):
+    # The latest health sweep as JSON, in a single row written by the
+    # sweeper and read by every web worker (see mysqlapi.api.health).
+    updated_at = models.FloatField()
+    statuses = models.TextField()
+
+
+def uses_ec2():
+    return not settings.SHARED_SERVER and not settings.USE_POOL
+
 
 def create_database(instance, ec2_client=None):
+    instance.requested_at = timezone.now()
     instance.name = canonicalize_db_name(instance.name)
     if instance.name in settings.RESERVED_NAMES:
         raise InvalidInstanceName(name=instance.name)
-    if Instance.objects.filter(name=instance.name):
+    # An EC2 instance that failed to launch is only kept for the
+    # provisioning report, and doesn't hold its name.
+    Instance.objects.filter(name=instance.name, state="error",
+                            ec2_id__isnull=True,
+                            failed_stage="ec2_boot").delete()
+    if Instance.objects.filter(name=instance.name).exists():
         raise InstanceAlreadyExists(name=instance.name)
     if settings.SHARED_SERVER:
         return _create_shared_database(instance)
@@ -235,28 +559,56 @@ def _create_shared_database(instance):
     instance.state = "running"
     instance.shared = True
     instance.ec2_id = None
+    instance.ready_at = timezone.now()
     instance.save()
 
 
 def _create_from_pool(instance):
+    if settings.POOL_MAX_DATABASES > 1:
+        return _place_in_pool(instance)
     provisioned_instance = ProvisionedInstance.objects.filter(
-        instance__isnull=True)[:1]
+        instance__isnull=True, replica_of__isnull=True,
+        tenants__isnull=True)[:1]
     if not provisioned_instance:
         raise DatabaseCreationError(instance,
                                     "No free instances available in the pool")
     provisioned_instance[0].alloc(instance)
 
 
+def _place_in_pool(instance):
+    # Best fit: the fullest host with room for one more database, so the
+    # emptier ones are kept for the instances that grow. The hosts stay
+    # locked until the database is placed, so concurrent creations can't
+    # overfill the same one.
+    with transaction.atomic():
+        # Tenants are counted only once the lock is held.
+        hosts = list(ProvisionedInstance.objects.select_for_update().filter(
+            instance__isnull=True, replica_of__isnull=True).order_by("pk"))
+        counts = dict(Instance.objects.filter(pool_host__isnull=False).
+                      values_list("pool_host").annotate(models.Count("pk")))
+        candidates = [(counts.get(h.pk, 0), h.disk_used or 0, -h.pk, h)
+                      for h in hosts if h.fits(counts.get(h.pk, 0))]
+        if not candidates:
+            raise DatabaseCreationError(
+                instance, "No free instances available in the pool")
+        max(candidates)[-1].place(instance)
+
+
 def _create_dedicate_database(instance, ec2_client):
     if not ec2_client.run(instance):
-        raise DatabaseCreationError(instance,
-                                    "Failed to create EC2 instance.")
+        instance.state = "error"
+        instance.reason = "Failed to create EC2 instance."
+        instance.failed_stage = "ec2_boot"
+        instance.save()
+        raise DatabaseCreationError(instance, instance.reason)
     instance.save()
-    creator.enqueue(instance)
+    if settings.CREATOR_MODE == "inline":
+        creator.enqueue(instance)
 
 
+@memoize(maxsize=4096)
 def canonicalize_db_name(name):
-    if re.search(r"[\W\s]", name) is not None:
+    if INVALID_NAME_CHARS.search(name) is not None:
         prefix = hashlib.sha1(name).hexdigest()[:10]
-        name = re.sub(r"[\W\s]", "_", name) + prefix
+        name = INVALID_NAME_CHARS.sub("_", name) + prefix
     return name
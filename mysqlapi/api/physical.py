@@ -0,0 +1,106 @@
+# Copyright 2015 mysqlapi authors. All rights reserved.
+# Use of this source code is governed by a BSD-style
+# license that can be found in the LICENSE file.
+
+import os
+import shutil
+import subprocess
+import tempfile
+
+from mysqlapi.api import database
+
+# xbstream is binary, so it's read in blocks that backup.split() groups into
+# chunks the same way it groups dump lines.
+BLOCK_SIZE = 64 * 1024
+CHECKPOINTS = "xtrabackup_checkpoints"
+# Size of the chunks --throttle counts.
+THROTTLE_CHUNK = 10 * 1024 * 1024
+
+
+def read_checkpoints(path):
+    checkpoints = {}
+    with open(path) as f:
+        for line in f:
+            key, sep, value = line.partition("=")
+            if not sep:
+                continue
+            key, value = key.strip(), value.strip()
+            checkpoints[key] = int(value) if value.isdigit() else value
+    return checkpoints
+
+
+class Backup(object):
+
+    def __init__(self, user="root", parallel=4, incremental_lsn=None,
+                 rate=0):
+        self.user = user
+        self.parallel = parallel
+        self.incremental_lsn = incremental_lsn
+        self.rate = rate
+        self.checkpoints = None
+
+    def command(self, lsn_dir):
+        cmd = ["xtrabackup", "--backup", "--user", self.user,
+               "--stream=xbstream", "--parallel=%d" % self.parallel,
+               "--target-dir", lsn_dir, "--extra-lsndir", lsn_dir]
+        if self.incremental_lsn is not None:
+            cmd.append("--incremental-lsn=%d" % self.incremental_lsn)
+        if self.rate:
+            # xtrabackup has to keep up with the redo log, so its stream is
+            # never paused: it limits its own reads, in chunks per second.
+            cmd.append("--throttle=%d" % max(self.rate // THROTTLE_CHUNK,
+                                             1))
+        return cmd
+
+    def stream(self):
+        # Checkpoints (the LSN range of this backup) are copied to a local
+        # directory next to the stream and read once it's complete.
+        lsn_dir = tempfile.mkdtemp(prefix="mysqlapi-xtrabackup-")
+        try:
+            cmd = self.command(lsn_dir)
+            for block in database.stream(cmd, block_size=BLOCK_SIZE):
+                yield block
+            self.checkpoints = read_checkpoints(os.path.join(lsn_dir,
+                                                             CHECKPOINTS))
+        finally:
+            shutil.rmtree(lsn_dir, ignore_errors=True)
+
+    def meta(self, base=None):
+        meta = {
+            "engine": "physical",
+            "backup_type": self.checkpoints["backup_type"],
+            "from_lsn": self.checkpoints["from_lsn"],
+            "to_lsn": self.checkpoints["to_lsn"],
+        }
+        if base is not None:
+            meta["base"] = base
+        return meta
+
+
+def extract(chunks, target_dir):
+    if not os.path.isdir(target_dir):
+        os.makedirs(target_dir)
+    database.pipe(["xbstream", "-x", "-C", target_dir], chunks)
+
+
+def prepare(target_dir, incremental_dir=None, apply_log_only=False):
+    cmd = ["xtrabackup", "--prepare", "--target-dir", target_dir]
+    if apply_log_only:
+        cmd.append("--apply-log-only")
+    if incremental_dir is not None:
+        cmd += ["--incremental-dir", incremental_dir]
+    subprocess.check_output(cmd, stderr=subprocess.STDOUT)
+
+
+def restore(backups, fetch, target_dir):
+    # backups is the chain from the full backup to the one being restored,
+    # and fetch(entry) returns its chunks. Every step but the last one is
+    # prepared with --apply-log-only so the next increment still applies.
+    base_dir = os.path.join(target_dir, "base")
+    extract(fetch(backups[0]), base_dir)
+    prepare(base_dir, apply_log_only=len(backups) > 1)
+    for i, entry in enumerate(backups[1:], 1):
+        incremental_dir = os.path.join(target_dir, "inc%d" % i)
+        extract(fetch(entry), incremental_dir)
+        prepare(base_dir, incremental_dir, apply_log_only=i < len(backups) - 1)
+    return base_dir
@@ -0,0 +1,51 @@
+# Copyright 2015 mysqlapi authors. All rights reserved.
+# Use of this source code is governed by a BSD-style
+# license that can be found in the LICENSE file.
+
+import MySQLdb
+
+from django.conf import settings
+
+# Users are loaded into the running proxy and saved, so they survive its
+# restarts.
+APPLY = ("LOAD MYSQL USERS TO RUNTIME", "SAVE MYSQL USERS TO DISK")
+
+
+def enabled(instance):
+    # Dedicated instances have their whole server, so only the shared one
+    # is behind the proxy.
+    return bool(settings.PROXY_HOST) and instance.shared
+
+
+def connect():
+    return MySQLdb.connect(host=settings.PROXY_ADMIN_HOST,
+                           port=settings.PROXY_ADMIN_PORT,
+                           user=settings.PROXY_ADMIN_USER,
+                           passwd=settings.PROXY_ADMIN_PASSWORD)
+
+
+def admin(statements):
+    conn = connect()
+    try:
+        cursor = conn.cursor()
+        for statement in statements:
+            cursor.execute(*statement)
+        for statement in APPLY:
+            cursor.execute(statement)
+    finally:
+        conn.close()
+
+
+def register(username, password, database):
+    # Connections of the app units end at the proxy, which multiplexes
+    # their queries over a few connections to the server. Transactions
+    # stay on one of them.
+    admin([("REPLACE INTO mysql_users (username, password, "
+            "default_hostgroup, default_schema, max_connections, "
+            "transaction_persistent) VALUES (%s, %s, %s, %s, %s, 1)",
+            (username, password, settings.PROXY_HOSTGROUP, database,
+             settings.PROXY_MAX_CONNECTIONS))])
+
+
+def unregister(username):
+    admin([("DELETE FROM mysql_users WHERE username = %s", (username,))])
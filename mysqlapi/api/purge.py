@@ -0,0 +1,86 @@
+# Copyright 2015 mysqlapi authors. All rights reserved.
+# Use of this source code is governed by a BSD-style
+# license that can be found in the LICENSE file.
+
+import time
+
+from django.conf import settings
+
+from mysqlapi.api import snapshot, throttle
+from mysqlapi.api.database import Connection
+from mysqlapi.api.snapshot import quote
+
+# Dropped databases wait to be purged under this prefix. Instance names
+# can't have "$", so they never clash with it.
+PREFIX = "purge$"
+
+
+def trash_name(name, now=None):
+    now = int(now if now is not None else time.time())
+    return ("%s%d$%s" % (PREFIX, now, name))[:64]
+
+
+def shared_connection():
+    return Connection(settings.SHARED_SERVER, "3306", settings.SHARED_USER,
+                      settings.SHARED_PASSWORD)
+
+
+def detach(conn, name, trash):
+    # Moves the tables of database name into trash and drops what's left of
+    # it. Renames only touch metadata, so it's fast whatever the size of
+    # the tables, and the users of name have no grants on trash. Tables
+    # with triggers can't move to another database, so those go first.
+    cursor = conn.cursor()
+    cursor.execute("CREATE DATABASE %s" % quote(trash))
+    cursor.execute("SHOW TRIGGERS FROM %s" % quote(name))
+    for trigger in [row[0] for row in cursor.fetchall()]:
+        cursor.execute("DROP TRIGGER %s.%s" % (quote(name), quote(trigger)))
+    cursor.execute("SELECT table_name FROM information_schema.tables "
+                   "WHERE table_schema = %s AND table_type = 'BASE TABLE'",
+                   (name,))
+    tables = [row[0] for row in cursor.fetchall()]
+    if tables:
+        cursor.execute("RENAME TABLE " + ", ".join(
+            "%s.%s TO %s.%s" % (quote(name), quote(t), quote(trash), quote(t))
+            for t in tables))
+    cursor.execute("DROP DATABASE %s" % quote(name))
+
+
+def tables(cursor, trash):
+    cursor.execute("SELECT table_name, "
+                   "COALESCE(data_length + index_length, 0) "
+                   "FROM information_schema.tables WHERE table_schema = %s "
+                   "ORDER BY 2", (trash,))
+    return list(cursor.fetchall())
+
+
+def purge(conn, trash, limiter, progress=None):
+    # Drops the tables of trash one at a time, smallest first, going as
+    # fast as limiter lets it for their size: it pauses while the server
+    # is busy. Returns the bytes dropped.
+    cursor = conn.cursor()
+    done = 0
+    for table, size in tables(cursor, trash):
+        limiter.consume(size)
+        cursor.execute("DROP TABLE IF EXISTS %s.%s" % (quote(trash),
+                                                       quote(table)))
+        done += size
+        if progress is not None:
+            progress(done)
+    cursor.execute("DROP DATABASE IF EXISTS %s" % quote(trash))
+    return done
+
+
+def shared_throttle():
+    load = throttle.Load(lambda: snapshot.connect(settings.SHARED_SERVER,
+                                                  settings.SHARED_USER,
+                                                  settings.SHARED_PASSWORD))
+    limiter = throttle.Throttle(
+        load.sample,
+        rate=settings.PURGE_RATE,
+        max_threads_running=settings.BACKUP_MAX_THREADS_RUNNING,
+        # iowait is sampled on this host, not on the database server.
+        max_iowait=1.0,
+        max_replication_lag=settings.BACKUP_MAX_REPLICATION_LAG,
+        max_pause=settings.BACKUP_MAX_PAUSE)
+    return load, limiter
@@ -0,0 +1,81 @@
+# Copyright 2015 mysqlapi authors. All rights reserved.
+# Use of this source code is governed by a BSD-style
+# license that can be found in the LICENSE file.
+
+import datetime
+import math
+
+from django.db.models import Q
+from django.utils import timezone
+
+# Provisioning of dedicated instances, as (stage, started, finished) fields
+# of Instance. An instance that fails is marked with the stage it failed in.
+STAGES = (
+    ("ec2_boot", "requested_at", "ec2_running_at"),
+    ("authorize", "ec2_running_at", "authorized_at"),
+    ("create_database", "authorized_at", "database_created_at"),
+)
+PERCENTILES = (50, 90, 99)
+
+
+def percentile(values, p):
+    # Nearest rank on sorted values.
+    if not values:
+        return None
+    rank = int(math.ceil(p / 100.0 * len(values)))
+    return values[max(rank, 1) - 1]
+
+
+def summarize(values):
+    values = sorted(values)
+    summary = {"count": len(values), "max": values[-1] if values else None}
+    for p in PERCENTILES:
+        summary["p%d" % p] = percentile(values, p)
+    return summary
+
+
+def seconds(started, finished):
+    if started is None or finished is None:
+        return None
+    return (finished - started).total_seconds()
+
+
+def provisioning(model, days=7, now=None):
+    now = now or timezone.now()
+    fields = ["requested_at", "ready_at", "failed_stage"]
+    fields += [finished for stage, started, finished in STAGES]
+    # Instances that failed to launch never got an EC2 id.
+    rows = model.objects.filter(
+        Q(ec2_id__isnull=False) | Q(failed_stage="ec2_boot"), shared=False,
+        requested_at__gte=now - datetime.timedelta(days=days)).values(*fields)
+    durations = dict((stage, []) for stage, started, finished in STAGES)
+    reached = dict((stage, 0) for stage, started, finished in STAGES)
+    failed = dict((stage, 0) for stage, started, finished in STAGES)
+    to_ready = []
+    for row in rows:
+        for stage, started, finished in STAGES:
+            if row[started] is None:
+                break
+            reached[stage] += 1
+            elapsed = seconds(row[started], row[finished])
+            if elapsed is not None:
+                durations[stage].append(elapsed)
+            elif row["failed_stage"] == stage:
+                failed[stage] += 1
+        elapsed = seconds(row["requested_at"], row["ready_at"])
+        if elapsed is not None:
+            to_ready.append(elapsed)
+    stages = {}
+    for stage, started, finished in STAGES:
+        stages[stage] = summarize(durations[stage])
+        stages[stage]["failed"] = failed[stage]
+        stages[stage]["failure_rate"] = (
+            float(failed[stage]) / reached[stage] if reached[stage] else None)
+    return {
+        "days": days,
+        "requested": len(rows),
+        "ready": len(to_ready),
+        "failed": sum(failed.values()),
+        "time_to_ready": summarize(to_ready),
+        "stages": stages,
+    }
@@ -0,0 +1,164 @@
+# Copyright 2015 mysqlapi authors. All rights reserved.
+# Use of this source code is governed by a BSD-style
+# license that can be found in the LICENSE file.
+
+import hashlib
+import re
+
+from django.conf import settings
+
+from mysqlapi.api.cache import TTLCache
+from mysqlapi.api.snapshot import ordered, quote
+
+# The statements are wrapped like "mysqldump -d --compact" wraps them, so
+# the output can be loaded the same way.
+TABLE = ("/*!40101 SET @saved_cs_client     = @@character_set_client */;\n"
+         "/*!40101 SET character_set_client = utf8 */;\n"
+         "%s;\n"
+         "/*!40101 SET character_set_client = @saved_cs_client */;\n")
+VIEW = ("/*!50001 DROP TABLE IF EXISTS %(name)s*/;\n"
+        "/*!50001 DROP VIEW IF EXISTS %(name)s*/;\n"
+        "/*!50001 CREATE %(algorithm)s*/\n"
+        "%(definer)s"
+        "/*!50001 %(view)s */;\n")
+ROUTINE = ("/*!50003 DROP %(kind)s IF EXISTS %(name)s */;\n"
+           "/*!50003 SET @saved_sql_mode       = @@sql_mode */ ;\n"
+           "/*!50003 SET sql_mode              = '%(sql_mode)s' */ ;\n"
+           "DELIMITER ;;\n"
+           "%(create)s ;;\n"
+           "DELIMITER ;\n"
+           "/*!50003 SET sql_mode              = @saved_sql_mode */ ;\n")
+TRIGGER = ("/*!50003 SET @saved_sql_mode       = @@sql_mode */ ;\n"
+           "/*!50003 SET sql_mode              = '%(sql_mode)s' */ ;\n"
+           "DELIMITER ;;\n"
+           "/*!50003 CREATE*/ %(definer)s/*!50003 %(trigger)s */;;\n"
+           "DELIMITER ;\n"
+           "/*!50003 SET sql_mode              = @saved_sql_mode */ ;\n")
+
+CREATE_VIEW = re.compile(r"^CREATE (ALGORITHM=\S+ )?(DEFINER=\S+ )?"
+                         r"(SQL SECURITY \w+ )?(VIEW .*)$", re.S)
+CREATE_TRIGGER = re.compile(r"^CREATE (DEFINER=\S+ )?(TRIGGER .*)$", re.S)
+
+# Every object of the schema with what changes when it's altered, in a
+# single metadata query. The schema row tells whether the database exists.
+FINGERPRINT = (
+    "SELECT 'schema', schema_name, NULL, NULL, NULL "
+    "FROM information_schema.schemata WHERE schema_name = %s "
+    "UNION ALL "
+    "SELECT 'table', t.table_name, t.create_time, t.update_time, "
+    "COUNT(c.column_name) FROM information_schema.tables t "
+    "LEFT JOIN information_schema.columns c "
+    "ON c.table_schema = t.table_schema AND c.table_name = t.table_name "
+    "WHERE t.table_schema = %s "
+    "GROUP BY t.table_name, t.create_time, t.update_time "
+    "UNION ALL "
+    "SELECT 'view', table_name, NULL, NULL, CRC32(view_definition) "
+    "FROM information_schema.views WHERE table_schema = %s "
+    "UNION ALL "
+    "SELECT 'trigger', trigger_name, created, NULL, CRC32(action_statement) "
+    "FROM information_schema.triggers WHERE trigger_schema = %s "
+    "UNION ALL "
+    "SELECT 'routine', routine_name, created, last_altered, NULL "
+    "FROM information_schema.routines WHERE routine_schema = %s")
+
+_exports = TTLCache(ttl=3600, maxsize=64)
+
+
+class UnknownDatabase(Exception):
+
+    def __init__(self, name):
+        self.args = [u"Unknown database '%s' when selecting the database" %
+                     name]
+
+
+def check(cursor, database):
+    cursor.execute("SELECT 1 FROM information_schema.schemata "
+                   "WHERE schema_name = %s", (database,))
+    if cursor.fetchone() is None:
+        raise UnknownDatabase(database)
+
+
+def fingerprint(cursor, database):
+    cursor.execute(FINGERPRINT, (database,) * 5)
+    rows = sorted(cursor.fetchall())
+    if not any(row[0] == "schema" for row in rows):
+        raise UnknownDatabase(database)
+    return hashlib.md5(repr(rows)).hexdigest()
+
+
+def cached(key):
+    if not settings.EXPORT_CACHE_TTL:
+        return None
+    return _exports.get(key)
+
+
+def caching(key, statements):
+    # Streams statements and caches the whole export once it's complete.
+    parts = []
+    for statement in statements:
+        parts.append(statement)
+        yield statement
+    if settings.EXPORT_CACHE_TTL:
+        _exports.set(key, "".join(parts), ttl=settings.EXPORT_CACHE_TTL)
+
+
+def dump(cursor, database):
+    # Yields the schema of database one object at a time: tables, each
+    # followed by its triggers, then views and stored routines.
+    qualified = quote(database) + ".%s"
+    cursor.execute("SELECT table_name, table_type "
+                   "FROM information_schema.tables WHERE table_schema = %s "
+                   "ORDER BY table_name", (database,))
+    tables = list(cursor.fetchall())
+    triggers = table_triggers(cursor, database)
+    views = []
+    for name, kind in tables:
+        if kind == "VIEW":
+            cursor.execute("SHOW CREATE VIEW " + qualified % quote(name))
+            views.append((name, cursor.fetchone()[1]))
+            continue
+        cursor.execute("SHOW CREATE TABLE " + qualified % quote(name))
+        yield TABLE % cursor.fetchone()[1]
+        for trigger in triggers.get(name, []):
+            cursor.execute("SHOW CREATE TRIGGER " + qualified % quote(trigger))
+            row = cursor.fetchone()
+            yield render_trigger(row[1], row[2])
+    for name, create in ordered(views):
+        yield render_view(name, create)
+    cursor.execute("SELECT routine_name, routine_type "
+                   "FROM information_schema.routines "
+                   "WHERE routine_schema = %s ORDER BY 2, 1", (database,))
+    for name, kind in list(cursor.fetchall()):
+        cursor.execute("SHOW CREATE %s %s" % (kind, qualified % quote(name)))
+        row = cursor.fetchone()
+        yield ROUTINE % {"kind": kind, "name": quote(name),
+                         "sql_mode": row[1], "create": row[2]}
+
+
+def table_triggers(cursor, database):
+    cursor.execute("SHOW TRIGGERS FROM %s" % quote(database))
+    triggers = {}
+    for row in cursor.fetchall():
+        triggers.setdefault(row[2], []).append(row[0])
+    return triggers
+
+
+def render_view(name, create):
+    match = CREATE_VIEW.match(create)
+    if match is None:
+        return TABLE % create
+    algorithm, definer, security, view = match.groups()
+    definer = (definer or "") + (security or "")
+    return VIEW % {"name": quote(name), "algorithm": algorithm or "",
+                   "definer": "/*!50013 %s*/\n" % definer if definer else "",
+                   "view": view}
+
+
+def render_trigger(sql_mode, create):
+    match = CREATE_TRIGGER.match(create)
+    if match is None:
+        return "DELIMITER ;;\n%s;;\nDELIMITER ;\n" % create
+    definer, trigger = match.groups()
+    return TRIGGER % {"sql_mode": sql_mode, "trigger": trigger,
+                      "definer": "/*!50017 %s*/ " % definer.strip()
+                      if definer else ""}
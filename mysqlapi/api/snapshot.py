@@ -0,0 +1,330 @@
+# Copyright 2015 mysqlapi authors. All rights reserved.
+# Use of this source code is governed by a BSD-style
+# license that can be found in the LICENSE file.
+
+import Queue
+import collections
+import contextlib
+import tempfile
+
+from multiprocessing.pool import ThreadPool
+
+import MySQLdb
+import MySQLdb.cursors
+
+SYSTEM_DATABASES = ("information_schema", "performance_schema", "mysql",
+                    "sys")
+# Accounts the server creates for itself.
+SYSTEM_USERS = ("mysql.sys", "mysql.session", "mysql.infoschema")
+# Rows are grouped in extended INSERTs of about this many bytes, like
+# mysqldump does with its default net_buffer_length.
+INSERT_SIZE = 1024 * 1024
+
+HEADER = ("SET NAMES utf8;\n"
+          "SET @OLD_FOREIGN_KEY_CHECKS=@@FOREIGN_KEY_CHECKS;\n"
+          "SET FOREIGN_KEY_CHECKS=0;\n")
+FOOTER = "SET FOREIGN_KEY_CHECKS=@OLD_FOREIGN_KEY_CHECKS;\n"
+ROUTINE = ("USE %(database)s;\n"
+           "SET @saved_sql_mode = @@sql_mode, "
+           "@saved_time_zone = @@time_zone;\n"
+           "SET sql_mode = '%(sql_mode)s', time_zone = '%(time_zone)s';\n"
+           "DROP %(kind)s IF EXISTS %(name)s;\n"
+           "DELIMITER ;;\n%(create)s;;\nDELIMITER ;\n"
+           "SET sql_mode = @saved_sql_mode, time_zone = @saved_time_zone;\n")
+
+
+def quote(name):
+    return "`%s`" % name.replace("`", "``")
+
+
+def qualified(table):
+    return "%s.%s" % (quote(table[0]), quote(table[1]))
+
+
+def ordered(views, mention=quote):
+    # A view may select from other views, so those go first. Views are
+    # taken in name order otherwise, and left as is if they refer to each
+    # other in a cycle. mention(name) is how the others refer to a view.
+    pending = list(views)
+    result = []
+    while pending:
+        for i, (name, create) in enumerate(pending):
+            if not any(mention(other) in create
+                       for other, _ in pending if other != name):
+                result.append(pending.pop(i))
+                break
+        else:
+            result.extend(pending)
+            break
+    return result
+
+
+def connect(host="localhost", user="root", password=""):
+    return MySQLdb.connect(host, user, password, charset="utf8",
+                           use_unicode=False)
+
+
+class SnapshotDump(object):
+
+    def __init__(self, connect=connect, workers=4, lock_timeout=10,
+                 throttle=None):
+        self.connect = connect
+        self.workers = workers
+        self.lock_timeout = lock_timeout
+        self.throttle = throttle
+        self.binlog = None
+        self.databases = []
+        self._conns = Queue.Queue()
+
+    def begin(self):
+        # Every worker starts its transaction while the global read lock is
+        # held, so they all see the same snapshot, which is also the one at
+        # the recorded binlog position. The lock is released right after,
+        # before any data is read. Waiting for the lock stalls writes
+        # queued behind it, so it gives up after lock_timeout seconds.
+        coordinator = self.connect()
+        cursor = coordinator.cursor()
+        try:
+            cursor.execute("SET SESSION lock_wait_timeout = %d" %
+                           self.lock_timeout)
+            cursor.execute("FLUSH TABLES")
+            cursor.execute("FLUSH TABLES WITH READ LOCK")
+            try:
+                for i in xrange(self.workers):
+                    conn = self.connect()
+                    worker = conn.cursor()
+                    worker.execute("SET SESSION TRANSACTION ISOLATION "
+                                   "LEVEL REPEATABLE READ")
+                    if self.throttle is not None:
+                        # Rows are read slower than the server sends them,
+                        # which it gives up on after net_write_timeout.
+                        worker.execute("SET SESSION net_write_timeout = %d"
+                                       % (self.throttle.max_pause + 60))
+                    worker.execute("START TRANSACTION WITH CONSISTENT "
+                                   "SNAPSHOT")
+                    self._conns.put(conn)
+                cursor.execute("SHOW MASTER STATUS")
+                row = cursor.fetchone()
+                if row:
+                    self.binlog = {"binlog_file": row[0],
+                                   "binlog_position": int(row[1])}
+            finally:
+                cursor.execute("UNLOCK TABLES")
+        finally:
+            coordinator.close()
+
+    def end(self):
+        while not self._conns.empty():
+            conn = self._conns.get()
+            try:
+                conn.close()
+            except MySQLdb.Error:
+                pass
+
+    @contextlib.contextmanager
+    def connection(self):
+        # A worker connection, reading from the snapshot.
+        conn = self._conns.get()
+        try:
+            yield conn
+        finally:
+            self._conns.put(conn)
+
+    def query(self, sql, args=None):
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(sql, args)
+            return list(cursor.fetchall())
+
+    def schemas(self):
+        excluded = ", ".join(["%s"] * len(SYSTEM_DATABASES))
+        rows = self.query("SELECT schema_name FROM information_schema."
+                          "schemata WHERE schema_name NOT IN (%s) "
+                          "ORDER BY 1" % excluded, SYSTEM_DATABASES)
+        return [row[0] for row in rows]
+
+    def tables(self):
+        excluded = ", ".join(["%s"] * len(SYSTEM_DATABASES))
+        rows = self.query("SELECT table_schema, table_name, table_type "
+                          "FROM information_schema.tables "
+                          "WHERE table_schema NOT IN (%s) "
+                          "ORDER BY 1, 2" % excluded, SYSTEM_DATABASES)
+        # The snapshot keeps InnoDB from purging the old versions of every
+        # row changed while the dump runs, and reading a busy table late
+        # means walking longer undo chains, so the busiest tables go first.
+        # Views may select from any table, so they come last, after the
+        # views they select from.
+        writes = self.change_rates()
+        tables = sorted([t for t in rows if t[2] != "VIEW"],
+                        key=lambda t: -writes.get(t[:2], 0))
+        views = [(t[:2],
+                  self.query("SHOW CREATE VIEW %s" % qualified(t))[0][1])
+                 for t in rows if t[2] == "VIEW"]
+        return tables + [view + ("VIEW",)
+                         for view, create in ordered(views, qualified)]
+
+    def change_rates(self):
+        # Writes per table since the server started, when performance_schema
+        # is enabled.
+        try:
+            rows = self.query("SELECT object_schema, object_name, "
+                              "count_insert + count_update + count_delete "
+                              "FROM performance_schema."
+                              "table_io_waits_summary_by_table "
+                              "WHERE object_type = 'TABLE'")
+        except MySQLdb.Error:
+            return {}
+        return dict(((row[0], row[1]), int(row[2])) for row in rows)
+
+    def routines(self):
+        # Stored procedures, functions and events live in the mysql schema,
+        # which isn't dumped, so they are recreated from their definitions.
+        excluded = ", ".join(["%s"] * len(SYSTEM_DATABASES))
+        rows = self.query("SELECT routine_schema, routine_type, "
+                          "routine_name FROM information_schema.routines "
+                          "WHERE routine_schema NOT IN (%s) "
+                          "ORDER BY 1, 2, 3" % excluded, SYSTEM_DATABASES)
+        rows += self.query("SELECT event_schema, 'EVENT', event_name "
+                           "FROM information_schema.events "
+                           "WHERE event_schema NOT IN (%s) "
+                           "ORDER BY 1, 3" % excluded, SYSTEM_DATABASES)
+        for database, kind, name in rows:
+            row = self.query("SHOW CREATE %s %s.%s" % (
+                kind, quote(database), quote(name)))[0]
+            if kind == "EVENT":
+                sql_mode, time_zone, create = row[1:4]
+            else:
+                sql_mode, time_zone, create = row[1], "SYSTEM", row[2]
+            yield ROUTINE % {"database": quote(database), "kind": kind,
+                             "name": quote(name), "sql_mode": sql_mode,
+                             "time_zone": time_zone, "create": create}
+
+    def accounts(self):
+        # Users and their grants, last so that grants on routines find
+        # them. Existing users are left alone, and grants only add up.
+        excluded = ", ".join(["%s"] * len(SYSTEM_USERS))
+        users = self.query("SELECT user, host FROM mysql.user "
+                           "WHERE user NOT IN (%s) ORDER BY 1, 2" % excluded,
+                           SYSTEM_USERS)
+        for user, host in users:
+            try:
+                create = self.query("SHOW CREATE USER %s@%s",
+                                    (user, host))[0][0]
+            except MySQLdb.Error:
+                # Before 5.7 the grants create the user, password included.
+                create = None
+            if create is not None:
+                yield "%s;\n" % create.replace(
+                    "CREATE USER ", "CREATE USER IF NOT EXISTS ", 1)
+            for row in self.query("SHOW GRANTS FOR %s@%s", (user, host)):
+                yield "%s;\n" % row[0]
+
+    def dump_table(self, table):
+        database, name, kind = table
+        conn = self._conns.get()
+        out = tempfile.TemporaryFile()
+        try:
+            cursor = conn.cursor()
+            qualified = "%s.%s" % (quote(database), quote(name))
+            out.write("USE %s;\n" % quote(database))
+            if kind == "VIEW":
+                cursor.execute("SHOW CREATE VIEW %s" % qualified)
+                out.write("DROP VIEW IF EXISTS %s;\n%s;\n" % (
+                    quote(name), cursor.fetchone()[1]))
+            else:
+                cursor.execute("SHOW CREATE TABLE %s" % qualified)
+                out.write("DROP TABLE IF EXISTS %s;\n%s;\n" % (
+                    quote(name), cursor.fetchone()[1]))
+                # Load pauses happen between tables, while no result set
+                # is open on the connection.
+                if self.throttle is not None:
+                    self.throttle.pause()
+                self.dump_rows(conn, qualified, quote(name), out)
+                self.dump_triggers(conn, database, name, out)
+            out.seek(0)
+            return out
+        except Exception:
+            out.close()
+            raise
+        finally:
+            self._conns.put(conn)
+
+    def dump_rows(self, conn, qualified, name, out):
+        # An unbuffered cursor streams the rows instead of loading the whole
+        # table in memory.
+        cursor = conn.cursor(MySQLdb.cursors.SSCursor)
+        try:
+            cursor.execute("SELECT * FROM %s" % qualified)
+            values = []
+            size = 0
+            for row in cursor:
+                value = "(%s)" % ",".join(conn.literal(v) for v in row)
+                values.append(value)
+                size += len(value)
+                if size >= INSERT_SIZE:
+                    self.write_insert(name, values, size, out)
+                    values = []
+                    size = 0
+            if values:
+                self.write_insert(name, values, size, out)
+        finally:
+            cursor.close()
+
+    def write_insert(self, name, values, size, out):
+        if self.throttle is not None:
+            self.throttle.reserve(size)
+        out.write("INSERT INTO %s VALUES %s;\n" % (name, ",".join(values)))
+
+    def dump_triggers(self, conn, database, name, out):
+        cursor = conn.cursor()
+        cursor.execute("SHOW TRIGGERS FROM %s LIKE %%s" % quote(database),
+                       (name,))
+        # LIKE treats "_" as a wildcard, so the table is checked again.
+        triggers = [row[0] for row in cursor.fetchall() if row[2] == name]
+        for trigger in triggers:
+            cursor.execute("SHOW CREATE TRIGGER %s.%s" % (quote(database),
+                                                          quote(trigger)))
+            out.write("DELIMITER ;;\n%s;;\nDELIMITER ;\n" %
+                      cursor.fetchone()[2])
+
+    def stream(self):
+        # Tables are dumped by the workers in parallel into temporary files
+        # and streamed in the order they were scheduled. At most 2 * workers
+        # dumped tables wait to be streamed.
+        pool = ThreadPool(self.workers)
+        try:
+            self.begin()
+            self.databases = self.schemas()
+            yield HEADER
+            for database in self.databases:
+                row = self.query("SHOW CREATE DATABASE IF NOT EXISTS %s" %
+                                 quote(database))[0]
+                yield "%s;\n" % row[1]
+            pending = collections.deque()
+            for table in self.tables():
+                pending.append(pool.apply_async(self.dump_table, (table,)))
+                if len(pending) >= 2 * self.workers:
+                    for line in self._drain(pending.popleft()):
+                        yield line
+            while pending:
+                for line in self._drain(pending.popleft()):
+                    yield line
+            for statement in self.routines():
+                yield statement
+            for statement in self.accounts():
+                yield statement
+            yield FOOTER
+        finally:
+            pool.terminate()
+            pool.join()
+            self.end()
+
+    def _drain(self, result):
+        with result.get() as dumped:
+            for line in dumped:
+                yield line
+
+    def meta(self):
+        meta = {"engine": "snapshot"}
+        meta.update(self.binlog or {})
+        return meta
@@ -56,3 +56,76 @@ class MultipleFailureEC2Client(FakeEC2Client):
             self.failures += 1
             return False
         return super(MultipleFailureEC2Client, self).get(instance)
+
+
+class FakeCursor(object):
+    # Answers each query with the rows of the longest prefix of it found in
+    # rows, or with default, and raises the errors given the same way.
+    # Queries are logged, and their args kept in params, on the connection.
+
+    def __init__(self, rows, connection=None, default=(), errors=None):
+        self.rows = rows
+        self.connection = connection
+        self.default = default
+        self.errors = errors or {}
+        self.log = connection.log if connection is not None else []
+        self.params = connection.params if connection is not None else []
+        self.result = []
+
+    def _match(self, table, sql):
+        prefixes = [p for p in table if sql.startswith(p)]
+        return max(prefixes, key=len) if prefixes else None
+
+    def execute(self, sql, args=None):
+        self.log.append(sql)
+        self.params.append(args)
+        if self.connection is not None and \
+                self.connection.history is not None:
+            self.connection.history.append((self.connection, sql))
+        error = self._match(self.errors, sql)
+        if error is not None:
+            raise self.errors[error]
+        prefix = self._match(self.rows, sql)
+        self.result = list(self.rows[prefix] if prefix is not None
+                           else self.default)
+
+    def fetchone(self):
+        return self.result[0] if self.result else None
+
+    def fetchall(self):
+        return self.result
+
+    def __iter__(self):
+        return iter(self.result)
+
+    def close(self):
+        pass
+
+
+class FakeConnection(object):
+    # Every cursor answers from rows. history, when given, is shared by
+    # several connections to record the order of their queries.
+
+    def __init__(self, rows, history=None, errors=None):
+        self.rows = rows
+        self.history = history
+        self.errors = errors
+        self.log = []
+        self.params = []
+        self.committed = False
+        self.closed = False
+
+    def open(self):
+        pass
+
+    def cursor(self, cursorclass=None):
+        return FakeCursor(self.rows, self, errors=self.errors)
+
+    def literal(self, value):
+        return "NULL" if value is None else repr(value)
+
+    def commit(self):
+        self.committed = True
+
+    def close(self):
+        self.closed = True
@@ -0,0 +1,56 @@
+# Copyright 2015 mysqlapi authors. All rights reserved.
+# Use of this source code is governed by a BSD-style
+# license that can be found in the LICENSE file.
+
+import random
+
+from unittest import TestCase
+
+from mysqlapi.api import backup
+
+
+class SplitTestCase(TestCase):
+
+    def dump(self, rows):
+        return "".join("INSERT INTO t VALUES (%d, 'row %d');\n" % (i, i)
+                       for i in rows)
+
+    def test_split_keeps_the_data(self):
+        data = self.dump(range(5000))
+        chunks = list(backup.split(data, min_size=1024, max_size=8192))
+        self.assertTrue(len(chunks) > 1)
+        self.assertEqual(data, "".join(chunks))
+        for chunk in chunks:
+            self.assertTrue(chunk.endswith("\n"))
+
+    def test_split_respects_max_size(self):
+        data = self.dump(range(5000))
+        for chunk in backup.split(data, min_size=1024, max_size=4096,
+                                  mask=0xffffffff):
+            self.assertTrue(len(chunk) < 4096 + 64)
+
+    def test_split_resynchronizes_after_a_change(self):
+        rows = range(20000)
+        before = set(backup.split(self.dump(rows), min_size=2048))
+        changed = list(rows)
+        changed[random.Random(42).randint(5000, 15000)] = -1
+        after = list(backup.split(self.dump(changed), min_size=2048))
+        new = [c for c in after if c not in before]
+        self.assertTrue(0 < len(new) <= 2)
+
+    def test_split_accepts_iterables(self):
+        data = ["a\n", "b\n"]
+        self.assertEqual(["a\nb\n"], list(backup.split(iter(data))))
+
+
+class PackTestCase(TestCase):
+
+    def test_pack_and_unpack(self):
+        chunk = "CREATE TABLE foo (id int);\n" * 100
+        packed = backup.pack(chunk)
+        self.assertTrue(len(packed) < len(chunk))
+        self.assertEqual(chunk, backup.unpack(backup.address(chunk), packed))
+
+    def test_unpack_verifies_the_address(self):
+        with self.assertRaises(backup.ChecksumMismatch):
+            backup.unpack(backup.address("other"), backup.pack("chunk"))
@@ -0,0 +1,128 @@
+# Copyright 2015 mysqlapi authors. All rights reserved.
+# Use of this source code is governed by a BSD-style
+# license that can be found in the LICENSE file.
+
+import json
+import StringIO
+
+from django.test import TestCase
+from django.test.client import RequestFactory
+
+from mysqlapi.api import bulk
+from mysqlapi.api.models import DatabaseManager, Instance
+from mysqlapi.api.views import Import
+
+import mock
+
+
+class FakeConnection(object):
+
+    def __init__(self):
+        self.statements = []
+        self.commits = 0
+
+    def cursor(self):
+        cursor = mock.Mock()
+        cursor.connection = self
+        cursor.execute.side_effect = self.statements.append
+        return cursor
+
+    def literal(self, value):
+        return "'%s'" % value
+
+    def commit(self):
+        self.commits += 1
+
+
+class InsertTestCase(TestCase):
+
+    def test_rows_are_inserted_in_batches(self):
+        conn = FakeConnection()
+        rows = bulk.rows(StringIO.StringIO("1,bob\n2,\\N\n\n3,\"a,b\"\n"),
+                         "csv")
+        with mock.patch("mysqlapi.api.snapshot.INSERT_SIZE", 20):
+            count = bulk.insert(conn, "app", "users", rows, ["id", "name"])
+        self.assertEqual(3, count)
+        self.assertEqual([
+            "INSERT INTO `app`.`users` (`id`,`name`) VALUES ('1','bob'),"
+            "('2',NULL)",
+            "INSERT INTO `app`.`users` (`id`,`name`) VALUES ('3','a,b')",
+        ], conn.statements)
+        self.assertEqual(2, conn.commits)
+
+    def test_tsv(self):
+        rows = bulk.rows(StringIO.StringIO('1\t"bob"\t\\N\n'), "tsv")
+        self.assertEqual([["1", '"bob"', "\\N"]], list(rows))
+
+
+class LoadTestCase(TestCase):
+
+    def setUp(self):
+        self.db = DatabaseManager("app")
+
+    def test_csv_with_header(self):
+        upload = StringIO.StringIO("id,name\n1,bob\n")
+        with mock.patch.object(self.db, "conn") as conn, \
+                mock.patch("mysqlapi.api.bulk.insert") as insert:
+            insert.return_value = 1
+            result = bulk.load(self.db, upload, "csv", "users", header=True)
+        self.assertEqual(1, result["rows"])
+        self.assertIn("rows_per_second", result)
+        args = insert.call_args[0]
+        self.assertEqual(("app", "users"), args[1:3])
+        self.assertEqual(["id", "name"], args[4])
+        conn.close.assert_called_once_with()
+
+    def test_sql_is_piped_to_the_client_as_the_instance_user(self):
+        loaded = []
+        upload = StringIO.StringIO("INSERT INTO t VALUES (1);\n")
+        with mock.patch.object(self.db, "create_user") as create_user, \
+                mock.patch("mysqlapi.api.database.pipe") as pipe:
+            create_user.return_value = ("app", "secret")
+            pipe.side_effect = lambda cmd, chunks, env: loaded.extend(chunks)
+            result = bulk.load(self.db, upload, "sql")
+        create_user.assert_called_once_with("app", None)
+        cmd, chunks, env = pipe.call_args[0]
+        self.assertEqual("app", cmd[cmd.index("-u") + 1])
+        self.assertEqual("app", cmd[-1])
+        self.assertEqual("secret", env["MYSQL_PWD"])
+        self.assertEqual(["INSERT INTO t VALUES (1);\n"], loaded)
+        self.assertEqual(26, result["bytes"])
+
+    def test_invalid_imports(self):
+        with self.assertRaises(bulk.InvalidImport):
+            bulk.load(self.db, StringIO.StringIO(""), "xls")
+        with self.assertRaises(bulk.InvalidImport):
+            bulk.load(self.db, StringIO.StringIO(""), "csv")
+
+
+class ImportViewTestCase(TestCase):
+
+    def setUp(self):
+        Instance.objects.create(name="app", state="running", shared=True)
+
+    def post(self, name, path, data=""):
+        request = RequestFactory().post(path, data, content_type="text/csv")
+        return Import.as_view()(request, name=name)
+
+    def test_import_streams_the_request_body(self):
+        def load(db, upload, format, table, header):
+            self.assertEqual(("app", "csv", "users", True),
+                             (db.name, format, table, header))
+            self.assertEqual(["1,bob\n"], list(upload))
+            return {"rows": 1}
+        with mock.patch("mysqlapi.api.bulk.load") as load_mock:
+            load_mock.side_effect = load
+            response = self.post("app", "/resources/app/import?table=users"
+                                 "&header=1", "1,bob\n")
+        self.assertEqual(200, response.status_code)
+        self.assertEqual({"rows": 1}, json.loads(response.content))
+
+    def test_import_errors(self):
+        response = self.post("other", "/resources/other/import")
+        self.assertEqual(404, response.status_code)
+        response = self.post("app", "/resources/app/import?format=xls")
+        self.assertEqual(400, response.status_code)
+        Instance.objects.create(name="booting", state="pending")
+        response = self.post("booting", "/resources/booting/import")
+        self.assertEqual(412, response.status_code)
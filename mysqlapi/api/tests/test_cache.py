@@ -0,0 +1,33 @@
+# Copyright 2015 mysqlapi authors. All rights reserved.
+# Use of this source code is governed by a BSD-style
+# license that can be found in the LICENSE file.
+
+from unittest import TestCase
+
+from mysqlapi.api.cache import memoize
+
+
+class MemoizeTestCase(TestCase):
+
+    def test_memoize_calls_the_function_once_per_arguments(self):
+        calls = []
+
+        @memoize()
+        def double(x):
+            calls.append(x)
+            return x * 2
+
+        self.assertEqual(4, double(2))
+        self.assertEqual(4, double(2))
+        self.assertEqual(6, double(3))
+        self.assertEqual([2, 3], calls)
+
+    def test_memoize_is_bounded(self):
+        @memoize(maxsize=2)
+        def identity(x):
+            return x
+
+        for i in range(5):
+            identity(i)
+        self.assertLessEqual(len(identity.cache), 2)
+        self.assertIn((4,), identity.cache)
@@ -0,0 +1,109 @@
+# Copyright 2015 mysqlapi authors. All rights reserved.
+# Use of this source code is governed by a BSD-style
+# license that can be found in the LICENSE file.
+
+import threading
+
+from unittest import TestCase
+
+from mysqlapi.api import clone
+from mysqlapi.api.models import DatabaseManager
+from mysqlapi.api.tests import mocks
+
+import mock
+
+ROWS = {
+    "SELECT table_name": [("big", "BASE TABLE", 2048L),
+                          ("small", "BASE TABLE", 16L),
+                          ("recent", "VIEW", None)],
+    "SHOW CREATE VIEW `prod`.`recent`": [
+        ("recent", "CREATE VIEW `recent` AS select * from `prod`.`big`")],
+    "SHOW TRIGGERS FROM `prod`": [("audit", "INSERT", "big")],
+    "SHOW CREATE TRIGGER `prod`.`audit`": [
+        ("audit", "", "CREATE TRIGGER audit BEFORE INSERT ON big "
+                      "FOR EACH ROW SET NEW.id = 1")],
+    "SELECT routine_name": [("touch", "PROCEDURE")],
+    "SHOW CREATE PROCEDURE `prod`.`touch`": [
+        ("touch", "", "CREATE PROCEDURE `touch`() SELECT 1")],
+    "SELECT * FROM `prod`.`big`": [(1, "bob"), (2, None)],
+}
+
+
+class Connections(list):
+    lock = threading.Lock()
+
+
+class CloneTestCase(TestCase):
+
+    def setUp(self):
+        self.errors = {}
+        self.connections = Connections()
+        patcher = mock.patch(
+            "mysqlapi.api.clone.Connection",
+            lambda *args: self.connect(self.connections, *args))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.servers = Connections()
+        patcher = mock.patch(
+            "mysqlapi.api.clone.server",
+            lambda db: self.connect(self.servers, db.name))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.source = DatabaseManager("prod", host="10.0.0.1", user="admin",
+                                      password="secret")
+        self.target = DatabaseManager("preview", host="10.0.0.1",
+                                      user="admin", password="secret")
+
+    def connect(self, connections, *args):
+        conn = mocks.FakeConnection(ROWS, errors=self.errors)
+        conn.args = args
+        with connections.lock:
+            connections.append(conn)
+        return conn
+
+    def test_same_server(self):
+        self.assertTrue(clone.same_server(self.source, self.target))
+        other = DatabaseManager("preview", host="10.0.0.2")
+        self.assertFalse(clone.same_server(self.source, other))
+
+    def test_copy_tables_in_parallel_from_a_snapshot(self):
+        progress = mock.Mock()
+        done = clone.copy(self.source, self.target, progress, workers=2)
+        self.assertEqual(2064, done)
+        self.assertEqual(2064, progress.call_args[0][0])
+        self.assertEqual(2, progress.call_count)
+        self.assertEqual(1, len(self.connections))
+        self.assertEqual("preview", self.connections[0].args[-1])
+        self.assertTrue(all(c.closed for c in self.connections))
+        self.assertTrue(all(c.closed for c in self.servers))
+        # A coordinator and two snapshot readers on the source, and a
+        # writer for each table on the target.
+        readers = [c for c in self.servers if c.args == ("prod",)]
+        writers = [c for c in self.servers if c.args == ("preview",)]
+        self.assertEqual(3, len(readers))
+        self.assertEqual(2, len(writers))
+        self.assertIn("FLUSH TABLES WITH READ LOCK", readers[0].log)
+        for reader in readers[1:]:
+            self.assertIn("START TRANSACTION WITH CONSISTENT SNAPSHOT",
+                          reader.log)
+        reads = sum([r.log for r in readers[1:]], [])
+        self.assertIn("SELECT * FROM `prod`.`big`", reads)
+        big = [w for w in writers if "big" in w.log[1]][0]
+        self.assertEqual(["SET SESSION foreign_key_checks = 0",
+                          "CREATE TABLE `preview`.`big` LIKE `prod`.`big`",
+                          "INSERT INTO `preview`.`big` VALUES "
+                          "(1,'bob'),(2,NULL)"], big.log)
+        self.assertTrue(big.committed)
+        log = self.connections[0].log
+        self.assertIn("CREATE VIEW `recent` AS select * from `preview`.`big`",
+                      log)
+        self.assertIn("CREATE TRIGGER audit BEFORE INSERT ON big "
+                      "FOR EACH ROW SET NEW.id = 1", log)
+        self.assertEqual("CREATE PROCEDURE `touch`() SELECT 1", log[-1])
+
+    def test_snapshot_is_released_on_errors(self):
+        self.errors["CREATE TABLE"] = Exception("Disk full")
+        with self.assertRaises(Exception):
+            clone.copy(self.source, self.target, workers=1)
+        self.assertTrue(all(c.closed for c in self.servers))
+        self.assertFalse(any(c.committed for c in self.servers))
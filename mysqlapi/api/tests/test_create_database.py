@@ -142,6 +142,14 @@ class CreateDatabaseViewTestCase(unittest.TestCase):
         with self.assertRaises(DatabaseCreationError) as e:
             create_database(instance, ec2_client)
         self.assertEqual(u"Failed to create EC2 instance.", e.exception[1])
+        failed = Instance.objects.get(name="seven_cities")
+        self.assertEqual("error", failed.state)
+        self.assertEqual("ec2_boot", failed.failed_stage)
+        with self.assertRaises(DatabaseCreationError):
+            create_database(Instance(name="seven_cities"), ec2_client)
+        self.assertEqual(1, Instance.objects.filter(
+            name="seven_cities").count())
+        Instance.objects.filter(name="seven_cities").delete()
 
     def test_create_database_terminates_the_instance_when_cant_create_db(self):
         exc_msg = u"I've failed to create your database, sorry! :("
@@ -370,3 +378,15 @@ class CreateDatabaseFunctionTestCase(unittest.TestCase):
         instance = Instance(name="mysql")
         with self.assertRaises(InvalidInstanceName):
             create_database(instance)
+
+
+class CreateDatabaseClientTestCase(unittest.TestCase):
+
+    def test_ec2_client_is_built_only_when_used(self):
+        view = CreateDatabase()
+        self.assertIsNone(view._client)
+        with mock.patch("crane_ec2.Client") as Client:
+            client = view.client
+            self.assertIs(Client.return_value, client)
+            self.assertIs(client, view.client)
+            Client.assert_called_once_with()
@@ -0,0 +1,273 @@
+# Copyright 2015 mysqlapi authors. All rights reserved.
+# Use of this source code is governed by a BSD-style
+# license that can be found in the LICENSE file.
+
+import datetime
+
+from unittest import TestCase
+
+from django.test import TestCase as DjangoTestCase
+from django.test.client import RequestFactory
+from django.test.utils import override_settings
+from django.utils import timezone
+
+from mysqlapi.api import creator
+from mysqlapi.api.models import Instance
+from mysqlapi.api.views import ec2_event
+
+import mock
+
+
+class InstanceQueueTestCase(TestCase):
+
+    def test_put_marks_the_instance_as_known_until_done(self):
+        queue = creator.InstanceQueue()
+        instance = Instance(pk=10, name="aurora")
+        queue.put(instance)
+        self.assertIn(instance, queue)
+        self.assertIs(instance, queue.get(timeout=1))
+        self.assertIn(instance, queue)
+        queue.done(instance)
+        self.assertNotIn(instance, queue)
+
+    def test_drain(self):
+        queue = creator.InstanceQueue()
+        first, second = Instance(pk=1), Instance(pk=2)
+        queue.put(first)
+        queue.put(second)
+        self.assertEqual([first, second], queue.drain())
+        self.assertEqual([], queue.drain())
+
+
+class BuildQueueTestCase(TestCase):
+
+    def setUp(self):
+        self.addCleanup(creator.set_model, creator.model_class)
+
+    def test_build_queue_skips_instances_already_queued(self):
+        queued = Instance(pk=1, name="queued")
+        fresh = Instance(pk=2, name="fresh")
+        model = mock.Mock()
+        model.objects.filter.return_value = [queued, fresh]
+        creator.set_model(model)
+        queue = creator.InstanceQueue()
+        queue.put(queued)
+        with mock.patch("mysqlapi.api.creator._instance_queue", queue):
+            creator.build_queue()
+        self.assertIs(queued, queue.get(timeout=1))
+        self.assertIs(fresh, queue.get(timeout=1))
+        self.assertTrue(queue._queue.empty())
+        model.objects.filter.assert_called_with(state="pending", shared=False)
+
+
+class DatabaseCreatorTestCase(DjangoTestCase):
+
+    def setUp(self):
+        self.queue = creator.InstanceQueue()
+        patcher = mock.patch("mysqlapi.api.creator._instance_queue",
+                             self.queue)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        patcher = mock.patch("mysqlapi.api.creator.connection")
+        self.connection = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(creator.set_model, creator.model_class)
+        creator.set_model(Instance)
+        self.instance = Instance.objects.create(
+            name="aurora", host="10.0.0.1", ec2_id="i-1", state="pending",
+            requested_at=timezone.now())
+        self.queue.put(self.instance)
+        self.client = mock.Mock()
+        self.manager = mock.Mock()
+        self.source = mock.Mock()
+        self.source.ready.side_effect = lambda instances: instances
+
+    def run_creator(self):
+        creator.DatabaseCreator(self.manager, self.client,
+                                sources=[self.source], interval=0.01).run()
+        self.assertNotIn(self.instance, self.queue)
+
+    def test_records_provisioning_stages(self):
+        self.manager.return_value.create_database.side_effect = \
+            lambda: self.queue.close()
+        self.run_creator()
+        instance = self.instance
+        self.assertTrue(instance.ec2_running_at <= instance.authorized_at <=
+                        instance.database_created_at)
+        self.assertEqual(instance.database_created_at, instance.ready_at)
+        saved = Instance.objects.get(pk=instance.pk)
+        self.assertEqual("running", saved.state)
+        self.assertEqual(instance.ready_at, saved.ready_at)
+        self.assertEqual(instance.authorized_at, saved.authorized_at)
+
+    def test_records_failed_stage(self):
+        self.client.authorize.side_effect = lambda i: self.queue.close()
+        self.run_creator()
+        saved = Instance.objects.get(pk=self.instance.pk)
+        self.assertEqual(("error", "authorize"),
+                         (saved.state, saved.failed_stage))
+
+    def test_waits_for_the_instance_to_be_ready(self):
+        answers = [[], [self.instance]]
+        self.source.ready.side_effect = lambda instances: answers.pop(0)
+        self.manager.return_value.create_database.side_effect = \
+            lambda: self.queue.close()
+        self.run_creator()
+        self.assertEqual(2, self.source.ready.call_count)
+        self.assertIsNotNone(self.instance.ready_at)
+
+    @override_settings(EC2_BOOT_TIMEOUT=60)
+    def test_instances_that_never_boot_fail_in_ec2_boot(self):
+        self.instance.requested_at -= datetime.timedelta(seconds=61)
+        self.instance.save()
+        self.source.ready.side_effect = lambda instances: []
+        self.client.terminate.side_effect = lambda i: self.queue.close()
+        self.run_creator()
+        self.assertEqual("ec2_boot", self.instance.failed_stage)
+        self.assertEqual("error", self.instance.state)
+        self.assertEqual(u"EC2 instance didn't start in 60 seconds.",
+                         self.instance.reason)
+        self.client.terminate.assert_called_once_with(self.instance)
+        self.assertFalse(self.manager.called)
+        saved = Instance.objects.get(pk=self.instance.pk)
+        self.assertEqual("error", saved.state)
+
+    @override_settings(EC2_BOOT_TIMEOUT=60)
+    def test_dropped_instances_are_not_saved_again(self):
+        self.instance.requested_at -= datetime.timedelta(seconds=61)
+        self.instance.save()
+        self.source.ready.side_effect = lambda instances: []
+        # DropDatabase terminates the machine and deletes the row while the
+        # creator still holds the instance.
+        Instance.objects.filter(pk=self.instance.pk).delete()
+        pending = {}
+        creator.DatabaseCreator(self.manager, self.client,
+                                sources=[self.source]).run_once(pending)
+        self.assertEqual({}, pending)
+        self.assertFalse(Instance.objects.filter(name="aurora").exists())
+        self.assertFalse(self.client.terminate.called)
+        self.assertFalse(self.client.unauthorize.called)
+
+    def test_instances_dropped_while_created_are_not_saved_again(self):
+        def create_database():
+            Instance.objects.filter(pk=self.instance.pk).delete()
+            self.queue.close()
+        self.manager.return_value.create_database.side_effect = \
+            create_database
+        self.run_creator()
+        self.assertFalse(Instance.objects.filter(name="aurora").exists())
+
+    def test_unexpected_errors_are_retried_on_the_next_round(self):
+        self.client.authorize.side_effect = iter(
+            [Exception("EC2 is down"), True])
+        self.manager.return_value.create_database.side_effect = \
+            lambda: self.queue.close()
+        with mock.patch("sys.stderr"):
+            self.run_creator()
+        self.assertEqual(2, self.client.authorize.call_count)
+        self.assertIsNotNone(self.instance.ready_at)
+        self.assertEqual(2, self.connection.close.call_count)
+
+    def test_later_sources_only_get_instances_not_ready_yet(self):
+        other = mock.Mock(pk=2)
+        first = mock.Mock()
+        first.ready.return_value = [self.instance]
+        second = mock.Mock()
+        second.ready.return_value = []
+        c = creator.DatabaseCreator(self.manager, self.client,
+                                    sources=[first, second])
+        self.assertEqual([self.instance], c.ready([self.instance, other]))
+        second.ready.assert_called_once_with([other])
+
+
+class Reservation(object):
+
+    def __init__(self, *instances):
+        self.instances = instances
+
+
+class PollerTestCase(TestCase):
+
+    def ec2_instance(self, id, ip, private_ip="10.0.0.9", state="running"):
+        return mock.Mock(id=id, ip_address=ip, private_ip_address=private_ip,
+                         state=state)
+
+    def test_one_describe_call_for_all_pending_instances(self):
+        client = mock.Mock()
+        client.ec2_conn.get_all_instances.return_value = [
+            Reservation(self.ec2_instance("i-1", "54.0.0.1")),
+            Reservation(self.ec2_instance("i-2", "10.0.0.9"),
+                        self.ec2_instance("i-9", "54.0.0.9"))]
+        booting = Instance(pk=2, ec2_id="i-2")
+        running = Instance(pk=1, ec2_id="i-1")
+        poller = creator.Poller(client, interval=60)
+        self.assertEqual([running], poller.ready([running, booting]))
+        self.assertEqual("54.0.0.1", running.host)
+        self.assertEqual("running", running.state)
+        self.assertEqual("pending", booting.state)
+        call = client.ec2_conn.get_all_instances.call_args
+        self.assertEqual(["i-1", "i-2"],
+                         sorted(call[1]["filters"]["instance-id"]))
+        # Nothing until the next interval.
+        self.assertEqual([], poller.ready([booting]))
+        self.assertEqual(1, client.ec2_conn.get_all_instances.call_count)
+
+    def test_errors_wait_for_the_next_poll(self):
+        client = mock.Mock()
+        client.ec2_conn.get_all_instances.side_effect = Exception("timeout")
+        poller = creator.Poller(client, interval=60)
+        self.assertEqual([], poller.ready([Instance(pk=1, ec2_id="i-1")]))
+
+
+class NotificationsTestCase(DjangoTestCase):
+
+    def setUp(self):
+        self.addCleanup(creator.set_model, creator.model_class)
+        creator.set_model(Instance)
+
+    def create(self, name, ec2_id, state="pending"):
+        return Instance.objects.create(name=name, ec2_id=ec2_id, state=state)
+
+    def notify(self, **data):
+        request = RequestFactory().post("/ec2/events", data)
+        with mock.patch("mysqlapi.api.creator.wake") as wake:
+            response = ec2_event(request)
+        return response, wake
+
+    def test_notification_makes_the_instance_ready(self):
+        notified = self.create("notified", "i-1")
+        waiting = self.create("waiting", "i-2")
+        response, wake = self.notify(instance_id="i-1", state="running",
+                                     ip_address="54.0.0.1")
+        self.assertEqual(200, response.status_code)
+        wake.assert_called_once_with()
+        ready = creator.Notifications().ready([notified, waiting])
+        self.assertEqual([notified], ready)
+        self.assertEqual("54.0.0.1", notified.host)
+        self.assertEqual("running", notified.state)
+        self.assertIsInstance(notified.ec2_running_at, datetime.datetime)
+
+    def test_repeated_notification_keeps_the_first_time(self):
+        self.create("notified", "i-1")
+        self.notify(instance_id="i-1", state="running", ip_address="54.0.0.1")
+        first = Instance.objects.get(ec2_id="i-1").ec2_running_at
+        response, wake = self.notify(instance_id="i-1", state="running",
+                                     ip_address="54.0.0.1")
+        self.assertEqual(200, response.status_code)
+        self.assertEqual(first, Instance.objects.get(ec2_id="i-1")
+                         .ec2_running_at)
+
+    def test_other_states_are_ignored(self):
+        self.create("booting", "i-1")
+        response, wake = self.notify(instance_id="i-1", state="pending")
+        self.assertEqual(200, response.status_code)
+        self.assertFalse(wake.called)
+        self.assertIsNone(Instance.objects.get(ec2_id="i-1").ec2_running_at)
+
+    def test_unknown_instance(self):
+        self.create("running", "i-1", state="running")
+        response, wake = self.notify(instance_id="i-1", state="running",
+                                     ip_address="54.0.0.1")
+        self.assertEqual(404, response.status_code)
+        response, wake = self.notify(state="running")
+        self.assertEqual(400, response.status_code)
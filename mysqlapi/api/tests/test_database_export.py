@@ -6,7 +6,7 @@
 
 from unittest import TestCase
 
-from mysqlapi.api.database import export
+from mysqlapi.api.database import export, pipe, stream
 
 import mock
 import subprocess
@@ -18,5 +18,27 @@ class ExportTestCase(TestCase):
         with mock.patch("subprocess.check_output") as check_output:
             export()
             cmd = ["mysqldump", "-u", "root", "--quick",
-                   "--all-databases", "--compact"]
+                   "--single-transaction", "--all-databases", "--compact"]
             check_output.assert_called_with(cmd, stderr=subprocess.STDOUT)
+
+
+class StreamTestCase(TestCase):
+
+    def test_stream_yields_lines(self):
+        lines = list(stream(["printf", "a\\nb\\n"]))
+        self.assertEqual(["a\n", "b\n"], lines)
+
+    def test_stream_yields_blocks(self):
+        blocks = list(stream(["printf", "abcde"], block_size=2))
+        self.assertEqual(["ab", "cd", "e"], blocks)
+
+    def test_stream_raises_on_failure(self):
+        with self.assertRaises(subprocess.CalledProcessError) as cm:
+            list(stream(["sh", "-c", "echo oops >&2; exit 3"]))
+        self.assertEqual(3, cm.exception.returncode)
+        self.assertEqual("oops\n", cm.exception.output)
+
+    def test_pipe(self):
+        with self.assertRaises(subprocess.CalledProcessError) as cm:
+            pipe(["sh", "-c", "cat; exit 1"], ["a\n", "b\n"])
+        self.assertEqual("a\nb\n", cm.exception.output)
@@ -40,7 +40,8 @@ CREATE TABLE `foo` (
         request = RequestFactory().get("/", {"service_host": "127.0.0.1"})
         result = export(request, "magneto")
         self.assertEqual(200, result.status_code)
-        self.assertEqual(expected, result.content.replace("InnoDB", "MyISAM"))
+        content = "".join(result.streaming_content)
+        self.assertEqual(expected, content.replace("InnoDB", "MyISAM"))
         db.drop_database()
         db.drop_user("magneto", "%")
 
@@ -60,7 +61,8 @@ CREATE TABLE `foo` (
         request = RequestFactory().get("/")
         result = export(request, "magneto")
         self.assertEqual(200, result.status_code)
-        self.assertEqual(expected, result.content.replace("InnoDB", "MyISAM"))
+        content = "".join(result.streaming_content)
+        self.assertEqual(expected, content.replace("InnoDB", "MyISAM"))
         db.drop_database()
         db.drop_user("magneto", "%")
 
@@ -6,6 +6,7 @@ from unittest import TestCase
 from django.conf import settings
 from django.test.utils import override_settings
 
+from mysqlapi.api import backup
 from mysqlapi.api.management.commands.export import Command
 
 import mock
@@ -17,9 +18,10 @@ class ExportCommandTestCase(TestCase):
         with mock.patch("subprocess.check_output") as check_output:
             m = "mysqlapi.api.management.commands.export.Command.send_data"
             with mock.patch(m):
-                Command().handle_noargs()
+                Command().handle_noargs(engine="logical")
                 cmd = ["mysqldump", "-u", "root", "--quick",
-                       "--all-databases", "--compact"]
+                       "--single-transaction", "--all-databases",
+                       "--compact"]
                 check_output.assert_called_with(cmd, stderr=subprocess.STDOUT)
 
     def test_export_should_send_data(self):
@@ -27,7 +29,7 @@ class ExportCommandTestCase(TestCase):
             check_output.return_value = "data"
             m = "mysqlapi.api.management.commands.export.Command.send_data"
             with mock.patch(m) as send_data:
-                Command().handle_noargs()
+                Command().handle_noargs(engine="logical")
                 send_data.assert_called_with("data")
 
     @override_settings(S3_ACCESS_KEY="access", S3_SECRET_KEY="secret")
@@ -38,6 +40,7 @@ class ExportCommandTestCase(TestCase):
             conn = mock.Mock()
             s3 = s3con.return_value
             s3.return_value = conn
+            s3.get_bucket.return_value.get_key.return_value = None
             with mock.patch("boto.s3.key.Key"):
                 Command().send_data("data")
                 s3con.assert_called_with(access, secret)
@@ -49,6 +52,7 @@ class ExportCommandTestCase(TestCase):
             conn = mock.Mock()
             s3 = s3con.return_value
             s3.return_value = conn
+            s3.get_bucket.return_value.get_key.return_value = None
             with mock.patch("boto.s3.key.Key"):
                 Command().send_data("data")
                 s3.get_bucket.assert_called_with(bucket)
@@ -58,7 +62,53 @@ class ExportCommandTestCase(TestCase):
             conn = mock.Mock()
             s3 = s3con.return_value
             s3.return_value = conn
+            s3.get_bucket.return_value.get_key.return_value = None
             with mock.patch("boto.s3.key.Key") as Key:
                 key = Key.return_value
                 Command().send_data("data")
-                key.set_contents_from_string.assert_any_call("data")
+                key.set_contents_from_string.assert_any_call(
+                    backup.pack("data"))
+
+    @mock.patch("mysqlapi.api.throttle.Load")
+    @mock.patch("mysqlapi.api.physical.Backup")
+    def test_export_physical_incremental(self, Backup, Load):
+        s3 = "mysqlapi.api.management.commands.s3."
+        with mock.patch(s3 + "bucket") as bucket, \
+                mock.patch(s3 + "catalog") as catalog, \
+                mock.patch(s3 + "store_chunks") as store_chunks, \
+                mock.patch(s3 + "store_manifest") as store_manifest:
+            catalog.return_value = [{"manifest": "manifests/full",
+                                     "engine": "physical", "to_lsn": 42}]
+            Backup.return_value.stream.return_value = ["xbstream"]
+            with override_settings(BACKUP_RATE_LIMIT=1024):
+                Command().handle_noargs(engine="physical", incremental=True,
+                                        parallel=2)
+        Backup.assert_called_with(parallel=2, incremental_lsn=42, rate=1024)
+        hot = Backup.return_value
+        data = store_chunks.call_args[0][1]
+        self.assertEqual(["xbstream"], list(data))
+        # xtrabackup's stream is never paused.
+        self.assertFalse(Load.called)
+        hot.meta.assert_called_with("manifests/full")
+        store_manifest.assert_called_with(bucket.return_value,
+                                          store_chunks.return_value,
+                                          meta=hot.meta.return_value)
+
+    @mock.patch("mysqlapi.api.throttle.Load")
+    @mock.patch("mysqlapi.api.snapshot.SnapshotDump")
+    def test_export_snapshot(self, SnapshotDump, Load):
+        s3 = "mysqlapi.api.management.commands.s3."
+        with mock.patch(s3 + "bucket") as bucket, \
+                mock.patch(s3 + "store_chunks") as store_chunks, \
+                mock.patch(s3 + "store_manifest") as store_manifest:
+            Command().handle_noargs(engine="snapshot", parallel=3)
+        self.assertEqual(3, SnapshotDump.call_args[1]["workers"])
+        limiter = SnapshotDump.call_args[1]["throttle"]
+        self.assertEqual(Load.return_value.sample, limiter.sample)
+        dump = SnapshotDump.return_value
+        store_chunks.assert_called_with(bucket.return_value,
+                                        dump.stream.return_value, workers=3)
+        store_manifest.assert_called_with(bucket.return_value,
+                                          store_chunks.return_value,
+                                          databases=dump.databases,
+                                          meta=dump.meta.return_value)
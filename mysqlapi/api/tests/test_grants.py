@@ -0,0 +1,215 @@
+# Copyright 2015 mysqlapi authors. All rights reserved.
+# Use of this source code is governed by a BSD-style
+# license that can be found in the LICENSE file.
+
+import MySQLdb
+
+from django.conf import settings
+from django.test import TestCase
+from django.test.utils import override_settings
+
+from mysqlapi.api import grants
+from mysqlapi.api.management.commands import collectusers
+from mysqlapi.api.management.commands.collectusers import Command
+from mysqlapi.api.models import (DatabaseManager, Instance,
+                                 ProvisionedInstance)
+from mysqlapi.api.tests import mocks
+
+import mock
+
+ROWS = {
+    "SELECT User, Host, Db FROM mysql.db": [
+        ("root", "localhost", "test"),
+        ("app1", "%", "app"),
+        ("gone1", "%", "gone"),
+        ("gone2", "%", "gone\\_db"),
+        ("split", "%", "gone"),
+        ("split", "%", "app"),
+        ("wide", "%", "app%"),
+        ("tabled", "%", "gone"),
+        ("monitor", "%", "monitoring"),
+        ("meta", "%", "mysqlapi"),
+        ("ops", "%", "gone"),
+    ],
+    "SELECT schema_name FROM information_schema.schemata": [
+        ("mysql",), ("app",), ("monitoring",),
+    ],
+    "SELECT DISTINCT User, Host FROM mysql.tables_priv": [
+        ("tabled", "%"),
+    ],
+}
+
+
+def fake_cursor(errors=None):
+    # Every other query counts three rows.
+    return mocks.FakeCursor(ROWS, default=[(3L,)], errors=errors)
+
+
+class GrantsTestCase(TestCase):
+
+    def test_sizes(self):
+        cursor = fake_cursor(errors={
+            "SELECT COUNT(*) FROM mysql.procs_priv":
+                MySQLdb.OperationalError(1146, "no such table")})
+        sizes = grants.sizes(cursor)
+        self.assertEqual({"user": 3, "db": 3, "tables_priv": 3,
+                          "columns_priv": 3}, sizes)
+
+    def test_orphans(self):
+        found = grants.orphans(fake_cursor(), lambda: ["mysqlapi", "test"],
+                               keep=["ops"])
+        self.assertEqual([("gone1", "%"), ("gone2", "%")], found)
+
+    def test_orphans_lists_databases_after_the_grants(self):
+        cursor = fake_cursor()
+
+        def databases():
+            self.assertEqual(3, len(cursor.log))
+            return ["mysqlapi"]
+        grants.orphans(cursor, databases)
+
+    def test_orphans_keep(self):
+        found = grants.orphans(fake_cursor(), lambda: ["mysqlapi"],
+                               keep=["gone1", "ops"])
+        self.assertEqual([("gone2", "%")], found)
+
+    def test_drop_in_batches(self):
+        cursor = fake_cursor()
+        accounts = [("u%d" % i, "%") for i in range(5)]
+        self.assertEqual(5, grants.drop(cursor, accounts, batch_size=2))
+        self.assertEqual(["DROP USER %s@%s, %s@%s", "DROP USER %s@%s, %s@%s",
+                          "DROP USER %s@%s"], cursor.log)
+        self.assertEqual([["u0", "%", "u1", "%"], ["u2", "%", "u3", "%"],
+                          ["u4", "%"]], cursor.params)
+
+
+class ScriptedCursor(object):
+
+    def __init__(self, *results):
+        self.log = []
+        self.results = list(results)
+        self.description = None
+
+    def execute(self, sql, args=None):
+        self.log.append((sql, args))
+        self.description, self.row = self.results.pop(0)
+
+    def fetchone(self):
+        return self.row
+
+
+DB = ((("Host",), ("Db",), ("User",), ("Select_priv",), ("Insert_priv",),
+       ("Grant_priv",)),
+      ("%", "app", "app", "Y", "Y", "N"))
+USER = ((("Host",), ("User",), ("authentication_string",)),
+        ("%", "app", "*HASH"))
+
+
+class GrantedTestCase(TestCase):
+
+    def test_granted(self):
+        cursor = ScriptedCursor(DB, USER, (None, ("*HASH",)))
+        self.assertTrue(grants.granted(cursor, "app", "app", "secret"))
+        self.assertEqual(("SELECT PASSWORD(%s)", ("secret",)),
+                         cursor.log[-1])
+
+    def test_not_granted_without_db_row(self):
+        cursor = ScriptedCursor((DB[0], None))
+        self.assertFalse(grants.granted(cursor, "app", "app", "secret"))
+
+    def test_not_granted_with_missing_privileges(self):
+        cursor = ScriptedCursor((DB[0], ("%", "app", "app", "Y", "N", "N")))
+        self.assertFalse(grants.granted(cursor, "app", "app", "secret"))
+
+    def test_not_granted_with_another_password(self):
+        cursor = ScriptedCursor(DB, USER, (None, ("*OTHER",)))
+        self.assertFalse(grants.granted(cursor, "app", "app", "secret"))
+
+    def test_granted_with_old_password_column(self):
+        user = ((("User",), ("Password",)), ("app", "*HASH"))
+        cursor = ScriptedCursor(DB, user, (None, ("*HASH",)))
+        self.assertTrue(grants.granted(cursor, "app", "app", "secret"))
+
+    @mock.patch("mysqlapi.api.grants.granted")
+    def test_create_user_skips_the_grant(self, granted):
+        granted.return_value = True
+        db = DatabaseManager("app")
+        db.conn = mock.Mock()
+        username, password = db.create_user("app", None)
+        cursor = db.conn.cursor.return_value
+        granted.assert_called_once_with(cursor, "app", "app", password)
+        self.assertFalse(cursor.execute.called)
+        db.conn.close.assert_called_once_with()
+
+    @mock.patch("mysqlapi.api.grants.granted")
+    def test_create_user_grants(self, granted):
+        granted.return_value = False
+        db = DatabaseManager("app")
+        db.conn = mock.Mock()
+        username, password = db.create_user("app", None)
+        cursor = db.conn.cursor.return_value
+        cursor.execute.assert_called_once_with(
+            "grant all privileges on app.* to 'app'@'%' identified by "
+            "'{0}'".format(password))
+
+
+class CollectUsersTestCase(TestCase):
+
+    def setUp(self):
+        Instance.objects.create(name="app", shared=True)
+        self.cursor = fake_cursor()
+        patcher = mock.patch(
+            "mysqlapi.api.management.commands.collectusers.Connection")
+        self.addCleanup(patcher.stop)
+        connection = patcher.start()
+        self.conn = connection.return_value
+        self.conn.hostname = "shared"
+        self.conn.username = "api"
+        self.conn.cursor.return_value = self.cursor
+
+    def queries(self):
+        return zip(self.cursor.log, self.cursor.params)
+
+    @override_settings(SHARED_SERVER="shared", KEEP_USERS=["ops"])
+    def test_drops_orphans(self):
+        output = Command().handle(dry_run=False, batch_size=100)
+        drops = [args for sql, args in self.queries()
+                 if sql.startswith("DROP USER")]
+        self.assertEqual([["gone1", "%", "gone2", "%"]], drops)
+        self.assertIn(u"shared: dropped 2 orphaned users.", output)
+        self.assertIn(u"Before: 3 user, 3 db", output)
+        self.conn.close.assert_called_once_with()
+
+    @override_settings(SHARED_USER="shared", PROXY_ADMIN_USER="proxy",
+                       KEEP_USERS=["ops"])
+    def test_kept(self):
+        ProvisionedInstance.objects.create(host="10.0.0.1",
+                                           admin_user="pool")
+        users = collectusers.kept()
+        self.assertTrue(set(["shared", "proxy", "ops", "pool",
+                             settings.DATABASES["default"]["USER"]]) <= users)
+
+    def test_databases(self):
+        names = collectusers.databases()
+        self.assertIn("app", names)
+        self.assertIn("mysqlapi", names)
+        self.assertIn(settings.DATABASES["default"]["NAME"], names)
+
+    @override_settings(SHARED_SERVER="shared", KEEP_USERS=[])
+    def test_drops_users_not_kept(self):
+        Command().handle(dry_run=False, batch_size=100)
+        drops = [args for sql, args in self.queries()
+                 if sql.startswith("DROP USER")]
+        self.assertEqual([["gone1", "%", "gone2", "%", "ops", "%"]], drops)
+
+    @override_settings(SHARED_SERVER="shared", KEEP_USERS=["ops"])
+    def test_dry_run(self):
+        output = Command().handle(dry_run=True, batch_size=100)
+        self.assertFalse([sql for sql, args in self.queries()
+                          if sql.startswith("DROP USER")])
+        self.assertIn(u"shared: gone1@%", output)
+        self.assertIn(u"shared: 2 orphaned users", output)
+
+    @override_settings(SHARED_SERVER="")
+    def test_nothing_to_collect(self):
+        self.assertEqual(u"", Command().handle(dry_run=False, batch_size=100))
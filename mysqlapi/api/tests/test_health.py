@@ -0,0 +1,196 @@
+# Copyright 2015 mysqlapi authors. All rights reserved.
+# Use of this source code is governed by a BSD-style
+# license that can be found in the LICENSE file.
+
+import json
+import time
+
+import MySQLdb
+
+from django.test import TestCase
+from django.test.client import RequestFactory
+from django.test.utils import override_settings
+from django.utils import timezone
+
+from mysqlapi.api import health
+from mysqlapi.api.models import HealthSnapshot, Instance, ProvisionedInstance
+from mysqlapi.api.views import FleetHealthcheck, Healthcheck
+
+import mock
+
+
+class SnapshotTestCase(TestCase):
+
+    def test_get_ignores_stale_results(self):
+        snapshot = health.Snapshot()
+        snapshot.update({
+            "fresh": {"status": "up", "checked_at": time.time()},
+            "stale": {"status": "up", "checked_at": time.time() - 60},
+        })
+        self.assertEqual("up", snapshot.get("fresh", 30)["status"])
+        self.assertIsNone(snapshot.get("stale", 30))
+        self.assertIsNone(snapshot.get("unknown", 30))
+
+    def test_workers_read_the_sweeper_results(self):
+        sweeper, worker = health.Snapshot(), health.Snapshot()
+        self.assertEqual((None, {}), worker.all())
+        sweeper.update({"db": {"status": "up", "checked_at": time.time()}})
+        self.assertEqual("up", worker.get("db", 30)["status"])
+        self.assertEqual(sweeper.updated_at, worker.updated_at)
+        with mock.patch("json.loads") as loads:
+            worker.get("db", 30)
+            self.assertFalse(loads.called)
+        sweeper.update({})
+        self.assertIsNone(worker.get("db", 30))
+
+
+class SweeperTestCase(TestCase):
+
+    def setUp(self):
+        Instance.objects.create(name="up", state="running", host="10.0.0.1")
+        Instance.objects.create(name="down", state="running",
+                                host="10.0.0.2")
+        Instance.objects.create(name="waiting", state="pending")
+        Instance.objects.create(name="broken", state="error")
+
+    def test_sweep_probes_every_instance_concurrently(self):
+        snapshot = health.Snapshot()
+        sweeper = health.Sweeper(Instance, snapshot, interval=10, workers=4,
+                                 timeout=3)
+
+        def is_up(db, timeout):
+            self.assertEqual(3, timeout)
+            return db.name == "up"
+        with mock.patch("mysqlapi.api.models.DatabaseManager.is_up",
+                        autospec=True) as m:
+            m.side_effect = is_up
+            sweeper.sweep()
+        updated_at, statuses = snapshot.all()
+        self.assertIsNotNone(updated_at)
+        self.assertEqual(["down", "up", "waiting"], sorted(statuses))
+        self.assertEqual("up", statuses["up"]["status"])
+        self.assertEqual("down", statuses["down"]["status"])
+        self.assertEqual("pending", statuses["waiting"]["status"])
+
+
+class SnapshotViewsTestCase(TestCase):
+
+    def setUp(self):
+        Instance.objects.create(name="g8mysql", state="running")
+        self.addCleanup(health.snapshot.update, {})
+        health.snapshot.update({
+            "g8mysql": {"status": "up", "checked_at": time.time()},
+        })
+
+    @override_settings(HEALTH_SWEEP_INTERVAL=10)
+    def test_healthcheck_reads_from_the_snapshot(self):
+        request = RequestFactory().get("/resources/g8mysql/status")
+        with mock.patch("mysqlapi.api.models.DatabaseManager.is_up") as is_up:
+            response = Healthcheck().get(request, "g8mysql")
+            self.assertFalse(is_up.called)
+        self.assertEqual(204, response.status_code)
+
+    def test_fleet_healthcheck_returns_the_whole_snapshot(self):
+        request = RequestFactory().get("/resources/status")
+        response = FleetHealthcheck.as_view()(request)
+        self.assertEqual(200, response.status_code)
+        data = json.loads(response.content)
+        self.assertEqual("up", data["instances"]["g8mysql"]["status"])
+
+    @override_settings(HEALTH_SWEEP_INTERVAL=10)
+    def test_healthcheck_probes_instances_without_a_recent_result(self):
+        health.snapshot.update({
+            "g8mysql": {"status": "pending", "checked_at": time.time()},
+        })
+        request = RequestFactory().get("/resources/g8mysql/status")
+        with mock.patch("mysqlapi.api.models.DatabaseManager.is_up") as is_up:
+            is_up.return_value = True
+            response = Healthcheck().get(request, "g8mysql")
+        self.assertEqual(204, response.status_code)
+        health.snapshot.update({
+            "g8mysql": {"status": "down", "checked_at": time.time() - 5},
+        })
+        Instance.objects.filter(name="g8mysql").update(
+            ready_at=timezone.now())
+        with mock.patch("mysqlapi.api.models.DatabaseManager.is_up") as is_up:
+            is_up.return_value = True
+            response = Healthcheck().get(request, "g8mysql")
+            self.assertTrue(is_up.called)
+        self.assertEqual(204, response.status_code)
+
+    def test_fleet_healthcheck_without_snapshot(self):
+        HealthSnapshot.objects.all().delete()
+        with mock.patch("mysqlapi.api.health.snapshot", health.Snapshot()):
+            request = RequestFactory().get("/resources/status")
+            response = FleetHealthcheck.as_view()(request)
+        self.assertEqual(503, response.status_code)
+
+
+class DeepStatusTestCase(TestCase):
+
+    def setUp(self):
+        health._deep_results.clear()
+        self.instance = Instance.objects.create(name="deep", state="running",
+                                                host="10.0.0.9")
+
+    def fake_cursor(self):
+        cursor = mock.Mock()
+        cursor.fetchall.return_value = [
+            ("Innodb_buffer_pool_read_requests", "1000"),
+            ("Innodb_buffer_pool_reads", "10"),
+            ("Threads_connected", "12"),
+            ("Threads_running", "3"),
+        ]
+        cursor.fetchone.side_effect = [(1,), (7,)]
+        cursor.description = [("Seconds_Behind_Master",)]
+        return cursor
+
+    def test_probe_collects_latency_threads_and_replication_lag(self):
+        db = self.instance.db_manager()
+        db.conn = mock.Mock()
+        db.conn.cursor.return_value = self.fake_cursor()
+        result = db.probe(timeout=2)
+        self.assertEqual(2, db.conn.connect_timeout)
+        self.assertEqual(12, result["threads_connected"])
+        self.assertEqual(3, result["threads_running"])
+        self.assertAlmostEqual(0.99, result["buffer_pool_hit_ratio"])
+        self.assertEqual(7, result["replication_lag"])
+        self.assertIn("connect_latency", result)
+        self.assertIn("query_latency", result)
+        db.conn.close.assert_called_once_with()
+
+    def test_deep_status_is_cached_per_backend(self):
+        m = "mysqlapi.api.models.DatabaseManager.probe"
+        with mock.patch(m) as probe:
+            probe.return_value = {"threads_running": 1}
+            first = health.deep_status(self.instance)
+            second = health.deep_status(self.instance)
+            probe.assert_called_once_with(2)
+        self.assertEqual("up", first["status"])
+        self.assertEqual(first, second)
+
+    def test_deep_status_reports_replica_lag(self):
+        pi = ProvisionedInstance.objects.create(instance=self.instance,
+                                                host="10.0.0.9")
+        ProvisionedInstance.objects.create(host="10.0.0.10", replica_of=pi)
+        ProvisionedInstance.objects.create(host="10.0.0.11", replica_of=pi)
+        instance = Instance.objects.get(pk=self.instance.pk)
+        m = "mysqlapi.api.models.DatabaseManager.probe"
+        with mock.patch(m) as probe:
+            probe.side_effect = [{"replication_lag": None},
+                                 {"replication_lag": 3},
+                                 MySQLdb.OperationalError(2003, "gone")]
+            result = health.deep_status(instance)
+        self.assertEqual([
+            {"host": "10.0.0.10", "status": "up", "replication_lag": 3},
+            {"host": "10.0.0.11", "status": "down", "error": "gone"},
+        ], result["replicas"])
+
+    def test_healthcheck_deep_returns_json(self):
+        request = RequestFactory().get("/resources/deep/status",
+                                       {"deep": "1"})
+        with mock.patch("mysqlapi.api.health.deep_status") as deep_status:
+            deep_status.return_value = {"status": "down", "error": "gone"}
+            response = Healthcheck().get(request, "deep")
+        self.assertEqual(500, response.status_code)
+        self.assertEqual("gone", json.loads(response.content)["error"])
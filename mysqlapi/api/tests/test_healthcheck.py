@@ -62,3 +62,11 @@ class HealthcheckTestCase(TestCase):
         response = view.get(request, "g8mysql")
         self.assertEqual(202, response.status_code)
         self.assertEqual([], fake.actions)
+
+    def test_healthcheck_loads_the_instance_in_one_query(self):
+        request = RequestFactory().get("/resources/g8mysql/status/")
+        with mock.patch("mysqlapi.api.models.DatabaseManager.is_up") as is_up:
+            is_up.return_value = True
+            with self.assertNumQueries(1):
+                response = Healthcheck().get(request, "g8mysql")
+        self.assertEqual(204, response.status_code)
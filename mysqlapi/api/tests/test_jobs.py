@@ -0,0 +1,314 @@
+# Copyright 2015 mysqlapi authors. All rights reserved.
+# Use of this source code is governed by a BSD-style
+# license that can be found in the LICENSE file.
+
+import datetime
+import json
+import subprocess
+
+from django.test import TestCase
+from django.test.client import RequestFactory
+from django.utils import timezone
+
+from mysqlapi.api import jobs
+from mysqlapi.api.models import DatabaseManager, Instance, Job
+from mysqlapi.api.views import Backups, Clone, JobStatus, Restore
+
+import mock
+
+
+class DumpTestCase(TestCase):
+
+    def setUp(self):
+        self.db = DatabaseManager("mydb", host="10.0.0.1", port="3307",
+                                  user="admin", password="secret")
+
+    @mock.patch("subprocess.Popen")
+    def test_dump_streams_mysqldump_output(self, Popen):
+        Popen.return_value.stdout = iter(["CREATE TABLE a;\n", "INSERT;\n"])
+        Popen.return_value.wait.return_value = 0
+        self.assertEqual(["CREATE TABLE a;\n", "INSERT;\n"],
+                         list(self.db.dump()))
+        cmd = Popen.call_args[0][0]
+        self.assertEqual(["mysqldump", "-h", "10.0.0.1", "-P", "3307",
+                          "-u", "admin"], cmd[:7])
+        self.assertIn("--single-transaction", cmd)
+        self.assertEqual("mydb", cmd[-1])
+        self.assertNotIn("secret", cmd)
+        self.assertEqual("secret", Popen.call_args[1]["env"]["MYSQL_PWD"])
+
+    @mock.patch("subprocess.Popen")
+    def test_dump_raises_when_mysqldump_fails(self, Popen):
+        Popen.return_value.stdout = iter(["CREATE TABLE a;\n"])
+        Popen.return_value.wait.return_value = 2
+        with self.assertRaises(subprocess.CalledProcessError):
+            list(self.db.dump())
+
+    @mock.patch("subprocess.Popen")
+    def test_load_pipes_chunks_into_mysql(self, Popen):
+        Popen.return_value.wait.return_value = 0
+        self.db.load(iter(["CREATE TABLE a;\n", "INSERT;\n"]))
+        self.assertEqual("mysql", Popen.call_args[0][0][0])
+        stdin = Popen.return_value.stdin
+        stdin.write.assert_has_calls([mock.call("CREATE TABLE a;\n"),
+                                      mock.call("INSERT;\n")])
+        stdin.close.assert_called_once_with()
+
+    @mock.patch("subprocess.Popen")
+    def test_load_kills_mysql_when_chunks_fail(self, Popen):
+        def chunks():
+            yield "CREATE TABLE a;\n"
+            raise ValueError("corrupt")
+        with self.assertRaises(ValueError):
+            self.db.load(chunks())
+        Popen.return_value.kill.assert_called_once_with()
+
+
+class JobRunnerTestCase(TestCase):
+
+    def setUp(self):
+        self.instance = Instance.objects.create(name="mydb", state="running",
+                                                shared=True)
+        self.runner = jobs.JobRunner(interval=5)
+
+    def test_backup_streams_dump_into_instance_prefix(self):
+        job = Job.objects.create(instance_name="mydb", kind="backup")
+        key = mock.Mock()
+        key.name = "instances/mydb/manifests/uuid"
+
+        def store_data(data, databases, prefix, progress):
+            self.assertEqual(["line\n"], list(data))
+            self.assertEqual(["mydb"], databases)
+            self.assertEqual("instances/mydb/", prefix)
+            progress(5)
+            return key
+        with mock.patch.object(DatabaseManager, "dump") as dump, \
+                mock.patch("mysqlapi.api.management.commands.s3."
+                           "store_data") as store:
+            dump.return_value = iter(["line\n"])
+            store.side_effect = store_data
+            self.assertEqual(1, self.runner.run_once())
+        job = Job.objects.get(pk=job.pk)
+        self.assertEqual("done", job.state)
+        self.assertEqual(key.name, job.backup)
+        self.assertEqual(5, job.bytes_done)
+        self.assertEqual(5, job.bytes_total)
+
+    def test_restore_loads_backup_with_progress(self):
+        job = Job.objects.create(instance_name="mydb", kind="restore",
+                                 backup="instances/mydb/manifests/uuid",
+                                 bytes_total=8)
+        loaded = []
+        with mock.patch.object(DatabaseManager, "load") as load, \
+                mock.patch("mysqlapi.api.management.commands.s3."
+                           "iter_data") as iter_data, \
+                mock.patch("mysqlapi.api.management.commands.s3.bucket"):
+            iter_data.return_value = iter(["abc\n", "def\n"])
+            load.side_effect = lambda chunks: loaded.extend(chunks)
+            self.runner.run_once()
+        self.assertEqual("instances/mydb/manifests/uuid",
+                         iter_data.call_args[0][1])
+        self.assertEqual(["abc\n", "def\n"], loaded)
+        job = Job.objects.get(pk=job.pk)
+        self.assertEqual("done", job.state)
+        self.assertEqual(8, job.bytes_done)
+
+    def test_failed_job_records_reason(self):
+        job = Job.objects.create(instance_name="mydb", kind="backup")
+        with mock.patch.object(DatabaseManager, "dump") as dump, \
+                mock.patch("sys.stderr"):
+            dump.side_effect = subprocess.CalledProcessError(
+                2, "mysqldump", "mysqldump: Access denied")
+            self.runner.run_once()
+        job = Job.objects.get(pk=job.pk)
+        self.assertEqual("error", job.state)
+        self.assertEqual("Access denied", job.reason)
+
+    def test_clone_on_the_same_server_copies_tables(self):
+        Instance.objects.create(name="preview", state="running", shared=True)
+        job = Job.objects.create(instance_name="preview", kind="clone",
+                                 source="mydb")
+
+        def copy(source, target, progress, workers):
+            self.assertEqual(("mydb", "preview"), (source.name, target.name))
+            progress(100)
+        with mock.patch("mysqlapi.api.clone.copy") as copy_mock:
+            copy_mock.side_effect = copy
+            self.runner.run_once()
+        job = Job.objects.get(pk=job.pk)
+        self.assertEqual("done", job.state)
+        self.assertEqual(100, job.bytes_total)
+        self.assertIsNotNone(job.started_at)
+
+    def test_clone_across_servers_pipes_a_dump(self):
+        Instance.objects.create(name="preview", state="running",
+                                host="10.0.0.2")
+        job = Job.objects.create(instance_name="preview", kind="clone",
+                                 source="mydb")
+        loaded = []
+        with mock.patch.object(DatabaseManager, "dump") as dump, \
+                mock.patch.object(DatabaseManager, "load") as load:
+            dump.return_value = iter(["abc\n"])
+            load.side_effect = lambda chunks: loaded.extend(chunks)
+            self.runner.run_once()
+        self.assertEqual(["abc\n"], loaded)
+        job = Job.objects.get(pk=job.pk)
+        self.assertEqual(("done", 4), (job.state, job.bytes_done))
+
+    def test_clone_waits_for_a_pending_instance(self):
+        Instance.objects.create(name="preview", state="pending")
+        job = Job.objects.create(instance_name="preview", kind="clone",
+                                 source="mydb")
+        self.runner.run_once()
+        job = Job.objects.get(pk=job.pk)
+        self.assertEqual("pending", job.state)
+        self.assertIsNone(job.started_at)
+
+    def test_throughput(self):
+        job = Job.objects.create(instance_name="mydb", kind="backup",
+                                 state="done", bytes_done=3000)
+        self.assertIsNone(job.throughput())
+        job.started_at = job.updated_at - datetime.timedelta(seconds=3)
+        self.assertEqual(1000, job.as_dict()["bytes_per_second"])
+
+    def test_claimed_jobs_are_not_run_twice(self):
+        job = Job.objects.create(instance_name="mydb", kind="backup")
+        self.assertTrue(jobs.claim(job))
+        self.assertFalse(jobs.claim(Job.objects.get(pk=job.pk)))
+        self.assertEqual(0, self.runner.run_once())
+
+    def test_jobs_of_a_dead_runner_are_requeued(self):
+        job = Job.objects.create(instance_name="mydb", kind="purge",
+                                 source="purge$1$mydb")
+        self.assertTrue(jobs.claim(job))
+        # The runner died right after claiming it, its lease expires.
+        expired = timezone.now() - datetime.timedelta(seconds=121)
+        Job.objects.filter(pk=job.pk).update(updated_at=expired)
+        with mock.patch("mysqlapi.api.jobs.run_purge") as run_purge, \
+                mock.patch.dict(jobs.handlers, {"purge": run_purge}):
+            self.assertEqual(1, self.runner.run_once())
+        self.assertEqual(1, run_purge.call_count)
+        self.assertEqual("done", Job.objects.get(pk=job.pk).state)
+
+    def test_running_jobs_with_a_lease_are_left_alone(self):
+        job = Job.objects.create(instance_name="mydb", kind="backup")
+        self.assertTrue(jobs.claim(job))
+        renewed = timezone.now() - datetime.timedelta(seconds=60)
+        Job.objects.filter(pk=job.pk).update(updated_at=renewed)
+        jobs.Progress(job).save()
+        self.assertEqual(0, jobs.requeue())
+        self.assertEqual(0, self.runner.run_once())
+        job = Job.objects.get(pk=job.pk)
+        self.assertEqual("running", job.state)
+        self.assertTrue(job.updated_at > renewed)
+
+
+class JobViewsTestCase(TestCase):
+
+    def setUp(self):
+        self.instance = Instance.objects.create(name="mydb", state="running",
+                                                shared=True)
+        patcher = mock.patch("mysqlapi.api.management.commands.s3.catalog")
+        self.catalog = patcher.start()
+        self.addCleanup(patcher.stop)
+        patcher = mock.patch("mysqlapi.api.management.commands.s3.bucket")
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.catalog.return_value = [
+            {"manifest": "instances/mydb/manifests/old", "size": 10},
+            {"manifest": "instances/mydb/manifests/new", "size": 20},
+        ]
+
+    def test_post_backup_creates_pending_job(self):
+        request = RequestFactory().post("/resources/mydb/backups")
+        response = Backups.as_view()(request, name="mydb")
+        self.assertEqual(202, response.status_code)
+        data = json.loads(response.content)
+        job = Job.objects.get(pk=data["id"])
+        self.assertEqual(("backup", "pending"), (job.kind, job.state))
+
+    def test_post_backup_conflicts_with_active_job(self):
+        Job.objects.create(instance_name="mydb", kind="restore",
+                           state="running")
+        request = RequestFactory().post("/resources/mydb/backups")
+        response = Backups.as_view()(request, name="mydb")
+        self.assertEqual(409, response.status_code)
+
+    def test_post_backup_ignores_purges_of_a_dropped_instance(self):
+        Job.objects.create(instance_name="mydb", kind="purge",
+                           source="purge$1$mydb", state="running")
+        request = RequestFactory().post("/resources/mydb/backups")
+        response = Backups.as_view()(request, name="mydb")
+        self.assertEqual(202, response.status_code)
+
+    def test_post_backup_for_missing_instance(self):
+        request = RequestFactory().post("/resources/other/backups")
+        response = Backups.as_view()(request, name="other")
+        self.assertEqual(404, response.status_code)
+
+    def test_get_backups_lists_instance_catalog(self):
+        request = RequestFactory().get("/resources/mydb/backups")
+        response = Backups.as_view()(request, name="mydb")
+        self.assertEqual(200, response.status_code)
+        self.assertEqual(2, len(json.loads(response.content)["backups"]))
+        self.assertEqual("instances/mydb/", self.catalog.call_args[0][1])
+
+    def test_restore_uses_latest_backup_by_default(self):
+        request = RequestFactory().post("/resources/mydb/restore")
+        response = Restore.as_view()(request, name="mydb")
+        self.assertEqual(202, response.status_code)
+        data = json.loads(response.content)
+        self.assertEqual("instances/mydb/manifests/new", data["backup"])
+        self.assertEqual(20, data["bytes_total"])
+
+    def test_restore_chosen_backup(self):
+        request = RequestFactory().post(
+            "/resources/mydb/restore",
+            {"backup": "instances/mydb/manifests/old"})
+        response = Restore.as_view()(request, name="mydb")
+        data = json.loads(response.content)
+        self.assertEqual("instances/mydb/manifests/old", data["backup"])
+
+    def test_restore_unknown_backup(self):
+        request = RequestFactory().post(
+            "/resources/mydb/restore",
+            {"backup": "instances/other/manifests/new"})
+        response = Restore.as_view()(request, name="mydb")
+        self.assertEqual(404, response.status_code)
+        self.assertFalse(Job.objects.exists())
+
+    def test_clone_creates_the_instance_and_a_clone_job(self):
+        request = RequestFactory().post("/resources/mydb/clone",
+                                        {"name": "preview"})
+        with mock.patch("mysqlapi.api.views.create_database") as create, \
+                mock.patch("mysqlapi.api.views.uses_ec2") as uses_ec2:
+            uses_ec2.return_value = False
+            response = Clone.as_view()(request, name="mydb")
+        self.assertEqual(202, response.status_code)
+        instance = create.call_args[0][0]
+        self.assertEqual("preview", instance.name)
+        data = json.loads(response.content)
+        self.assertEqual(("preview", "clone", "mydb"),
+                         (data["instance"], data["kind"], data["source"]))
+
+    def test_clone_needs_a_name_and_a_running_source(self):
+        request = RequestFactory().post("/resources/mydb/clone")
+        response = Clone.as_view()(request, name="mydb")
+        self.assertEqual(400, response.status_code)
+        Instance.objects.create(name="booting", state="pending")
+        request = RequestFactory().post("/resources/booting/clone",
+                                        {"name": "preview"})
+        response = Clone.as_view()(request, name="booting")
+        self.assertEqual(412, response.status_code)
+
+    def test_job_status(self):
+        job = Job.objects.create(instance_name="mydb", kind="backup",
+                                 state="running", bytes_done=1024)
+        request = RequestFactory().get("/resources/mydb/jobs/%d" % job.pk)
+        response = JobStatus.as_view()(request, name="mydb", id=str(job.pk))
+        self.assertEqual(200, response.status_code)
+        data = json.loads(response.content)
+        self.assertEqual(("running", 1024), (data["state"],
+                                             data["bytes_done"]))
+        response = JobStatus.as_view()(request, name="other", id=str(job.pk))
+        self.assertEqual(404, response.status_code)
@@ -0,0 +1,110 @@
+# Copyright 2015 mysqlapi authors. All rights reserved.
+# Use of this source code is governed by a BSD-style
+# license that can be found in the LICENSE file.
+
+import time
+
+from unittest import TestCase
+from django.test.utils import override_settings
+
+import mock
+import MySQLdb
+
+from mysqlapi.api import keepalive
+from mysqlapi.api.database import Connection
+
+
+class ResolveTestCase(TestCase):
+
+    def setUp(self):
+        keepalive._hosts.clear()
+
+    @override_settings(DNS_CACHE_TTL=60)
+    def test_resolve_caches_addresses(self):
+        with mock.patch("socket.gethostbyname") as gethostbyname:
+            gethostbyname.return_value = "10.0.0.7"
+            self.assertEqual("10.0.0.7", keepalive.resolve("db.example.com"))
+            self.assertEqual("10.0.0.7", keepalive.resolve("db.example.com"))
+            gethostbyname.assert_called_once_with("db.example.com")
+
+    @override_settings(DNS_CACHE_TTL=60)
+    def test_resolve_keeps_localhost(self):
+        with mock.patch("socket.gethostbyname") as gethostbyname:
+            self.assertEqual("localhost", keepalive.resolve("localhost"))
+            self.assertFalse(gethostbyname.called)
+
+    @override_settings(DNS_CACHE_TTL=0)
+    def test_resolve_is_disabled_without_ttl(self):
+        with mock.patch("socket.gethostbyname") as gethostbyname:
+            self.assertEqual("db.example.com",
+                             keepalive.resolve("db.example.com"))
+            self.assertFalse(gethostbyname.called)
+
+
+class PoolTestCase(TestCase):
+
+    key = ("10.0.0.1", "root", "", "")
+
+    def test_checkin_keeps_up_to_size_connections(self):
+        pool = keepalive.Pool(size=1)
+        first, second = mock.Mock(), mock.Mock()
+        self.assertTrue(pool.checkin(self.key, first))
+        self.assertFalse(pool.checkin(self.key, second))
+        first.rollback.assert_called_once_with()
+        self.assertIs(first, pool.checkout(self.key))
+        first.ping.assert_called_once_with()
+        self.assertIsNone(pool.checkout(self.key))
+
+    def test_checkout_drops_dead_connections(self):
+        pool = keepalive.Pool(size=1)
+        conn = mock.Mock()
+        conn.ping.side_effect = MySQLdb.OperationalError(2006, "gone away")
+        pool.checkin(self.key, conn)
+        self.assertIsNone(pool.checkout(self.key))
+        conn.close.assert_called_once_with()
+
+    def test_keepalive_pings_refills_and_expires_backends(self):
+        pool = keepalive.Pool(size=1, idle_timeout=60, connect_timeout=3)
+        dead = mock.Mock()
+        dead.ping.side_effect = MySQLdb.OperationalError(2006, "gone away")
+        pool.checkout(self.key)
+        pool.checkin(self.key, dead)
+        old_key = ("10.0.0.2", "root", "", "")
+        old = mock.Mock()
+        pool.checkout(old_key)
+        pool.checkin(old_key, old)
+        pool._last_used[old_key] = time.time() - 120
+        fresh = mock.Mock()
+        with mock.patch("mysqlapi.api.keepalive.connect") as connect:
+            connect.return_value = fresh
+            pool.keepalive()
+            connect.assert_called_once_with(self.key, 3)
+        dead.close.assert_called_once_with()
+        old.close.assert_called_once_with()
+        self.assertEqual([self.key], pool.backends())
+        self.assertIs(fresh, pool.checkout(self.key))
+
+
+class PooledConnectionTestCase(TestCase):
+
+    def test_open_and_close_go_through_the_pool(self):
+        pool = keepalive.Pool(size=1)
+        conn = mock.Mock()
+        with mock.patch("mysqlapi.api.keepalive.pool", pool):
+            with mock.patch("MySQLdb.connect") as connect:
+                connect.return_value = conn
+                c = Connection(hostname="localhost", username="root")
+                c.open()
+                c.close()
+                c.open()
+                c.close()
+                connect.assert_called_once_with("localhost", "root", "", "",
+                                                charset="utf8",
+                                                use_unicode=False)
+        self.assertFalse(conn.close.called)
+
+    def test_connect_timeout(self):
+        with mock.patch("MySQLdb.connect") as connect:
+            Connection(hostname="localhost", username="root",
+                       connect_timeout=2).open()
+            self.assertEqual(2, connect.call_args[1]["connect_timeout"])
@@ -0,0 +1,125 @@
+# Copyright 2015 mysqlapi authors. All rights reserved.
+# Use of this source code is governed by a BSD-style
+# license that can be found in the LICENSE file.
+
+import json
+import threading
+import time
+
+from django.test import TestCase
+from django.test.client import RequestFactory
+from django.test.utils import override_settings
+
+from mysqlapi.api import limits, schema
+from mysqlapi.api.views import export, metrics
+
+import mock
+
+
+class LimiterTestCase(TestCase):
+
+    def test_slot_counts_running_operations(self):
+        limiter = limits.Limiter("export", max_global=2, max_per_host=2)
+        with limiter.slot("10.0.0.1"):
+            m = limiter.metrics()
+            self.assertEqual(1, m["running"])
+            self.assertEqual({"10.0.0.1": 1}, m["per_host"])
+        m = limiter.metrics()
+        self.assertEqual(0, m["running"])
+        self.assertEqual({}, m["per_host"])
+        self.assertEqual(1, m["admitted"])
+
+    def test_acquire_rejects_with_429_when_the_queue_is_full(self):
+        limiter = limits.Limiter("export", max_global=1, queue=0,
+                                 retry_after=12)
+        limiter.acquire("10.0.0.1")
+        with self.assertRaises(limits.LimitExceeded) as cm:
+            limiter.acquire("10.0.0.2")
+        self.assertEqual(429, cm.exception.status)
+        self.assertEqual(12, cm.exception.retry_after)
+        self.assertEqual(1, limiter.metrics()["rejected"])
+
+    def test_acquire_times_out_with_503(self):
+        limiter = limits.Limiter("drop", max_global=5, max_per_host=1,
+                                 queue=1, timeout=0.05)
+        limiter.acquire("10.0.0.1")
+        with self.assertRaises(limits.LimitExceeded) as cm:
+            limiter.acquire("10.0.0.1")
+        self.assertEqual(503, cm.exception.status)
+        self.assertEqual(1, limiter.metrics()["timed_out"])
+        limiter.acquire("10.0.0.2")
+
+    def test_waiting_callers_run_when_a_slot_is_released(self):
+        limiter = limits.Limiter("export", max_global=1, queue=1, timeout=5)
+        limiter.acquire("10.0.0.1")
+        acquired = []
+
+        def wait():
+            limiter.acquire("10.0.0.1")
+            acquired.append(True)
+        t = threading.Thread(target=wait)
+        t.start()
+        while limiter.metrics()["waiting"] == 0:
+            time.sleep(0.001)
+        self.assertEqual([], acquired)
+        limiter.release("10.0.0.1")
+        t.join()
+        self.assertEqual([True], acquired)
+
+    def test_held_releases_the_slot_once_closed(self):
+        limiter = limits.Limiter("export")
+        limiter.acquire("10.0.0.1")
+        chunks = mock.MagicMock()
+        chunks.__iter__.return_value = iter(["a", "b"])
+        held = limiter.held("10.0.0.1", chunks)
+        self.assertEqual(["a", "b"], list(held))
+        self.assertEqual(1, limiter.metrics()["running"])
+        held.close()
+        held.close()
+        chunks.close.assert_called_once_with()
+        self.assertEqual(0, limiter.metrics()["running"])
+
+
+class LimitedViewsTestCase(TestCase):
+
+    def setUp(self):
+        limits.reset()
+        self.addCleanup(limits.reset)
+
+    @override_settings(CONCURRENCY_LIMITS={
+        "export": {"max_global": 1, "queue": 0, "retry_after": 7}})
+    def test_export_returns_429_with_retry_after(self):
+        limits.limiter("export").acquire("localhost")
+        request = RequestFactory().get("/")
+        response = export(request, "magneto")
+        self.assertEqual(429, response.status_code)
+        self.assertEqual("7", response["Retry-After"])
+
+    @mock.patch("mysqlapi.api.models.DatabaseManager.schema_fingerprint")
+    @mock.patch("mysqlapi.api.models.DatabaseManager.export")
+    def test_export_holds_its_slot_while_streaming(self, dump, fingerprint):
+        fingerprint.return_value = "abc"
+        dump.return_value = iter(["CREATE TABLE `foo`;\n"])
+        response = export(RequestFactory().get("/"), "magneto")
+        self.assertEqual(200, response.status_code)
+        self.assertEqual(1, limits.limiter("export").metrics()["running"])
+        self.assertEqual("CREATE TABLE `foo`;\n",
+                         "".join(response.streaming_content))
+        response.close()
+        self.assertEqual(0, limits.limiter("export").metrics()["running"])
+
+    @mock.patch("mysqlapi.api.models.DatabaseManager.schema_fingerprint")
+    def test_export_releases_its_slot_on_errors(self, fingerprint):
+        fingerprint.side_effect = schema.UnknownDatabase("magneto")
+        response = export(RequestFactory().get("/"), "magneto")
+        self.assertEqual(500, response.status_code)
+        self.assertEqual("Unknown database 'magneto' when selecting the "
+                         "database", response.content)
+        self.assertEqual(0, limits.limiter("export").metrics()["running"])
+
+    def test_metrics_reports_limiters(self):
+        limits.limiter("export").acquire("localhost")
+        response = metrics(RequestFactory().get("/metrics"))
+        self.assertEqual(200, response.status_code)
+        data = json.loads(response.content)
+        self.assertEqual(1, data["limits"]["export"]["running"])
@@ -16,6 +16,8 @@ from mysqlapi.api.models import (DatabaseCreationError, DatabaseManager,
                                  Instance, ProvisionedInstance,
                                  canonicalize_db_name)
 from mysqlapi.api import models
+from mysqlapi.api.management.commands.upgradedb import Command
+from mysqlapi.api.views import get_instance
 
 
 class DatabaseManagerTestCase(TestCase):
@@ -264,6 +266,44 @@ class ProvisionedInstanceTestCase(TestCase):
         self.assertEqual(255, field.max_length)
         self.assertTrue(field.blank)
 
+    def test_replica_of(self):
+        field = ProvisionedInstance._meta.get_field_by_name("replica_of")[0]
+        self.assertIsInstance(field, ForeignKey)
+        self.assertEqual(ProvisionedInstance, field.related.parent_model)
+        self.assertTrue(field.null)
+
+    def test_read_replicas(self):
+        instance = Instance.objects.create(name="reads", host="10.0.0.1",
+                                           state="running")
+        pi = ProvisionedInstance.objects.create(instance=instance,
+                                                host="10.0.0.1")
+        ProvisionedInstance.objects.create(host="10.0.0.2", port=3307,
+                                           admin_user="admin",
+                                           admin_password="secret",
+                                           replica_of=pi)
+        replicas = Instance.objects.get(pk=instance.pk).read_replicas()
+        self.assertEqual(["10.0.0.2"], [r.host for r in replicas])
+        self.assertEqual(3307, replicas[0].port)
+        self.assertEqual("admin", replicas[0].conn.username)
+        self.assertEqual("reads", replicas[0].name)
+
+    def test_read_replicas_of_shared_instances(self):
+        instance = Instance(name="reads", shared=True)
+        with self.settings(SHARED_READ_HOSTS=["r1", "r2"],
+                           SHARED_USER="api"):
+            replicas = instance.read_replicas()
+        self.assertEqual(["r1", "r2"], [r.host for r in replicas])
+        self.assertEqual("api", replicas[0].conn.username)
+
+    def test_replicas_are_not_allocated(self):
+        primary = ProvisionedInstance.objects.create(host="10.0.0.1")
+        ProvisionedInstance.objects.create(host="10.0.0.2",
+                                           replica_of=primary)
+        primary.instance = Instance.objects.create(name="taken")
+        primary.save()
+        with self.assertRaises(DatabaseCreationError):
+            models._create_from_pool(Instance(name="other"))
+
     def test_manager(self):
         pi = ProvisionedInstance(instance=Instance(name="mydb"),
                                  host="10.10.10.10",
@@ -383,3 +423,67 @@ class GeneratePasswordTestCase(TestCase):
         expected = hashlib.sha1("bla" + settings.SALT).hexdigest()
         result = models.generate_password("bla")
         self.assertEqual(expected, result)
+
+    def test_generate_password_takes_salt_changes_into_account(self):
+        with override_settings(SALT="salt"):
+            salted = models.generate_password("bla")
+        with override_settings(SALT="pepper"):
+            peppered = models.generate_password("bla")
+        self.assertNotEqual(salted, peppered)
+        expected = hashlib.sha1("blapepper").hexdigest()
+        self.assertEqual(expected, peppered)
+
+
+class InstanceQueriesTestCase(TestCase):
+
+    def setUp(self):
+        self.instance = Instance.objects.create(name="quick", host="10.0.0.1",
+                                                state="running")
+        self.pi = ProvisionedInstance.objects.create(instance=self.instance,
+                                                     host="10.0.0.1",
+                                                     admin_user="admin",
+                                                     admin_password="secret")
+
+    def test_instance_has_composite_index_for_the_creator_queue(self):
+        self.assertIn(("state", "shared"),
+                      [tuple(i) for i in Instance._meta.index_together])
+
+    def test_get_instance_fetches_provisioned_instance_in_one_query(self):
+        with self.assertNumQueries(1):
+            instance = get_instance("quick")
+            db = instance.db_manager()
+        self.assertEqual("admin", db.conn.username)
+        self.assertEqual("secret", db.conn.password)
+
+    def test_get_instance_without_provisioned_instance(self):
+        self.pi.delete()
+        with self.assertNumQueries(1):
+            db = get_instance("quick").db_manager()
+        self.assertEqual("root", db.conn.username)
+
+    def test_db_manager_without_select_related_needs_one_query(self):
+        instance = Instance.objects.get(name="quick")
+        with self.assertNumQueries(1):
+            db = instance.db_manager()
+        self.assertEqual("admin", db.conn.username)
+
+
+class UpgradeDbCommandTestCase(TestCase):
+
+    def test_upgradedb_is_idempotent(self):
+        Command().handle_noargs()
+        Command().handle_noargs()
+
+    def test_upgradedb_adds_missing_nullable_columns(self):
+        from django.db import connection
+
+        cursor = connection.cursor()
+        cursor.execute("CREATE TABLE upgrade_test (id integer PRIMARY KEY)")
+        model = mock.Mock()
+        model._meta.db_table = "upgrade_test"
+        model._meta.local_fields = [
+            f for f in Instance._meta.local_fields
+            if f.name in ("id", "requested_at", "failed_stage")]
+        self.assertEqual(2, Command().add_columns(cursor, model))
+        self.assertEqual(0, Command().add_columns(cursor, model))
+        cursor.execute("SELECT requested_at, failed_stage FROM upgrade_test")
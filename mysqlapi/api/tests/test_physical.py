@@ -0,0 +1,95 @@
+# Copyright 2015 mysqlapi authors. All rights reserved.
+# Use of this source code is governed by a BSD-style
+# license that can be found in the LICENSE file.
+
+import os
+import shutil
+import tempfile
+
+from unittest import TestCase
+
+from mysqlapi.api import physical
+
+import mock
+
+CHECKPOINTS = """backup_type = incremental
+from_lsn = 1626007
+to_lsn = 1626300
+last_lsn = 1626300
+compact = 0
+"""
+
+
+class PhysicalBackupTestCase(TestCase):
+
+    def setUp(self):
+        self.lsn_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.lsn_dir, True)
+
+    def test_read_checkpoints(self):
+        path = os.path.join(self.lsn_dir, physical.CHECKPOINTS)
+        with open(path, "w") as f:
+            f.write(CHECKPOINTS)
+        checkpoints = physical.read_checkpoints(path)
+        self.assertEqual("incremental", checkpoints["backup_type"])
+        self.assertEqual(1626007, checkpoints["from_lsn"])
+        self.assertEqual(1626300, checkpoints["to_lsn"])
+
+    def test_command(self):
+        cmd = physical.Backup(parallel=8).command("/tmp/lsn")
+        self.assertEqual(["xtrabackup", "--backup"], cmd[:2])
+        self.assertIn("--stream=xbstream", cmd)
+        self.assertIn("--parallel=8", cmd)
+        self.assertEqual(["--extra-lsndir", "/tmp/lsn"], cmd[-2:])
+        cmd = physical.Backup(incremental_lsn=1626007).command("/tmp/lsn")
+        self.assertFalse([c for c in cmd if c.startswith("--throttle")])
+        self.assertEqual("--incremental-lsn=1626007", cmd[-1])
+
+    def test_command_throttle(self):
+        cmd = physical.Backup(rate=50 * 1024 * 1024).command("/tmp/lsn")
+        self.assertEqual("--throttle=5", cmd[-1])
+        cmd = physical.Backup(rate=1024).command("/tmp/lsn")
+        self.assertEqual("--throttle=1", cmd[-1])
+
+    def test_stream_records_checkpoints(self):
+        def stream(cmd, block_size):
+            self.assertEqual(physical.BLOCK_SIZE, block_size)
+            with open(os.path.join(self.lsn_dir, physical.CHECKPOINTS),
+                      "w") as f:
+                f.write(CHECKPOINTS)
+            yield "xbstream"
+        hot = physical.Backup()
+        with mock.patch("tempfile.mkdtemp") as mkdtemp, \
+                mock.patch("mysqlapi.api.database.stream") as m:
+            mkdtemp.return_value = self.lsn_dir
+            m.side_effect = stream
+            self.assertEqual(["xbstream"], list(hot.stream()))
+        self.assertFalse(os.path.exists(self.lsn_dir))
+        meta = hot.meta(base="manifests/full")
+        self.assertEqual({"engine": "physical",
+                          "backup_type": "incremental",
+                          "from_lsn": 1626007,
+                          "to_lsn": 1626300,
+                          "base": "manifests/full"}, meta)
+
+    @mock.patch("mysqlapi.api.physical.prepare")
+    @mock.patch("mysqlapi.api.physical.extract")
+    def test_restore_applies_incremental_chain(self, extract, prepare):
+        chain = [{"manifest": "full"}, {"manifest": "inc1"},
+                 {"manifest": "inc2"}]
+        data_dir = physical.restore(chain, lambda e: e["manifest"], "/r")
+        self.assertEqual("/r/base", data_dir)
+        extract.assert_has_calls([mock.call("full", "/r/base"),
+                                  mock.call("inc1", "/r/inc1"),
+                                  mock.call("inc2", "/r/inc2")])
+        prepare.assert_has_calls([
+            mock.call("/r/base", apply_log_only=True),
+            mock.call("/r/base", "/r/inc1", apply_log_only=True),
+            mock.call("/r/base", "/r/inc2", apply_log_only=False),
+        ])
+
+    @mock.patch("mysqlapi.api.physical.prepare")
+    @mock.patch("mysqlapi.api.physical.extract")
+    def test_restore_full_backup(self, extract, prepare):
+        physical.restore([{"manifest": "full"}], lambda e: "data", "/r")
+        prepare.assert_called_once_with("/r/base", apply_log_only=False)
@@ -0,0 +1,156 @@
+# Copyright 2015 mysqlapi authors. All rights reserved.
+# Use of this source code is governed by a BSD-style
+# license that can be found in the LICENSE file.
+
+import MySQLdb
+
+from django.db.models.query import QuerySet
+from django.test import TestCase
+from django.test.client import RequestFactory
+from django.test.utils import override_settings
+
+from mysqlapi.api import models
+from mysqlapi.api.management.commands.poolusage import Command
+from mysqlapi.api.models import (DatabaseCreationError, Instance,
+                                 ProvisionedInstance)
+from mysqlapi.api.views import DropDatabase
+
+import mock
+
+
+@override_settings(USE_POOL=True, SHARED_SERVER=None, POOL_MAX_DATABASES=3,
+                   POOL_MAX_DISK=1000, POOL_MAX_CONNECTIONS=0)
+class PoolPackingTestCase(TestCase):
+
+    def setUp(self):
+        patcher = mock.patch("mysqlapi.api.models.DatabaseManager."
+                             "create_database")
+        self.addCleanup(patcher.stop)
+        self.create_database = patcher.start()
+        self.empty = ProvisionedInstance.objects.create(host="10.0.0.1")
+        self.busy = ProvisionedInstance.objects.create(host="10.0.0.2",
+                                                       admin_user="admin",
+                                                       admin_password="pw")
+
+    def tenant(self, name, host):
+        return Instance.objects.create(name=name, host=host.host,
+                                       state="running", pool_host=host)
+
+    def test_places_in_the_fullest_host_with_room(self):
+        self.tenant("one", self.busy)
+        instance = Instance(name="two")
+        models._create_from_pool(instance)
+        self.assertEqual(self.busy, instance.pool_host)
+        self.assertEqual("10.0.0.2", instance.host)
+        self.assertEqual("running", instance.state)
+        self.assertFalse(instance.shared)
+        self.assertIsNotNone(instance.pk)
+        self.create_database.assert_called_once_with()
+
+    def test_locks_the_hosts_while_placing(self):
+        select_for_update = QuerySet.select_for_update
+        locked = []
+
+        def lock(queryset, *args, **kwargs):
+            locked.append(queryset.model)
+            return select_for_update(queryset, *args, **kwargs)
+        with mock.patch.object(QuerySet, "select_for_update", lock):
+            models._create_from_pool(Instance(name="one"))
+        self.assertEqual([ProvisionedInstance], locked)
+
+    def test_drop_keeps_the_instance_state(self):
+        instance = self.tenant("one", self.busy)
+        with mock.patch("mysqlapi.api.models.DatabaseManager."
+                        "drop_database"):
+            self.busy.remove(instance)
+        self.assertEqual("running", instance.state)
+        self.assertIsNone(instance.pool_host)
+
+    def test_skips_hosts_without_databases_left(self):
+        for name in ("one", "two", "three"):
+            self.tenant(name, self.busy)
+        instance = Instance(name="four")
+        models._create_from_pool(instance)
+        self.assertEqual(self.empty, instance.pool_host)
+
+    def test_skips_hosts_without_disk_left(self):
+        self.tenant("one", self.busy)
+        self.busy.disk_used = 1000
+        self.busy.save()
+        instance = Instance(name="two")
+        models._create_from_pool(instance)
+        self.assertEqual(self.empty, instance.pool_host)
+
+    def test_host_limits_override_the_settings(self):
+        self.tenant("one", self.busy)
+        self.busy.max_databases = 1
+        self.busy.save()
+        self.assertEqual((1, 1000, 0), self.busy.limits())
+        instance = Instance(name="two")
+        models._create_from_pool(instance)
+        self.assertEqual(self.empty, instance.pool_host)
+
+    def test_skips_dedicated_hosts_and_replicas(self):
+        self.empty.instance = self.tenant("dedicated", self.busy)
+        self.empty.save()
+        ProvisionedInstance.objects.create(host="10.0.0.3",
+                                           replica_of=self.busy)
+        self.busy.max_connections = 10
+        self.busy.connections_used = 10
+        self.busy.save()
+        with self.assertRaises(DatabaseCreationError):
+            models._create_from_pool(Instance(name="other"))
+
+    def test_dedicated_mode_skips_hosts_with_tenants(self):
+        self.tenant("one", self.busy)
+        self.empty.delete()
+        with self.settings(POOL_MAX_DATABASES=1):
+            with self.assertRaises(DatabaseCreationError):
+                models._create_from_pool(Instance(name="other"))
+
+    def test_db_manager_uses_the_pool_host(self):
+        instance = self.tenant("one", self.busy)
+        db = Instance.objects.get(pk=instance.pk).db_manager()
+        self.assertEqual("10.0.0.2", db.host)
+        self.assertEqual("admin", db.conn.username)
+        self.assertEqual("pw", db.conn.password)
+
+    @mock.patch("mysqlapi.api.models.DatabaseManager.drop_database")
+    def test_drop_removes_only_the_tenant(self, drop_database):
+        self.tenant("one", self.busy)
+        self.tenant("two", self.busy)
+        request = RequestFactory().delete("/")
+        response = DropDatabase.as_view()(request, "one")
+        self.assertEqual(200, response.status_code)
+        drop_database.assert_called_once_with()
+        self.assertEqual(["two"], [i.name for i in self.busy.tenants.all()])
+
+    def test_refresh_usage(self):
+        conn = mock.Mock()
+        cursor = conn.cursor.return_value
+        cursor.fetchone.side_effect = iter([(2048L,),
+                                            ("Threads_connected", "7")])
+        with mock.patch("mysqlapi.api.models.Connection") as connection:
+            connection.return_value = conn
+            self.busy.refresh_usage()
+        busy = ProvisionedInstance.objects.get(pk=self.busy.pk)
+        self.assertEqual(2048, busy.disk_used)
+        self.assertEqual(7, busy.connections_used)
+        self.assertIsNotNone(busy.usage_updated_at)
+        conn.close.assert_called_once_with()
+
+    def test_poolusage(self):
+        self.tenant("one", self.busy)
+
+        def refresh(host):
+            if host.pk == self.empty.pk:
+                raise MySQLdb.OperationalError(2003, "Can't connect")
+            host.disk_used, host.connections_used = 500, 4
+        m = "mysqlapi.api.models.ProvisionedInstance.refresh_usage"
+        with mock.patch(m, autospec=True) as refresh_usage:
+            refresh_usage.side_effect = refresh
+            output = Command().handle_noargs()
+        lines = output.splitlines()
+        self.assertIn(u"unreachable: Can't connect", lines[1])
+        self.assertEqual([u"10.0.0.2:3306", u"1/3", u"500/1000", u"4/-"],
+                         lines[2].split())
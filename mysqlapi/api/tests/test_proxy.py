@@ -0,0 +1,92 @@
+# Copyright 2015 mysqlapi authors. All rights reserved.
+# Use of this source code is governed by a BSD-style
+# license that can be found in the LICENSE file.
+
+import json
+
+from django.test import TestCase
+from django.test.client import RequestFactory
+from django.test.utils import override_settings
+
+from mysqlapi.api import proxy
+from mysqlapi.api.models import Instance
+from mysqlapi.api.views import BindApp, DropDatabase
+
+import mock
+
+
+@override_settings(PROXY_HOST="proxy", PROXY_PORT=6033, PROXY_HOSTGROUP=1,
+                   PROXY_MAX_CONNECTIONS=500, SHARED_SERVER="shared")
+class ProxyTestCase(TestCase):
+
+    def setUp(self):
+        patcher = mock.patch("mysqlapi.api.proxy.connect")
+        self.addCleanup(patcher.stop)
+        self.conn = patcher.start().return_value
+        self.cursor = self.conn.cursor.return_value
+
+    def statements(self):
+        return [c[0] for c in self.cursor.execute.call_args_list]
+
+    def test_enabled(self):
+        self.assertTrue(proxy.enabled(Instance(name="app", shared=True)))
+        self.assertFalse(proxy.enabled(Instance(name="app", shared=False)))
+        with self.settings(PROXY_HOST=None):
+            self.assertFalse(proxy.enabled(Instance(name="app", shared=True)))
+
+    def test_register(self):
+        proxy.register("app", "secret", "app")
+        statements = self.statements()
+        self.assertTrue(statements[0][0].startswith(
+            "REPLACE INTO mysql_users"))
+        self.assertEqual(("app", "secret", 1, "app", 500), statements[0][1])
+        self.assertEqual([("LOAD MYSQL USERS TO RUNTIME",),
+                          ("SAVE MYSQL USERS TO DISK",)], statements[1:])
+        self.conn.close.assert_called_once_with()
+
+    def test_unregister(self):
+        proxy.unregister("app")
+        self.assertEqual(("DELETE FROM mysql_users WHERE username = %s",
+                          ("app",)), self.statements()[0])
+        self.conn.close.assert_called_once_with()
+
+    @mock.patch("mysqlapi.api.models.DatabaseManager.create_user")
+    def test_bind_returns_the_proxy(self, create_user):
+        create_user.return_value = ("app", "secret")
+        Instance.objects.create(name="app", shared=True, state="running")
+        request = RequestFactory().post("/", {"unit-host": "192.168.1.1"})
+        response = BindApp.as_view()(request, "app")
+        self.assertEqual(201, response.status_code)
+        config = json.loads(response.content)
+        self.assertEqual("proxy", config["MYSQL_HOST"])
+        self.assertEqual("6033", config["MYSQL_PORT"])
+        self.assertEqual("REPLACE", self.statements()[0][0][:7])
+
+    @mock.patch("mysqlapi.api.models.DatabaseManager.create_user")
+    def test_bind_dedicated_instance_skips_the_proxy(self, create_user):
+        create_user.return_value = ("app", "secret")
+        Instance.objects.create(name="app", host="10.0.0.1", state="running")
+        request = RequestFactory().post("/", {"unit-host": "192.168.1.1"})
+        response = BindApp.as_view()(request, "app")
+        config = json.loads(response.content)
+        self.assertEqual("10.0.0.1", config["MYSQL_HOST"])
+        self.assertEqual("3306", config["MYSQL_PORT"])
+        self.assertFalse(self.cursor.execute.called)
+
+    @mock.patch("mysqlapi.api.models.DatabaseManager.drop_user")
+    def test_unbind_removes_the_user(self, drop_user):
+        Instance.objects.create(name="app", shared=True, state="running")
+        request = RequestFactory().delete("/")
+        response = BindApp.as_view()(request, "app")
+        self.assertEqual(200, response.status_code)
+        self.assertEqual(("app",), self.statements()[0][1])
+
+    def test_drop_removes_the_user(self):
+        Instance.objects.create(name="app", shared=True, state="running")
+        request = RequestFactory().delete("/resources/app")
+        with mock.patch("mysqlapi.api.purge.detach"), \
+                mock.patch("mysqlapi.api.database.Connection.open"):
+            response = DropDatabase.as_view()(request, name="app")
+        self.assertEqual(200, response.status_code)
+        self.assertEqual(("DELETE FROM mysql_users WHERE username = %s",
+                          ("app",)), self.statements()[0])
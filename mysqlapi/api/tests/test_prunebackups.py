@@ -0,0 +1,80 @@
+# Copyright 2015 mysqlapi authors. All rights reserved.
+# Use of this source code is governed by a BSD-style
+# license that can be found in the LICENSE file.
+
+import calendar
+
+from unittest import TestCase
+
+from mysqlapi.api.management.commands import s3
+from mysqlapi.api.management.commands.prunebackups import Command
+
+import mock
+
+
+class PruneBackupsCommandTestCase(TestCase):
+
+    def setUp(self):
+        self.bucket = mock.Mock()
+        self.bucket.list.return_value = [
+            self.item("instances/foo/"), self.item("instances/bar/"),
+            self.item("instances/stray")]
+        patcher = mock.patch.object(s3, "bucket")
+        patcher.start().return_value = self.bucket
+        self.addCleanup(patcher.stop)
+        patcher = mock.patch.object(s3, "session")
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def item(self, name):
+        item = mock.Mock()
+        item.name = name
+        return item
+
+    def test_instance_prefixes(self):
+        self.assertEqual(["instances/foo/", "instances/bar/"],
+                         list(s3.instance_prefixes(self.bucket)))
+        self.bucket.list.assert_called_with(prefix="instances/",
+                                            delimiter="/")
+
+    @mock.patch.object(s3, "prune")
+    def test_prunes_shared_and_instance_backups(self, prune):
+        prune.side_effect = lambda keep, max_age, prefix="": [prefix]
+        result = Command().handle(keep=2, max_age_days=1, legacy=False)
+        self.assertEqual([mock.call(2, 86400),
+                          mock.call(2, 86400, prefix="instances/foo/"),
+                          mock.call(2, 86400, prefix="instances/bar/")],
+                         prune.call_args_list)
+        self.assertEqual(u"Pruned 3 backups and 0 legacy dumps.", result)
+
+
+class LegacyKeysTestCase(TestCase):
+
+    def item(self, name, last_modified):
+        item = mock.Mock(last_modified=last_modified)
+        item.name = name
+        return item
+
+    def test_old_dumps_except_the_last_one(self):
+        bucket = mock.Mock()
+        bucket.get_key.return_value.get_contents_as_string.return_value = \
+            "last"
+        bucket.list.return_value = [
+            self.item("old", "2015-01-01T00:00:00.000Z"),
+            self.item("last", "2015-01-01T00:00:00.000Z"),
+            self.item("recent", "2015-01-02T11:30:00.000Z"),
+            self.item("lastkey", "2015-01-01T00:00:00.000Z"),
+            self.item("manifests/uuid", "2015-01-01T00:00:00.000Z")]
+        now = calendar.timegm((2015, 1, 2, 12, 0, 0))
+        self.assertEqual(["old"],
+                         list(s3.legacy_keys(bucket, 3600, now=now)))
+        bucket.get_key.assert_called_once_with("lastkey")
+
+    def test_without_lastkey(self):
+        bucket = mock.Mock()
+        bucket.get_key.return_value = None
+        bucket.list.return_value = [
+            self.item("old", "2015-01-01T00:00:00.000Z")]
+        now = calendar.timegm((2015, 1, 2, 12, 0, 0))
+        self.assertEqual(["old"],
+                         list(s3.legacy_keys(bucket, 3600, now=now)))
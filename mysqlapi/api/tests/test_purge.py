@@ -0,0 +1,97 @@
+# Copyright 2015 mysqlapi authors. All rights reserved.
+# Use of this source code is governed by a BSD-style
+# license that can be found in the LICENSE file.
+
+import json
+
+from django.test import TestCase
+from django.test.client import RequestFactory
+from django.test.utils import override_settings
+
+from mysqlapi.api import jobs, purge
+from mysqlapi.api.models import Instance, Job
+from mysqlapi.api.tests import mocks
+from mysqlapi.api.views import DropDatabase
+
+import mock
+
+ROWS = {
+    "SHOW TRIGGERS FROM `app`": [("audit", "INSERT", "users")],
+    "SELECT table_name FROM": [("posts",), ("users",)],
+    "SELECT table_name, ": [("small", 10L), ("big", 1000L)],
+}
+
+
+class PurgeTestCase(TestCase):
+
+    def test_trash_name(self):
+        self.assertEqual("purge$1400000000$app",
+                         purge.trash_name("app", 1400000000))
+        self.assertEqual(64, len(purge.trash_name("a" * 64)))
+
+    def test_detach_moves_the_tables_out(self):
+        conn = mocks.FakeConnection(ROWS)
+        purge.detach(conn, "app", "purge$1$app")
+        self.assertEqual([
+            "CREATE DATABASE `purge$1$app`",
+            "SHOW TRIGGERS FROM `app`",
+            "DROP TRIGGER `app`.`audit`",
+            "SELECT table_name FROM information_schema.tables WHERE "
+            "table_schema = %s AND table_type = 'BASE TABLE'",
+            "RENAME TABLE `app`.`posts` TO `purge$1$app`.`posts`, "
+            "`app`.`users` TO `purge$1$app`.`users`",
+            "DROP DATABASE `app`",
+        ], conn.log)
+
+    def test_purge_drops_one_table_at_a_time(self):
+        conn = mocks.FakeConnection(ROWS)
+        limiter = mock.Mock()
+        progress = mock.Mock()
+        self.assertEqual(1010, purge.purge(conn, "trash", limiter, progress))
+        self.assertEqual(["DROP TABLE IF EXISTS `trash`.`small`",
+                          "DROP TABLE IF EXISTS `trash`.`big`",
+                          "DROP DATABASE IF EXISTS `trash`"], conn.log[1:])
+        self.assertEqual([mock.call(10), mock.call(1000)],
+                         limiter.consume.call_args_list)
+        self.assertEqual([mock.call(10), mock.call(1010)],
+                         progress.call_args_list)
+
+
+class PurgeJobTestCase(TestCase):
+
+    def setUp(self):
+        self.conn = mocks.FakeConnection(ROWS)
+        patcher = mock.patch("mysqlapi.api.purge.shared_connection")
+        patcher.start().return_value = self.conn
+        self.addCleanup(patcher.stop)
+        patcher = mock.patch("mysqlapi.api.purge.shared_throttle")
+        self.load, self.limiter = mock.Mock(), mock.Mock()
+        patcher.start().return_value = (self.load, self.limiter)
+        self.addCleanup(patcher.stop)
+
+    def test_purge_job_runs_without_its_instance(self):
+        job = Job.objects.create(instance_name="app", kind="purge",
+                                 source="purge$1$app")
+        jobs.JobRunner(interval=5).run_once()
+        job = Job.objects.get(pk=job.pk)
+        self.assertEqual("done", job.state)
+        self.assertEqual((1010, 1010), (job.bytes_done, job.bytes_total))
+        self.assertIn("DROP DATABASE IF EXISTS `purge$1$app`", self.conn.log)
+        self.load.close.assert_called_once_with()
+
+    @override_settings(SHARED_SERVER="127.0.0.1")
+    def test_shared_drop_detaches_and_starts_a_purge(self):
+        Instance.objects.create(name="app", state="running", shared=True)
+        request = RequestFactory().delete("/resources/app")
+        with mock.patch("mysqlapi.api.purge.detach") as detach, \
+                mock.patch("mysqlapi.api.database.Connection.open"), \
+                mock.patch("mysqlapi.api.purge.trash_name") as trash_name:
+            trash_name.return_value = "purge$1$app"
+            response = DropDatabase.as_view()(request, name="app")
+        self.assertEqual(200, response.status_code)
+        self.assertEqual(("app", "purge$1$app"), detach.call_args[0][1:])
+        self.assertFalse(Instance.objects.filter(name="app").exists())
+        data = json.loads(response.content)
+        job = Job.objects.get(pk=data["id"])
+        self.assertEqual(("purge", "pending", "purge$1$app"),
+                         (job.kind, job.state, job.source))
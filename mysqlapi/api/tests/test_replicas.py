@@ -0,0 +1,105 @@
+# Copyright 2015 mysqlapi authors. All rights reserved.
+# Use of this source code is governed by a BSD-style
+# license that can be found in the LICENSE file.
+
+import json
+
+from django.test import TestCase
+from django.test.client import RequestFactory
+from django.test.utils import override_settings
+
+from mysqlapi.api.models import (DatabaseManager, Instance,
+                                 ProvisionedInstance, UserNotReplicated)
+from mysqlapi.api.views import BindApp
+
+import mock
+
+
+class BindReplicasTestCase(TestCase):
+
+    def setUp(self):
+        self.instance = Instance.objects.create(name="reads",
+                                                host="10.0.0.1",
+                                                state="running")
+        self.pi = ProvisionedInstance.objects.create(instance=self.instance,
+                                                     host="10.0.0.1")
+        patcher = mock.patch("mysqlapi.api.models.DatabaseManager."
+                             "create_user", autospec=True)
+        self.addCleanup(patcher.stop)
+        self.create_user = patcher.start()
+        self.create_user.return_value = ("reads", "secret")
+        patcher = mock.patch("mysqlapi.api.models.DatabaseManager."
+                             "wait_for_user", autospec=True)
+        self.addCleanup(patcher.stop)
+        self.wait_for_user = patcher.start()
+        self.wait_for_user.return_value = ("reads", "secret")
+
+    def bind(self):
+        request = RequestFactory().post("/", {"unit-host": "192.168.1.1"})
+        response = BindApp.as_view()(request, "reads")
+        self.assertEqual(201, response.status_code)
+        return json.loads(response.content)
+
+    @override_settings(REPLICA_GRANT_TIMEOUT=3)
+    def test_bind_waits_for_the_user_on_replicas(self):
+        ProvisionedInstance.objects.create(host="10.0.0.2",
+                                           replica_of=self.pi)
+        ProvisionedInstance.objects.create(host="10.0.0.3", port=3307,
+                                           replica_of=self.pi)
+        config = self.bind()
+        self.assertEqual("10.0.0.2,10.0.0.3", config["MYSQL_READ_HOSTS"])
+        self.assertEqual("3306,3307", config["MYSQL_READ_PORTS"])
+        self.assertEqual("10.0.0.1", config["MYSQL_HOST"])
+        hosts = [c[0][0].host for c in self.create_user.call_args_list]
+        self.assertEqual(["10.0.0.1"], hosts)
+        calls = [(c[0][0].host, c[0][1:])
+                 for c in self.wait_for_user.call_args_list]
+        self.assertEqual([("10.0.0.2", ("reads", 3)),
+                          ("10.0.0.3", ("reads", 3))], calls)
+
+    def test_bind_without_replicas(self):
+        config = self.bind()
+        self.assertNotIn("MYSQL_READ_HOSTS", config)
+        self.assertNotIn("MYSQL_READ_PORTS", config)
+        self.assertEqual(1, self.create_user.call_count)
+        self.assertFalse(self.wait_for_user.called)
+
+    def test_bind_fails_on_replica(self):
+        ProvisionedInstance.objects.create(host="10.0.0.2",
+                                           replica_of=self.pi)
+        self.wait_for_user.side_effect = UserNotReplicated("reads",
+                                                           "10.0.0.2")
+        request = RequestFactory().post("/", {"unit-host": "192.168.1.1"})
+        response = BindApp.as_view()(request, "reads")
+        self.assertEqual(500, response.status_code)
+        self.assertEqual("User reads was not replicated to 10.0.0.2 yet.",
+                         response.content)
+
+
+class WaitForUserTestCase(TestCase):
+
+    def test_waits_for_replication_without_writing(self):
+        db = DatabaseManager("reads", host="10.0.0.2")
+        answers = iter([False, False, True])
+        with mock.patch.object(db, "conn") as conn, \
+                mock.patch("mysqlapi.api.grants.granted") as granted, \
+                mock.patch("time.sleep") as sleep:
+            granted.side_effect = lambda *args: next(answers)
+            user, password = db.wait_for_user("reads", timeout=10)
+            cursor = conn.cursor.return_value
+            self.assertEqual([mock.call("ROLLBACK")] * 2,
+                             cursor.execute.call_args_list)
+            self.assertEqual(2, sleep.call_count)
+            conn.close.assert_called_once_with()
+        self.assertEqual((user, "reads", password),
+                         granted.call_args[0][1:])
+
+    def test_gives_up_after_the_timeout(self):
+        db = DatabaseManager("reads", host="10.0.0.2")
+        with mock.patch.object(db, "conn") as conn, \
+                mock.patch("mysqlapi.api.grants.granted") as granted, \
+                mock.patch("time.sleep"):
+            granted.return_value = False
+            with self.assertRaises(UserNotReplicated):
+                db.wait_for_user("reads", timeout=0)
+            conn.close.assert_called_once_with()
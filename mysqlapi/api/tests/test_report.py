@@ -0,0 +1,90 @@
+# Copyright 2015 mysqlapi authors. All rights reserved.
+# Use of this source code is governed by a BSD-style
+# license that can be found in the LICENSE file.
+
+import datetime
+import json
+
+from django.test import TestCase
+from django.test.client import RequestFactory
+from django.utils import timezone
+
+from mysqlapi.api import report
+from mysqlapi.api.management.commands.provisioningreport import Command
+from mysqlapi.api.models import Instance
+from mysqlapi.api.views import provisioning_report
+
+
+class ReportTestCase(TestCase):
+
+    def setUp(self):
+        self.now = timezone.now()
+        for i, boot in enumerate([30, 40, 50, 60, 200]):
+            self.create("ready%d" % i, boot, 2, 4)
+        self.create("noauth", 45, None, None, failed_stage="authorize")
+        self.create("nodb", 45, 2, None, failed_stage="create_database")
+        self.create("booting", None, None, None)
+        self.create("noboot", None, None, None, failed_stage="ec2_boot")
+        self.create("nolaunch", None, None, None, failed_stage="ec2_boot",
+                    ec2_id=None)
+        self.create("old", 10, 1, 2, age=30)
+        Instance.objects.create(name="shared", shared=True,
+                                requested_at=self.now)
+
+    def create(self, name, *stages, **kwargs):
+        at = self.now - datetime.timedelta(days=kwargs.pop("age", 1))
+        fields = {"requested_at": at}
+        for (stage, started, finished), elapsed in zip(report.STAGES,
+                                                       stages):
+            if elapsed is None:
+                break
+            at += datetime.timedelta(seconds=elapsed)
+            fields[finished] = at
+        else:
+            fields["ready_at"] = at
+        fields.setdefault("ec2_id", "i-" + name)
+        fields.update(kwargs)
+        return Instance.objects.create(name=name, **fields)
+
+    def test_percentile(self):
+        self.assertEqual(50, report.percentile(range(1, 101), 50))
+        self.assertEqual(99, report.percentile(range(1, 101), 99))
+        self.assertEqual(7, report.percentile([7], 90))
+        self.assertIsNone(report.percentile([], 50))
+
+    def test_provisioning(self):
+        data = report.provisioning(Instance, days=7, now=self.now)
+        self.assertEqual(10, data["requested"])
+        self.assertEqual(5, data["ready"])
+        self.assertEqual(4, data["failed"])
+        self.assertEqual(["authorize", "create_database", "ec2_boot"],
+                         sorted(data["stages"]))
+        boot = data["stages"]["ec2_boot"]
+        self.assertEqual(7, boot["count"])
+        self.assertEqual(45, boot["p50"])
+        self.assertEqual(200, boot["max"])
+        self.assertEqual(2, boot["failed"])
+        self.assertAlmostEqual(2 / 10.0, boot["failure_rate"])
+        authorize = data["stages"]["authorize"]
+        self.assertEqual(1, authorize["failed"])
+        self.assertAlmostEqual(1 / 7.0, authorize["failure_rate"])
+        create = data["stages"]["create_database"]
+        self.assertAlmostEqual(1 / 6.0, create["failure_rate"])
+        self.assertEqual(56, data["time_to_ready"]["p50"])
+        self.assertEqual(206, data["time_to_ready"]["p99"])
+
+    def test_view(self):
+        request = RequestFactory().get("/metrics/provisioning", {"days": 60})
+        response = provisioning_report(request)
+        self.assertEqual(200, response.status_code)
+        data = json.loads(response.content)
+        self.assertEqual(11, data["requested"])
+
+    def test_command(self):
+        output = Command().handle(days=7)
+        self.assertIn("10 instances requested in the last 7 days", output)
+        self.assertIn("ec2_boot", output)
+
+    def test_view_validates_days(self):
+        request = RequestFactory().get("/metrics/provisioning", {"days": "x"})
+        self.assertEqual(400, provisioning_report(request).status_code)
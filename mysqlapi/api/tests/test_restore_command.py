@@ -4,9 +4,54 @@
 
 from unittest import TestCase
 
+from django.core.management.base import CommandError
+
 from mysqlapi.api.management.commands.restore import Command
 
+import mock
+
+BACKUPS = [
+    {"manifest": "manifests/dump", "created_at": 100},
+    {"manifest": "manifests/full", "created_at": 200, "engine": "physical"},
+    {"manifest": "manifests/inc", "created_at": 300, "engine": "physical",
+     "base": "manifests/full"},
+]
+
 
 class RestoreCommandTestCase(TestCase):
-    def test_restore(self):
+
+    def setUp(self):
+        s3 = "mysqlapi.api.management.commands.s3."
+        for name in ("bucket", "catalog", "iter_data", "get_data"):
+            patcher = mock.patch(s3 + name)
+            setattr(self, name, patcher.start())
+            self.addCleanup(patcher.stop)
+        self.catalog.return_value = BACKUPS
+
+    @mock.patch("mysqlapi.api.database.restore")
+    def test_restore(self, restore):
+        Command().handle_noargs(backup="manifests/dump")
+        self.iter_data.assert_called_with(self.bucket.return_value,
+                                          "manifests/dump")
+        restore.assert_called_with(self.iter_data.return_value)
+
+    @mock.patch("mysqlapi.api.database.restore")
+    def test_restore_pre_catalog_dump(self, restore):
+        self.catalog.return_value = []
         Command().handle_noargs()
+        self.get_data.assert_called_with(None)
+        restore.assert_called_with([self.get_data.return_value])
+
+    @mock.patch("mysqlapi.api.physical.restore")
+    def test_restore_physical_chain(self, restore):
+        restore.return_value = "/restore/base"
+        message = Command().handle_noargs(target_dir="/restore")
+        chain, fetch, target_dir = restore.call_args[0]
+        self.assertEqual(["manifests/full", "manifests/inc"],
+                         [e["manifest"] for e in chain])
+        self.assertEqual("/restore", target_dir)
+        self.assertIn("/restore/base", message)
+
+    def test_restore_physical_requires_target_dir(self):
+        with self.assertRaises(CommandError):
+            Command().handle_noargs()
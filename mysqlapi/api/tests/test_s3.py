@@ -2,10 +2,17 @@
 # Use of this source code is governed by a BSD-style
 # license that can be found in the LICENSE file.
 
+import hashlib
+import json
+import time
+
+from email.utils import formatdate
+
 from unittest import TestCase
 from django.conf import settings
 from django.test.utils import override_settings
 
+from mysqlapi.api import backup
 from mysqlapi.api.management.commands import s3
 
 import mock
@@ -30,6 +37,13 @@ class S3TestCase(TestCase):
             s3.bucket()
             s3_instance.get_bucket.assert_called_with(bucket)
 
+    def test_session_reuses_the_connection(self):
+        with mock.patch("boto.s3.connection.S3Connection") as s3con:
+            with s3.session():
+                self.assertIs(s3.bucket(), s3.bucket())
+            s3.bucket()
+            self.assertEqual(2, s3con.call_count)
+
     def test_last_key(self):
         m = "mysqlapi.api.management.commands.s3.bucket"
         with mock.patch(m) as bucket_mock:
@@ -41,26 +55,60 @@ class S3TestCase(TestCase):
             self.assertEqual("last_key", s3.last_key())
 
     def test_store_data(self):
-        with mock.patch("mysqlapi.api.management.commands.s3.bucket"):
+        m = "mysqlapi.api.management.commands.s3.bucket"
+        with mock.patch(m) as bucket_mock:
+            bucket_mock.return_value.get_key.return_value = None
             with mock.patch("boto.s3.key.Key") as Key:
                 key = Key.return_value
                 s3.store_data("data")
-                key.set_contents_from_string.assert_any_call("data")
+                name = backup.address("data")
+                Key.assert_any_call(bucket_mock.return_value,
+                                    "chunks/" + name)
+                key.set_contents_from_string.assert_any_call(
+                    backup.pack("data"))
+                manifest = json.loads(
+                    key.set_contents_from_string.call_args_list[1][0][0])
+                self.assertEqual([name], manifest["chunks"])
+                self.assertEqual(4, manifest["size"])
+
+    def test_store_data_skips_chunks_already_stored(self):
+        data = "line\n" * 10
+        m = "mysqlapi.api.management.commands.s3.bucket"
+        with mock.patch(m) as bucket_mock:
+            existing = mock.Mock(last_modified=formatdate(usegmt=True))
+            bucket_mock.return_value.get_key.side_effect = \
+                lambda name: None if name == "catalog.json" else existing
+            with mock.patch("boto.s3.key.Key") as Key:
+                key = Key.return_value
+                s3.store_data(data)
+                self.assertEqual(3, key.set_contents_from_string.call_count)
+                manifest = json.loads(
+                    key.set_contents_from_string.call_args_list[0][0][0])
+                self.assertEqual(0, manifest["stored"])
+                self.assertEqual(len(data), manifest["size"])
+                self.assertFalse(bucket_mock.return_value.copy_key.called)
 
     def test_store_data_should_use_uuid_in_key_name(self):
-        with mock.patch("mysqlapi.api.management.commands.s3.bucket"):
+        m = "mysqlapi.api.management.commands.s3.bucket"
+        with mock.patch(m) as bucket_mock:
+            bucket_mock.return_value.get_key.return_value = None
             with mock.patch("boto.s3.key.Key") as Key:
                 key = Key.return_value
-                with mock.patch("uuid.uuid4"):
+                with mock.patch("uuid.uuid4") as uuid4:
+                    uuid4.return_value = mock.Mock(hex="uuid")
                     s3.store_data("data")
                     key.set_contents_from_string.assert_called_with(Key().name)
+                    Key.assert_any_call(bucket_mock.return_value,
+                                        "manifests/uuid")
 
     def test_store_data_should_store_last_key(self):
-        with mock.patch("mysqlapi.api.management.commands.s3.bucket"):
+        m = "mysqlapi.api.management.commands.s3.bucket"
+        with mock.patch(m) as bucket_mock:
+            bucket_mock.return_value.get_key.return_value = None
             with mock.patch("uuid.uuid4") as uuid4:
                 uuid4.return_value = mock.Mock(hex="uuid")
                 key = s3.store_data("data")
-        self.assertEqual("uuid", key.name)
+        self.assertEqual("manifests/uuid", key.name)
 
     def test_get_data(self):
         m = "mysqlapi.api.management.commands.s3.bucket"
@@ -71,3 +119,199 @@ class S3TestCase(TestCase):
             bucket.get_key.return_value = key
             bucket_mock.return_value = bucket
             self.assertEqual("last_key", s3.get_data())
+
+    def test_get_data_from_manifest(self):
+        data = "first line\nsecond line\n"
+        names = [backup.address("first line\n"),
+                 backup.address("second line\n")]
+        manifest = {
+            "chunks": names,
+            "checksum": hashlib.sha256(data).hexdigest(),
+        }
+        objects = {
+            "lastmanifest": "manifests/abc",
+            "manifests/abc": json.dumps(manifest),
+            "chunks/" + names[0]: backup.pack("first line\n"),
+            "chunks/" + names[1]: backup.pack("second line\n"),
+        }
+
+        def get_key(name):
+            return mock.Mock(**{
+                "get_contents_as_string.return_value": objects[name]})
+        m = "mysqlapi.api.management.commands.s3.bucket"
+        with mock.patch(m) as bucket_mock:
+            bucket_mock.return_value.get_key.side_effect = get_key
+            self.assertEqual(data, s3.get_data())
+
+
+class CatalogTestCase(TestCase):
+
+    def setUp(self):
+        self.objects = {}
+        self.modified = {}
+        self.bucket = mock.Mock()
+        self.bucket.get_key.side_effect = self.get_key
+        self.bucket.list.side_effect = self.list
+        self.bucket.copy_key.side_effect = self.copy_key
+        self.bucket.delete_keys.side_effect = self.delete_keys
+        patcher = mock.patch("mysqlapi.api.management.commands.s3.bucket")
+        patcher.start().return_value = self.bucket
+        self.addCleanup(patcher.stop)
+        patcher = mock.patch("boto.s3.key.Key", self.Key)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def Key(self, bucket, name):
+        test = self
+
+        class Key(object):
+            def set_contents_from_string(self, data):
+                test.objects[name] = data
+                test.modified[name] = time.time()
+        key = Key()
+        key.name = name
+        return key
+
+    def get_key(self, name):
+        if name not in self.objects:
+            return None
+        return mock.Mock(**{
+            "last_modified": formatdate(self.modified[name], usegmt=True),
+            "get_contents_as_string.return_value": self.objects[name]})
+
+    def list(self, prefix=""):
+        keys = []
+        for name in sorted(self.objects):
+            if name.startswith(prefix):
+                modified = time.gmtime(self.modified[name])
+                key = mock.Mock(**{
+                    "last_modified": time.strftime("%Y-%m-%dT%H:%M:%S.000Z",
+                                                   modified),
+                    "get_contents_as_string.return_value": self.objects[name],
+                })
+                key.name = name
+                keys.append(key)
+        return keys
+
+    def copy_key(self, new_name, bucket_name, name, metadata=None):
+        self.objects[new_name] = self.objects[name]
+        self.modified[new_name] = time.time()
+
+    def delete_keys(self, names, quiet=False):
+        self.assertTrue(len(names) <= s3.DELETE_BATCH_SIZE)
+        for name in names:
+            del self.objects[name]
+
+    def store(self, data, at):
+        with mock.patch("time.time") as time:
+            time.return_value = at
+            return s3.store_data(data)
+
+    def test_store_data_records_backup_in_catalog(self):
+        self.store("USE `foo`;\nUSE `bar`;\n", 100)
+        self.store("USE `foo`;\n", 200)
+        backups = s3.catalog(self.bucket)
+        self.assertEqual([100, 200], [e["created_at"] for e in backups])
+        self.assertEqual(["foo", "bar"], backups[0]["databases"])
+        self.assertEqual(22, backups[0]["size"])
+        self.assertEqual(hashlib.sha256("USE `foo`;\n").hexdigest(),
+                         backups[1]["checksum"])
+
+    def test_find_backup(self):
+        first = self.store("first\n", 100)
+        second = self.store("second\n", 200)
+        self.assertEqual(second.name, s3.find_backup(self.bucket)["manifest"])
+        found = s3.find_backup(self.bucket, at=150)
+        self.assertEqual(first.name, found["manifest"])
+        self.assertIsNone(s3.find_backup(self.bucket, at=50))
+        self.assertEqual("first\n", s3.get_data(found["manifest"]))
+
+    def chunks(self, prefix=""):
+        return set(n for n in self.objects
+                   if n.startswith(prefix + s3.CHUNK_PREFIX))
+
+    @override_settings(BACKUP_CHUNK_GRACE_HOURS=0)
+    def test_prune_deletes_expired_backups_and_unreferenced_chunks(self):
+        old = self.store("shared\nold\n" * 100000 + "gone\n", 100)
+        self.store("shared\nold\n" * 100000 + "new\n", 9500)
+        recent = self.store("recent\n", 10000)
+        chunks = self.chunks()
+        expired = s3.prune(keep=1, max_age=1000, now=10100)
+        self.assertEqual([old.name], [e["manifest"] for e in expired])
+        self.assertNotIn(old.name, self.objects)
+        self.assertEqual(1, len(chunks - self.chunks()))
+        backups = s3.catalog(self.bucket)
+        self.assertEqual(2, len(backups))
+        self.assertEqual(recent.name, backups[-1]["manifest"])
+        for entry in backups:
+            s3.get_data(entry["manifest"])
+
+    @override_settings(BACKUP_CHUNK_GRACE_HOURS=1)
+    def test_prune_keeps_recent_unreferenced_chunks(self):
+        self.store("old\n", 100)
+        with mock.patch("time.time") as time:
+            time.return_value = 9000
+            s3.store_chunks(self.bucket, "uploading\n")
+        self.store("new\n", 9500)
+        chunks = self.chunks()
+        s3.prune(keep=1, max_age=0, now=10000)
+        self.assertEqual(2, len(self.chunks()))
+        self.assertIn(s3.CHUNK_PREFIX + backup.address("uploading\n"),
+                      self.chunks())
+        s3.prune(keep=1, max_age=0, now=20000)
+        gone = set(s3.CHUNK_PREFIX + backup.address(d)
+                   for d in ["old\n", "uploading\n"])
+        self.assertEqual(gone, chunks - self.chunks())
+
+    @override_settings(BACKUP_CHUNK_GRACE_HOURS=1)
+    def test_store_data_refreshes_old_reused_chunks(self):
+        self.store("shared\n", 100)
+        name = s3.CHUNK_PREFIX + backup.address("shared\n")
+        self.store("shared\n", 1000)
+        self.assertEqual(100, self.modified[name])
+        self.store("shared\n", 2000)
+        self.assertEqual(2000, self.modified[name])
+
+    def test_concurrent_exports_keep_their_catalog_entries(self):
+        first = self.store("first\n", 100)
+        second = self.store("second\n", 200)
+        self.assertNotIn(s3.CATALOG, self.objects)
+        self.assertEqual([first.name, second.name],
+                         [e["manifest"] for e in s3.catalog(self.bucket)])
+        self.assertEqual([], s3.prune(keep=2, max_age=10, now=300))
+        self.assertEqual([], [n for n in self.objects
+                              if n.startswith(s3.CATALOG_PREFIX)])
+        third = self.store("third\n", 400)
+        self.assertEqual([first.name, second.name, third.name],
+                         [e["manifest"] for e in s3.catalog(self.bucket)])
+
+    def test_instance_backups_are_kept_under_their_prefix(self):
+        prefix = s3.instance_prefix("mydb")
+        with mock.patch("time.time") as time:
+            time.return_value = 100
+            progress = mock.Mock()
+            key = s3.store_data("USE `mydb`;\n", prefix=prefix,
+                                progress=progress)
+        progress.assert_called_with(12)
+        self.assertTrue(all(n.startswith(prefix) for n in self.objects))
+        self.assertEqual([], s3.catalog(self.bucket))
+        self.assertEqual(key.name, s3.find_backup(self.bucket,
+                                                  prefix=prefix)["manifest"])
+        self.assertEqual("USE `mydb`;\n", s3.get_data(key.name))
+
+    def test_store_data_with_workers(self):
+        data = "".join("line %d\n" % i for i in xrange(200000))
+        key = s3.store_data(data, workers=4)
+        manifest = json.loads(self.objects[key.name])
+        self.assertTrue(len(manifest["chunks"]) > 1)
+        self.assertEqual(data, s3.get_data(key.name))
+
+    def test_prune_keeps_bases_of_kept_incrementals(self):
+        full = self.store("full\n", 100)
+        with mock.patch("time.time") as time:
+            time.return_value = 200
+            meta = {"engine": "physical", "base": full.name}
+            s3.store_data("inc\n", meta=meta)
+        self.store("dump\n", 300)
+        self.assertEqual([], s3.prune(keep=2, max_age=10, now=1000))
+        self.assertIn(full.name, self.objects)
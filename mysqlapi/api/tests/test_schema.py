@@ -0,0 +1,193 @@
+# Copyright 2015 mysqlapi authors. All rights reserved.
+# Use of this source code is governed by a BSD-style
+# license that can be found in the LICENSE file.
+
+import datetime
+
+from unittest import TestCase
+
+from django.test.client import RequestFactory
+from django.test.utils import override_settings
+
+from mysqlapi.api import limits, schema
+from mysqlapi.api.models import DatabaseManager
+from mysqlapi.api.tests import mocks
+from mysqlapi.api.views import export
+
+import mock
+
+ROWS = {
+    "SELECT 1 FROM information_schema.schemata": [(1,)],
+    "SELECT table_name": [("active", "VIEW"), ("posts", "BASE TABLE"),
+                          ("recent", "VIEW"), ("users", "BASE TABLE")],
+    "SHOW TRIGGERS FROM `app`": [("audit", "INSERT", "users")],
+    "SHOW CREATE TABLE `app`.`posts`": [("posts", "CREATE TABLE `posts`")],
+    "SHOW CREATE TABLE `app`.`users`": [("users", "CREATE TABLE `users`")],
+    "SHOW CREATE TRIGGER `app`.`audit`": [
+        ("audit", "STRICT_TRANS_TABLES",
+         "CREATE DEFINER=`root`@`localhost` TRIGGER audit BEFORE INSERT ON "
+         "users FOR EACH ROW SET NEW.id = 1")],
+    # active selects from recent, so recent has to come first.
+    "SHOW CREATE VIEW `app`.`active`": [
+        ("active", "CREATE ALGORITHM=UNDEFINED DEFINER=`root`@`localhost` "
+         "SQL SECURITY DEFINER VIEW `active` AS select 1 from "
+         "`app`.`recent`")],
+    "SHOW CREATE VIEW `app`.`recent`": [
+        ("recent", "CREATE ALGORITHM=UNDEFINED DEFINER=`root`@`localhost` "
+         "SQL SECURITY DEFINER VIEW `recent` AS select 1 AS `1`")],
+    "SELECT routine_name": [("touch", "PROCEDURE")],
+    "SHOW CREATE PROCEDURE `app`.`touch`": [
+        ("touch", "", "CREATE DEFINER=`root`@`localhost` PROCEDURE "
+         "`touch`()\nBEGIN\nSELECT 1;\nEND")],
+}
+
+
+class SchemaTestCase(TestCase):
+
+    def test_check(self):
+        schema.check(mocks.FakeCursor(ROWS), "app")
+        with self.assertRaises(schema.UnknownDatabase) as cm:
+            schema.check(mocks.FakeCursor({}), "nope")
+        self.assertEqual(
+            "Unknown database 'nope' when selecting the database",
+            cm.exception.args[-1])
+
+    def test_dump_is_compatible_with_mysqldump(self):
+        data = "".join(schema.dump(mocks.FakeCursor(ROWS), "app"))
+        posts = schema.TABLE % "CREATE TABLE `posts`"
+        users = schema.TABLE % "CREATE TABLE `users`"
+        trigger = (
+            "/*!50003 SET @saved_sql_mode       = @@sql_mode */ ;\n"
+            "/*!50003 SET sql_mode              = 'STRICT_TRANS_TABLES' */ ;\n"
+            "DELIMITER ;;\n"
+            "/*!50003 CREATE*/ /*!50017 DEFINER=`root`@`localhost`*/ "
+            "/*!50003 TRIGGER audit BEFORE INSERT ON users FOR EACH ROW SET "
+            "NEW.id = 1 */;;\n"
+            "DELIMITER ;\n"
+            "/*!50003 SET sql_mode              = @saved_sql_mode */ ;\n")
+        recent = (
+            "/*!50001 DROP TABLE IF EXISTS `recent`*/;\n"
+            "/*!50001 DROP VIEW IF EXISTS `recent`*/;\n"
+            "/*!50001 CREATE ALGORITHM=UNDEFINED */\n"
+            "/*!50013 DEFINER=`root`@`localhost` SQL SECURITY DEFINER */\n"
+            "/*!50001 VIEW `recent` AS select 1 AS `1` */;\n")
+        self.assertTrue(data.startswith(posts + users + trigger + recent))
+        self.assertIn("/*!50001 VIEW `active` AS select 1 from "
+                      "`app`.`recent` */;\n", data)
+        self.assertTrue(data.endswith(
+            "DELIMITER ;;\n"
+            "CREATE DEFINER=`root`@`localhost` PROCEDURE `touch`()\n"
+            "BEGIN\nSELECT 1;\nEND ;;\n"
+            "DELIMITER ;\n"
+            "/*!50003 SET sql_mode              = @saved_sql_mode */ ;\n"))
+
+    def test_dump_streams_one_object_at_a_time(self):
+        cursor = mocks.FakeCursor(ROWS)
+        statements = schema.dump(cursor, "app")
+        self.assertEqual(schema.TABLE % "CREATE TABLE `posts`",
+                         next(statements))
+        self.assertNotIn("SHOW CREATE TABLE `app`.`users`", cursor.log)
+
+    def test_ordered_leaves_cycles_as_they_are(self):
+        views = [("a", "VIEW `a` AS select * from `b`"),
+                 ("b", "VIEW `b` AS select * from `a`")]
+        self.assertEqual(views, schema.ordered(views))
+
+
+class FingerprintTestCase(TestCase):
+
+    def rows(self, create_time):
+        return [("table", "users", create_time, None, 3L),
+                ("schema", "app", None, None, None)]
+
+    def test_fingerprint_changes_with_the_schema(self):
+        created = datetime.datetime(2015, 1, 1)
+        first = schema.fingerprint(
+            mocks.FakeCursor({"SELECT 'schema'": self.rows(created)}), "app")
+        same = schema.fingerprint(mocks.FakeCursor(
+            {"SELECT 'schema'": self.rows(created)[::-1]}), "app")
+        self.assertEqual(first, same)
+        altered = schema.fingerprint(mocks.FakeCursor(
+            {"SELECT 'schema'": self.rows(created.replace(day=2))}), "app")
+        self.assertNotEqual(first, altered)
+
+    def test_fingerprint_of_a_missing_database(self):
+        with self.assertRaises(schema.UnknownDatabase):
+            schema.fingerprint(mocks.FakeCursor({}), "nope")
+
+
+class ExportTestCase(TestCase):
+
+    def test_export_streams_over_the_pooled_connection(self):
+        db = DatabaseManager("app")
+        cursor = mocks.FakeCursor(ROWS)
+        with mock.patch.object(db, "conn") as conn:
+            conn.cursor.return_value = cursor
+            statements = db.export()
+            # utf8 is the charset of every pooled connection already.
+            self.assertFalse(any(sql.startswith("SET")
+                                 for sql in cursor.log))
+            self.assertFalse(conn.close.called)
+            list(statements)
+            conn.close.assert_called_once_with()
+
+    def test_export_of_a_missing_database(self):
+        db = DatabaseManager("nope")
+        with mock.patch.object(db, "conn") as conn:
+            conn.cursor.return_value = mocks.FakeCursor({})
+            with self.assertRaises(schema.UnknownDatabase):
+                db.export()
+            conn.close.assert_called_once_with()
+
+
+class ExportViewTestCase(TestCase):
+
+    def setUp(self):
+        schema._exports.clear()
+        limits.reset()
+        self.addCleanup(limits.reset)
+        patcher = mock.patch(
+            "mysqlapi.api.models.DatabaseManager.schema_fingerprint")
+        self.fingerprint = patcher.start()
+        self.fingerprint.return_value = "abc"
+        self.addCleanup(patcher.stop)
+        patcher = mock.patch("mysqlapi.api.models.DatabaseManager.export")
+        self.dump = patcher.start()
+        self.dump.side_effect = lambda: iter(["CREATE TABLE `foo`;\n"])
+        self.addCleanup(patcher.stop)
+
+    def get(self, **headers):
+        response = export(RequestFactory().get("/", **headers), "magneto")
+        if response.streaming:
+            content = "".join(response.streaming_content)
+            response.close()
+        else:
+            content = response.content
+        self.assertEqual(0, limits.limiter("export").metrics()["running"])
+        return response, content
+
+    def test_unchanged_schemas_are_served_from_the_cache(self):
+        response, content = self.get()
+        self.assertEqual('"abc"', response["ETag"])
+        self.assertEqual("CREATE TABLE `foo`;\n", content)
+        response, content = self.get()
+        self.assertEqual("CREATE TABLE `foo`;\n", content)
+        self.assertEqual(1, self.dump.call_count)
+        self.fingerprint.return_value = "def"
+        response, content = self.get()
+        self.assertEqual('"def"', response["ETag"])
+        self.assertEqual(2, self.dump.call_count)
+
+    def test_not_modified(self):
+        response, content = self.get(HTTP_IF_NONE_MATCH='"abc"')
+        self.assertEqual(304, response.status_code)
+        self.assertEqual('"abc"', response["ETag"])
+        self.assertFalse(self.dump.called)
+        response, content = self.get(HTTP_IF_NONE_MATCH='"old"')
+        self.assertEqual(200, response.status_code)
+
+    @override_settings(EXPORT_CACHE_TTL=0)
+    def test_cache_can_be_disabled(self):
+        self.get()
+        self.get()
+        self.assertEqual(2, self.dump.call_count)
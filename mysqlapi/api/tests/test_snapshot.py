@@ -0,0 +1,200 @@
+# Copyright 2015 mysqlapi authors. All rights reserved.
+# Use of this source code is governed by a BSD-style
+# license that can be found in the LICENSE file.
+
+import threading
+
+from unittest import TestCase
+
+import MySQLdb
+
+from mysqlapi.api import snapshot
+from mysqlapi.api.tests import mocks
+
+import mock
+
+ROWS = {
+    "SHOW MASTER STATUS": [("mysql-bin.000003", 1337L)],
+    "SELECT schema_name": [("app",), ("empty",)],
+    "SELECT table_schema": [("app", "posts", "BASE TABLE"),
+                            ("app", "recent", "VIEW"),
+                            ("app", "users", "BASE TABLE")],
+    "SHOW CREATE DATABASE IF NOT EXISTS `app`": [
+        ("app", "CREATE DATABASE /*!32312 IF NOT EXISTS*/ `app`")],
+    "SHOW CREATE DATABASE IF NOT EXISTS `empty`": [
+        ("empty", "CREATE DATABASE /*!32312 IF NOT EXISTS*/ `empty`")],
+    "SHOW CREATE VIEW": [("recent", "CREATE VIEW `recent` AS SELECT 1")],
+    "SHOW CREATE TABLE `app`.`users`": [("users", "CREATE TABLE `users`")],
+    "SHOW CREATE TABLE `app`.`posts`": [("posts", "CREATE TABLE `posts`")],
+    "SELECT * FROM `app`.`users`": [(1, "bob"), (2, None)],
+    "SELECT * FROM `app`.`posts`": [],
+    "SHOW TRIGGERS FROM `app`": [("audit", "INSERT", "users"),
+                                 ("other", "INSERT", "usersx")],
+    "SHOW CREATE TRIGGER": [("audit", "", "CREATE TRIGGER audit")],
+    "SELECT object_schema": [("app", "users", 10L)],
+    "SELECT routine_schema": [("app", "PROCEDURE", "cleanup")],
+    "SELECT event_schema": [("app", "EVENT", "purge")],
+    "SHOW CREATE PROCEDURE `app`.`cleanup`": [
+        ("cleanup", "STRICT_TRANS_TABLES", "CREATE PROCEDURE `cleanup`()")],
+    "SHOW CREATE EVENT `app`.`purge`": [
+        ("purge", "", "+00:00", "CREATE EVENT `purge` ON SCHEDULE")],
+    "SELECT user, host": [("app", "%")],
+    "SHOW CREATE USER": [("CREATE USER 'app'@'%' IDENTIFIED BY 'x'",)],
+    "SHOW GRANTS": [("GRANT USAGE ON *.* TO 'app'@'%'",),
+                    ("GRANT ALL PRIVILEGES ON `app`.* TO 'app'@'%'",)],
+}
+
+
+class SnapshotDumpTestCase(TestCase):
+
+    def setUp(self):
+        self.log = []
+        self.conns = []
+        self.lock = threading.Lock()
+
+    def connect(self):
+        with self.lock:
+            conn = mocks.FakeConnection(ROWS, history=self.log)
+            self.conns.append(conn)
+            return conn
+
+    def statements(self, conn_id):
+        return self.conns[conn_id].log
+
+    def test_workers_share_a_snapshot_taken_under_a_brief_lock(self):
+        dump = snapshot.SnapshotDump(self.connect, workers=2)
+        dump.begin()
+        self.assertEqual(3, len(self.conns))
+        self.assertEqual(["SET SESSION lock_wait_timeout = 10",
+                          "FLUSH TABLES", "FLUSH TABLES WITH READ LOCK",
+                          "SHOW MASTER STATUS", "UNLOCK TABLES"],
+                         self.statements(0))
+        self.assertTrue(self.conns[0].closed)
+        lock = self.log.index((self.conns[0], "FLUSH TABLES WITH READ LOCK"))
+        unlock = self.log.index((self.conns[0], "UNLOCK TABLES"))
+        for conn in self.conns[1:]:
+            started = self.log.index(
+                (conn, "START TRANSACTION WITH CONSISTENT SNAPSHOT"))
+            self.assertTrue(lock < started < unlock)
+        self.assertEqual({"engine": "snapshot",
+                          "binlog_file": "mysql-bin.000003",
+                          "binlog_position": 1337}, dump.meta())
+        dump.end()
+        self.assertTrue(all(c.closed for c in self.conns))
+
+    def test_lock_is_released_when_a_worker_fails_to_connect(self):
+        def connect():
+            if self.conns:
+                raise MySQLdb.OperationalError(1040, "Too many connections")
+            return self.connect()
+        dump = snapshot.SnapshotDump(connect, workers=2)
+        with self.assertRaises(MySQLdb.OperationalError):
+            dump.begin()
+        self.assertEqual("UNLOCK TABLES", self.statements(0)[-1])
+
+    def test_stream(self):
+        dump = snapshot.SnapshotDump(self.connect, workers=2)
+        data = "".join(dump.stream())
+        self.assertEqual(["app", "empty"], dump.databases)
+        self.assertTrue(data.startswith(snapshot.HEADER))
+        self.assertTrue(data.endswith(snapshot.FOOTER))
+        self.assertIn("CREATE DATABASE /*!32312 IF NOT EXISTS*/ `empty`;\n",
+                      data)
+        users = data.index("DROP TABLE IF EXISTS `users`;\n"
+                           "CREATE TABLE `users`;\n"
+                           "INSERT INTO `users` VALUES (1,'bob'),(2,NULL);\n"
+                           "DELIMITER ;;\nCREATE TRIGGER audit;;\n"
+                           "DELIMITER ;\n")
+        posts = data.index("CREATE TABLE `posts`;\nUSE `app`;\n")
+        view = data.index("DROP VIEW IF EXISTS `recent`;\n")
+        # users is written to, so it's dumped before posts.
+        self.assertTrue(users < posts < view)
+        self.assertEqual(1, data.count("TRIGGER"))
+        routines = data.index(
+            "USE `app`;\n"
+            "SET @saved_sql_mode = @@sql_mode, "
+            "@saved_time_zone = @@time_zone;\n"
+            "SET sql_mode = 'STRICT_TRANS_TABLES', time_zone = 'SYSTEM';\n"
+            "DROP PROCEDURE IF EXISTS `cleanup`;\n"
+            "DELIMITER ;;\nCREATE PROCEDURE `cleanup`();;\nDELIMITER ;\n")
+        self.assertIn("SET sql_mode = '', time_zone = '+00:00';\n"
+                      "DROP EVENT IF EXISTS `purge`;\n"
+                      "DELIMITER ;;\nCREATE EVENT `purge` ON SCHEDULE;;\n",
+                      data)
+        accounts = data.index(
+            "CREATE USER IF NOT EXISTS 'app'@'%' IDENTIFIED BY 'x';\n"
+            "GRANT USAGE ON *.* TO 'app'@'%';\n"
+            "GRANT ALL PRIVILEGES ON `app`.* TO 'app'@'%';\n")
+        self.assertTrue(view < routines < accounts)
+        self.assertTrue(all(c.closed for c in self.conns))
+
+    def test_views_come_after_the_views_they_select_from(self):
+        tables = [("app", "users", "BASE TABLE"), ("app", "v_a", "VIEW"),
+                  ("app", "v_b", "VIEW")]
+        views = {
+            "SELECT table_schema": tables,
+            "SHOW CREATE VIEW `app`.`v_a`": [
+                ("v_a", "CREATE VIEW `v_a` AS select 1 from `app`.`v_b`")],
+            "SHOW CREATE VIEW `app`.`v_b`": [
+                ("v_b", "CREATE VIEW `v_b` AS select 1 from `app`.`users`")],
+        }
+        dump = snapshot.SnapshotDump(self.connect, workers=1)
+        dump.begin()
+        with mock.patch.dict(ROWS, views):
+            self.assertEqual([tables[0], tables[2], tables[1]],
+                             dump.tables())
+        dump.end()
+
+    def test_accounts_before_show_create_user(self):
+        dump = snapshot.SnapshotDump(self.connect, workers=1)
+        dump.begin()
+        query = dump.query
+
+        def old_query(sql, args=None):
+            if sql.startswith("SHOW CREATE USER"):
+                raise MySQLdb.ProgrammingError(1064, "syntax error")
+            return query(sql, args)
+        with mock.patch.object(dump, "query", old_query):
+            accounts = list(dump.accounts())
+        dump.end()
+        self.assertEqual(["GRANT USAGE ON *.* TO 'app'@'%';\n",
+                          "GRANT ALL PRIVILEGES ON `app`.* TO 'app'@'%';\n"],
+                         accounts)
+
+    def test_insert_batches(self):
+        dump = snapshot.SnapshotDump(self.connect, workers=1)
+        conn = self.connect()
+        rows = [(i,) for i in xrange(10)]
+        out = mock.Mock()
+        with mock.patch.object(snapshot, "INSERT_SIZE", 12):
+            with mock.patch.dict(ROWS, {"SELECT * FROM `t`": rows}):
+                dump.dump_rows(conn, "`t`", "`t`", out)
+        self.assertEqual(
+            mock.call("INSERT INTO `t` VALUES (0),(1),(2),(3);\n"),
+            out.write.call_args_list[0])
+        self.assertEqual(3, out.write.call_count)
+
+    def test_throttled_inserts(self):
+        limiter = mock.Mock()
+        dump = snapshot.SnapshotDump(self.connect, workers=1,
+                                     throttle=limiter)
+        with mock.patch.dict(ROWS, {"SELECT * FROM `t`": [(1,)]}):
+            dump.dump_rows(self.connect(), "`t`", "`t`", mock.Mock())
+        limiter.reserve.assert_called_once_with(3)
+        self.assertFalse(limiter.consume.called)
+        self.assertFalse(limiter.pause.called)
+
+    def test_throttled_dumps_pause_between_tables(self):
+        limiter = mock.Mock(max_pause=600)
+        dump = snapshot.SnapshotDump(self.connect, workers=1,
+                                     throttle=limiter)
+        dump.begin()
+        self.assertIn("SET SESSION net_write_timeout = 660",
+                      self.statements(1))
+        calls = []
+        limiter.pause.side_effect = lambda: calls.append("pause")
+        with mock.patch.object(dump, "dump_rows") as dump_rows:
+            dump_rows.side_effect = lambda *args: calls.append("rows")
+            dump.dump_table(("app", "users", "BASE TABLE")).close()
+        self.assertEqual(["pause", "rows"], calls)
+        dump.end()
@@ -0,0 +1,125 @@
+# Copyright 2015 mysqlapi authors. All rights reserved.
+# Use of this source code is governed by a BSD-style
+# license that can be found in the LICENSE file.
+
+import os
+import tempfile
+
+from unittest import TestCase
+
+import MySQLdb
+
+from mysqlapi.api import throttle
+
+import mock
+
+CALM = {"threads_running": 2, "iowait": 0.01, "replication_lag": None}
+BUSY = {"threads_running": 40, "iowait": 0.01, "replication_lag": None}
+
+
+class IOWaitTestCase(TestCase):
+
+    def test_sample(self):
+        fd, path = tempfile.mkstemp()
+        self.addCleanup(os.remove, path)
+        iowait = throttle.IOWait(path)
+
+        def write(iowait_ticks, total_extra):
+            with open(path, "w") as f:
+                f.write("cpu  %d 0 0 %d %d 0 0 0 0 0\n" % (
+                    total_extra, 1000, iowait_ticks))
+        write(100, 0)
+        self.assertIsNone(iowait.sample())
+        write(150, 50)
+        self.assertEqual(0.5, iowait.sample())
+
+    def test_sample_without_proc(self):
+        self.assertIsNone(throttle.IOWait("/nonexistent/stat").sample())
+
+
+class LoadTestCase(TestCase):
+
+    def test_sample(self):
+        conn = mock.Mock()
+        cursor = conn.cursor.return_value
+        cursor.description = [("Seconds_Behind_Master",)]
+        cursor.fetchone.side_effect = [("Threads_running", "7"), (12,)]
+        iowait = mock.Mock()
+        iowait.sample.return_value = 0.2
+        load = throttle.Load(lambda: conn, iowait)
+        self.assertEqual({"threads_running": 7, "iowait": 0.2,
+                          "replication_lag": 12}, load.sample())
+        load.close()
+        conn.close.assert_called_once_with()
+
+
+class ThrottleTestCase(TestCase):
+
+    def setUp(self):
+        patcher = mock.patch("time.sleep")
+        self.sleep = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_overloaded(self):
+        t = throttle.Throttle(None, max_threads_running=16, max_iowait=0.3,
+                              max_replication_lag=30)
+        self.assertIsNone(t.overloaded(CALM))
+        self.assertEqual("threads_running", t.overloaded(BUSY))
+        self.assertEqual("iowait", t.overloaded(dict(CALM, iowait=0.5)))
+        self.assertEqual("replication_lag",
+                         t.overloaded(dict(CALM, replication_lag=60)))
+
+    def test_pauses_while_overloaded_and_slows_down(self):
+        sample = mock.Mock(side_effect=[BUSY, BUSY, CALM, CALM])
+        t = throttle.Throttle(sample, interval=0)
+        t.consume(100)
+        self.assertEqual(2, self.sleep.call_count)
+        self.assertEqual(1, t.pauses)
+        self.assertEqual(0.25 * 1.25, t.factor)
+        t.consume(100)
+        self.assertEqual(0.25 * 1.25 * 1.25, t.factor)
+
+    def test_pause_is_bounded(self):
+        sample = mock.Mock(return_value=BUSY)
+        t = throttle.Throttle(sample, interval=0, max_pause=0)
+        t.consume(100)
+        self.assertEqual(0, self.sleep.call_count)
+
+    def test_sampling_errors_keep_going(self):
+        sample = mock.Mock(side_effect=MySQLdb.OperationalError(2006, ""))
+        t = throttle.Throttle(sample, interval=0)
+        t.consume(100)
+        self.assertIsNone(t.overload)
+
+    def test_rate_limit(self):
+        sample = mock.Mock(return_value=CALM)
+        with mock.patch("time.time") as now:
+            now.return_value = 100.0
+            t = throttle.Throttle(sample, rate=1000, interval=60)
+            t.consume(500)
+            t.consume(500)
+            t.consume(500)
+        self.assertEqual([mock.call(0.5), mock.call(1.0)],
+                         self.sleep.call_args_list)
+
+    def test_pause_does_not_hold_the_lock(self):
+        t = throttle.Throttle(mock.Mock(side_effect=[BUSY, CALM]),
+                              interval=0)
+        self.sleep.side_effect = lambda delay: self.assertTrue(
+            t._lock.acquire(False)) or t._lock.release()
+        t.pause()
+        self.assertEqual(1, self.sleep.call_count)
+
+    def test_reserve_only_limits_the_rate(self):
+        sample = mock.Mock(return_value=BUSY)
+        with mock.patch("time.time") as now:
+            now.return_value = 100.0
+            t = throttle.Throttle(sample, rate=1000, interval=60)
+            t.reserve(500)
+            t.reserve(500)
+        self.assertFalse(sample.called)
+        self.assertEqual([mock.call(0.5)], self.sleep.call_args_list)
+
+    def test_limit(self):
+        t = throttle.Throttle(mock.Mock(return_value=CALM))
+        self.assertEqual(["a", "b"], list(t.limit(["a", "b"])))
@@ -0,0 +1,178 @@
+# Copyright 2015 mysqlapi authors. All rights reserved.
+# Use of this source code is governed by a BSD-style
+# license that can be found in the LICENSE file.
+
+import threading
+import time
+
+import MySQLdb
+
+from django.conf import settings
+
+
+class IOWait(object):
+    # Fraction of CPU time spent waiting for I/O since the previous sample,
+    # from /proc/stat. None where it isn't available.
+
+    def __init__(self, path="/proc/stat"):
+        self.path = path
+        self._last = None
+
+    def read(self):
+        try:
+            with open(self.path) as f:
+                fields = f.readline().split()
+        except IOError:
+            return None
+        if len(fields) < 6 or fields[0] != "cpu":
+            return None
+        values = [int(v) for v in fields[1:]]
+        return sum(values), values[4]
+
+    def sample(self):
+        current = self.read()
+        if current is None:
+            return None
+        last, self._last = self._last, current
+        if last is None or current[0] == last[0]:
+            return None
+        return float(current[1] - last[1]) / (current[0] - last[0])
+
+
+class Load(object):
+
+    def __init__(self, connect, iowait=None):
+        self.connect = connect
+        self.iowait = iowait or IOWait()
+        self._conn = None
+
+    def sample(self):
+        if self._conn is None:
+            self._conn = self.connect()
+        cursor = self._conn.cursor()
+        cursor.execute("SHOW GLOBAL STATUS LIKE 'Threads_running'")
+        load = {"threads_running": int(cursor.fetchone()[1]),
+                "replication_lag": None,
+                "iowait": self.iowait.sample()}
+        try:
+            cursor.execute("SHOW SLAVE STATUS")
+            row = cursor.fetchone()
+        except MySQLdb.Error:
+            row = None
+        if row:
+            columns = [c[0] for c in cursor.description]
+            load["replication_lag"] = dict(zip(columns,
+                                               row))["Seconds_Behind_Master"]
+        return load
+
+    def close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+
+class Throttle(object):
+    # Limits dump throughput to rate bytes per second (0 for no limit) and
+    # adapts it to the server load, sampled every interval seconds: while
+    # any limit is exceeded the rate is halved and callers pause, up to
+    # max_pause seconds in a row, and it recovers gradually afterwards.
+    # Callers that hold a result set open should only pause() between
+    # reads, and reserve() the rate while reading.
+
+    def __init__(self, sample, rate=0, max_threads_running=16,
+                 max_iowait=0.3, max_replication_lag=30, interval=1,
+                 max_pause=600, min_factor=0.1):
+        self.sample = sample
+        self.rate = rate
+        self.max_threads_running = max_threads_running
+        self.max_iowait = max_iowait
+        self.max_replication_lag = max_replication_lag
+        self.interval = interval
+        self.max_pause = max_pause
+        self.min_factor = min_factor
+        self.factor = 1.0
+        self.overload = None
+        self.pauses = 0
+        self.paused = 0.0
+        self._lock = threading.Lock()
+        self._checked_at = 0
+        self._next_at = time.time()
+
+    def overloaded(self, load):
+        if load["threads_running"] > self.max_threads_running:
+            return "threads_running"
+        if load["iowait"] is not None and load["iowait"] > self.max_iowait:
+            return "iowait"
+        lag = load["replication_lag"]
+        if lag is not None and lag > self.max_replication_lag:
+            return "replication_lag"
+        return None
+
+    def check(self):
+        # Must be called with the lock held.
+        now = time.time()
+        if now - self._checked_at < self.interval:
+            return self.overload
+        self._checked_at = now
+        try:
+            load = self.sample()
+        except MySQLdb.Error:
+            # Keep the previous verdict rather than failing the dump.
+            return self.overload
+        self.overload = self.overloaded(load)
+        if self.overload:
+            self.factor = max(self.factor / 2, self.min_factor)
+        else:
+            self.factor = min(self.factor * 1.25, 1.0)
+        return self.overload
+
+    def pause(self):
+        # Sleeps without the lock, so the other workers keep checking too.
+        started = time.time()
+        paused = False
+        while time.time() - started < self.max_pause:
+            with self._lock:
+                overload = self.check()
+            if not overload:
+                break
+            paused = True
+            time.sleep(self.interval)
+        if paused:
+            with self._lock:
+                self.pauses += 1
+                self.paused += time.time() - started
+
+    def reserve(self, size):
+        if not self.rate:
+            return
+        with self._lock:
+            # Callers reserve their share of the rate one after the other,
+            # so concurrent workers add up to it.
+            now = time.time()
+            self._next_at = max(self._next_at, now)
+            delay = self._next_at - now
+            self._next_at += float(size) / (self.rate * self.factor)
+        if delay > 0:
+            time.sleep(delay)
+
+    def consume(self, size):
+        self.pause()
+        self.reserve(size)
+
+    def limit(self, data):
+        for item in data:
+            self.consume(len(item))
+            yield item
+
+    def stats(self):
+        return {"pauses": self.pauses, "paused": round(self.paused, 3),
+                "factor": self.factor}
+
+
+def from_settings(sample):
+    return Throttle(sample,
+                    rate=settings.BACKUP_RATE_LIMIT,
+                    max_threads_running=settings.BACKUP_MAX_THREADS_RUNNING,
+                    max_iowait=settings.BACKUP_MAX_IOWAIT,
+                    max_replication_lag=settings.BACKUP_MAX_REPLICATION_LAG,
+                    max_pause=settings.BACKUP_MAX_PAUSE)
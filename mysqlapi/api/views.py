@@ -7,16 +7,42 @@
 import json
 import subprocess
 
-from django.http import HttpResponse
+import MySQLdb
+
+from django.conf import settings
+from django.http import (HttpResponse, HttpResponseNotModified,
+                         StreamingHttpResponse)
+from django.utils import timezone
+from django.utils.http import parse_etags, quote_etag
 from django.views.decorators.http import require_http_methods
 from django.views.generic.base import View
 
-import crane_ec2
-
+from mysqlapi.api import (bulk, creator, health, limits, proxy, purge,
+                          report, schema)
 from mysqlapi.api.decorators import basic_auth_required
-from mysqlapi.api.models import (create_database, DatabaseManager,
-                                 ProvisionedInstance, Instance,
-                                 canonicalize_db_name)
+from mysqlapi.api.management.commands import s3
+from mysqlapi.api.models import (create_database, DatabaseManager, Instance,
+                                 Job, canonicalize_db_name, generate_user,
+                                 uses_ec2)
+
+
+def get_instance(name):
+    queryset = Instance.objects.select_related("provisionedinstance",
+                                               "pool_host")
+    return queryset.get(name=name)
+
+
+class EC2ClientMixin(object):
+    _client = None
+
+    @property
+    def client(self):
+        # crane_ec2 pulls boto in, so it is only imported by the views that
+        # actually talk to EC2, the first time they need it.
+        if self._client is None:
+            import crane_ec2
+            self._client = crane_ec2.Client()
+        return self._client
 
 
 class BindApp(View):
@@ -24,35 +50,53 @@ class BindApp(View):
     def post(self, request, name, *args, **kwargs):
         name = canonicalize_db_name(name)
         try:
-            instance = Instance.objects.get(name=name)
+            instance = get_instance(name)
         except Instance.DoesNotExist:
             return HttpResponse("Instance not found", status=404)
         if instance.state != "running":
             msg = u"You can't bind to this instance because it's not running."
             return HttpResponse(msg, status=412)
         db = instance.db_manager()
+        host, port = db.public_host, u"3306"
         try:
             username, password = db.create_user(name, None)
+            # Replicas only get the user through replication, the bind just
+            # waits for it to be there.
+            replicas = instance.read_replicas()
+            for replica in replicas:
+                replica.wait_for_user(name, settings.REPLICA_GRANT_TIMEOUT)
+            if proxy.enabled(instance):
+                proxy.register(username, password, instance.name)
+                host, port = settings.PROXY_HOST, unicode(settings.PROXY_PORT)
         except Exception, e:
             return HttpResponse(e.args[-1], status=500)
         config = {
-            "MYSQL_HOST": db.public_host,
-            "MYSQL_PORT": u"3306",
+            "MYSQL_HOST": host,
+            "MYSQL_PORT": port,
             "MYSQL_DATABASE_NAME": instance.name,
             "MYSQL_USER": username,
             "MYSQL_PASSWORD": password,
         }
+        if replicas:
+            # Ports go apart, in the same order, so the hosts stay as they
+            # were for the apps that only read those.
+            config["MYSQL_READ_HOSTS"] = u",".join(r.public_host
+                                                   for r in replicas)
+            config["MYSQL_READ_PORTS"] = u",".join(unicode(r.port)
+                                                   for r in replicas)
         return HttpResponse(json.dumps(config), status=201)
 
     def delete(self, request, name, *args, **kwargs):
         name = canonicalize_db_name(name)
         try:
-            instance = Instance.objects.get(name=name)
+            instance = get_instance(name)
         except Instance.DoesNotExist:
             return HttpResponse("Instance not found.", status=404)
         db = instance.db_manager()
         try:
             db.drop_user(name, None)
+            if proxy.enabled(instance):
+                proxy.unregister(generate_user(name))
         except Exception, e:
             return HttpResponse(e.args[-1], status=500)
         return HttpResponse("", status=200)
@@ -67,11 +111,7 @@ class BindUnit(View):
         return HttpResponse("", status=200)
 
 
-class CreateDatabase(View):
-
-    def __init__(self, *args, **kwargs):
-        super(CreateDatabase, self).__init__(*args, **kwargs)
-        self._client = crane_ec2.Client()
+class CreateDatabase(EC2ClientMixin, View):
 
     def post(self, request):
         if "name" not in request.POST:
@@ -80,70 +120,305 @@ class CreateDatabase(View):
         if not name:
             return HttpResponse("Instance name is empty", status=500)
         instance = Instance(name=canonicalize_db_name(name))
+        ec2_client = self.client if uses_ec2() else None
         try:
-            create_database(instance, self._client)
+            create_database(instance, ec2_client)
         except Exception as e:
             return HttpResponse(e.args[-1], status=500)
         return HttpResponse("", status=201)
 
 
-class DropDatabase(View):
-
-    def __init__(self, *args, **kwargs):
-        super(DropDatabase, self).__init__(*args, **kwargs)
-        self._client = crane_ec2.Client()
+class DropDatabase(EC2ClientMixin, View):
 
     def delete(self, request, name, *args, **kwargs):
         name = canonicalize_db_name(name)
         try:
-            instance = Instance.objects.get(name=name)
+            instance = get_instance(name)
         except Instance.DoesNotExist:
             msg = "Can't drop database '%s'; database doesn't exist" % name
             return HttpResponse(msg, status=404)
-        if instance.shared:
-            db = instance.db_manager()
-            db.drop_database()
-        elif instance.ec2_id is None:
-            pi = ProvisionedInstance.objects.get(instance=instance)
-            pi.dealloc()
-        elif self._client.unauthorize(instance) and \
-                self._client.terminate(instance):
-            pass
-        else:
-            return HttpResponse("Failed to terminate the instance.",
-                                status=500)
+        host = settings.SHARED_SERVER if instance.shared else instance.host
+        job = None
+        try:
+            with limits.limiter("drop").slot(host):
+                if instance.shared:
+                    # Dropping a large database stalls the whole shared
+                    # server, so its tables are moved out of the way and
+                    # dropped by a throttled purge job.
+                    trash = purge.trash_name(name)
+                    if proxy.enabled(instance):
+                        proxy.unregister(generate_user(name))
+                    conn = instance.db_manager().conn
+                    conn.open()
+                    try:
+                        purge.detach(conn, name, trash)
+                    finally:
+                        conn.close()
+                    job = Job.objects.create(instance_name=name,
+                                             kind="purge", source=trash)
+                elif instance.pool_host_id is not None:
+                    instance.pool_host.remove(instance)
+                elif instance.ec2_id is None:
+                    instance.provisioned().dealloc()
+                elif self.client.unauthorize(instance) and \
+                        self.client.terminate(instance):
+                    pass
+                else:
+                    return HttpResponse("Failed to terminate the instance.",
+                                        status=500)
+        except limits.LimitExceeded as e:
+            return limit_exceeded(e)
         instance.delete()
+        if job is not None:
+            return json_response(job.as_dict())
         return HttpResponse("", status=200)
 
 
+def limit_exceeded(exc):
+    response = HttpResponse(exc.args[-1], status=exc.status)
+    response["Retry-After"] = str(exc.retry_after)
+    return response
+
+
 @basic_auth_required
 @require_http_methods(["GET"])
 def export(request, name):
     host = request.GET.get("service_host", "localhost")
+    limiter = limits.limiter("export")
+    try:
+        limiter.acquire(host)
+    except limits.LimitExceeded as e:
+        return limit_exceeded(e)
+    # The schema fingerprint costs a single metadata query: unchanged
+    # schemas are answered with a 304 or from the cache, and only the
+    # others are exported, streaming with the slot held until it's sent.
+    streaming = False
     try:
         db = DatabaseManager(name, host)
-        return HttpResponse(db.export())
-    except subprocess.CalledProcessError, e:
-        return HttpResponse(e.output.split(":")[-1].strip(), status=500)
+        fingerprint = db.schema_fingerprint()
+        etags = parse_etags(request.META.get("HTTP_IF_NONE_MATCH", ""))
+        if fingerprint in etags or "*" in etags:
+            response = HttpResponseNotModified()
+        else:
+            key = (host, db.name, fingerprint)
+            content = schema.cached(key)
+            if content is None:
+                chunks = schema.caching(key, db.export())
+                response = StreamingHttpResponse(limiter.held(host, chunks))
+                streaming = True
+            else:
+                response = HttpResponse(content)
+        response["ETag"] = quote_etag(fingerprint)
+        return response
+    except (schema.UnknownDatabase, MySQLdb.Error) as e:
+        return HttpResponse(e.args[-1], status=500)
+    finally:
+        if not streaming:
+            limiter.release(host)
 
 
-class Healthcheck(View):
+class Import(View):
 
-    def __init__(self, *args, **kwargs):
-        self._client = crane_ec2.Client()
+    def post(self, request, name, *args, **kwargs):
+        name = canonicalize_db_name(name)
+        try:
+            instance = get_instance(name)
+        except Instance.DoesNotExist:
+            return HttpResponse("Instance not found", status=404)
+        if instance.state != "running":
+            msg = u"You can't import into this instance because it's not " \
+                  u"running."
+            return HttpResponse(msg, status=412)
+        # The upload is the raw request body, read as it's imported.
+        host = settings.SHARED_SERVER if instance.shared else instance.host
+        try:
+            with limits.limiter("import").slot(host):
+                result = bulk.load(instance.db_manager(), request,
+                                   request.GET.get("format", "csv"),
+                                   table=request.GET.get("table"),
+                                   header=request.GET.get("header") in
+                                   ("1", "true", "True"))
+        except limits.LimitExceeded as e:
+            return limit_exceeded(e)
+        except bulk.InvalidImport as e:
+            return HttpResponse(e.args[-1], status=400)
+        except MySQLdb.Error as e:
+            return HttpResponse(e.args[-1], status=500)
+        except subprocess.CalledProcessError as e:
+            return HttpResponse(e.output.split(":")[-1].strip(), status=500)
+        return json_response(result)
+
+
+@basic_auth_required
+@require_http_methods(["GET"])
+def metrics(request):
+    data = {"limits": limits.metrics()}
+    return HttpResponse(json.dumps(data), content_type="application/json")
+
+
+@basic_auth_required
+@require_http_methods(["GET"])
+def provisioning_report(request):
+    try:
+        days = int(request.GET.get("days", 7))
+    except ValueError:
+        return HttpResponse("days must be an integer", status=400)
+    data = report.provisioning(Instance, days=days)
+    return HttpResponse(json.dumps(data), content_type="application/json")
+
+
+@basic_auth_required
+@require_http_methods(["POST"])
+def ec2_event(request):
+    # Instance state notifications, so the creator doesn't have to wait for
+    # its next poll. Only running instances with a public address matter.
+    ec2_id = request.POST.get("instance_id")
+    if not ec2_id:
+        return HttpResponse("Instance id is missing", status=400)
+    host = request.POST.get("ip_address")
+    if request.POST.get("state") != "running" or not host:
+        return HttpResponse("", status=200)
+    pending = Instance.objects.filter(ec2_id=ec2_id, state="pending",
+                                      shared=False)
+    # Repeated notifications keep the time of the first one.
+    updated = pending.filter(ec2_running_at__isnull=True).update(
+        host=host, ec2_running_at=timezone.now())
+    if not updated and not pending.exists():
+        return HttpResponse("Instance not found", status=404)
+    creator.wake()
+    return HttpResponse("", status=200)
+
+
+class Healthcheck(View):
 
     def get(self, request, name, *args, **kwargs):
         try:
-            instance = Instance.objects.get(name=name)
+            instance = get_instance(name)
         except Instance.DoesNotExist:
             return HttpResponse("Instance %s not found" % name, status=404)
 
         if instance.state == "pending":
             return HttpResponse("pending", status=202)
 
-        # if it is up, we check again to see if the state still the same
+        if request.GET.get("deep"):
+            result = health.deep_status(instance)
+            status = 200 if result["status"] == "up" else 500
+            return HttpResponse(json.dumps(result), status=status,
+                                content_type="application/json")
+
+        swept = health.status(instance)
+        if swept is not None:
+            up = swept["status"] == "up"
+        else:
+            # if it is up, we check again to see if the state still the same
+            up = instance.is_up()
         status = 500
-        if instance.is_up():
+        if up:
             status = 204
 
         return HttpResponse(status=status)
+
+
+class FleetHealthcheck(View):
+
+    def get(self, request, *args, **kwargs):
+        updated_at, statuses = health.snapshot.all()
+        if updated_at is None:
+            return HttpResponse("Health snapshot is not available yet.",
+                                status=503)
+        data = {"updated_at": updated_at, "instances": statuses}
+        return HttpResponse(json.dumps(data), content_type="application/json")
+
+
+def json_response(data, status=200):
+    return HttpResponse(json.dumps(data), status=status,
+                        content_type="application/json")
+
+
+def start_job(instance, kind, **kwargs):
+    # Purges drop the tables of a database that was dropped, they don't
+    # hold up an instance created again under its name.
+    active = Job.objects.filter(
+        instance_name=instance.name,
+        state__in=["pending", "running"]).exclude(kind="purge").first()
+    if active is not None:
+        msg = u"Instance %s already has a %s in progress." % (instance.name,
+                                                              active.kind)
+        return HttpResponse(msg, status=409)
+    job = Job.objects.create(instance_name=instance.name, kind=kind, **kwargs)
+    return json_response(job.as_dict(), status=202)
+
+
+class Backups(View):
+
+    def get(self, request, name, *args, **kwargs):
+        name = canonicalize_db_name(name)
+        prefix = s3.instance_prefix(name)
+        return json_response({"backups": s3.catalog(s3.bucket(), prefix)})
+
+    def post(self, request, name, *args, **kwargs):
+        name = canonicalize_db_name(name)
+        try:
+            instance = get_instance(name)
+        except Instance.DoesNotExist:
+            return HttpResponse("Instance not found", status=404)
+        if instance.state != "running":
+            msg = u"You can't backup this instance because it's not running."
+            return HttpResponse(msg, status=412)
+        return start_job(instance, "backup")
+
+
+class Restore(View):
+
+    def post(self, request, name, *args, **kwargs):
+        name = canonicalize_db_name(name)
+        try:
+            instance = get_instance(name)
+        except Instance.DoesNotExist:
+            return HttpResponse("Instance not found", status=404)
+        if instance.state != "running":
+            msg = u"You can't restore this instance because it's not running."
+            return HttpResponse(msg, status=412)
+        backups = s3.catalog(s3.bucket(), s3.instance_prefix(name))
+        manifest = request.POST.get("backup")
+        if manifest:
+            backups = [e for e in backups if e["manifest"] == manifest]
+        if not backups:
+            return HttpResponse("Backup not found", status=404)
+        return start_job(instance, "restore", backup=backups[-1]["manifest"],
+                         bytes_total=backups[-1]["size"])
+
+
+class Clone(EC2ClientMixin, View):
+
+    def post(self, request, name, *args, **kwargs):
+        name = canonicalize_db_name(name)
+        try:
+            source = get_instance(name)
+        except Instance.DoesNotExist:
+            return HttpResponse("Instance not found", status=404)
+        if source.state != "running":
+            msg = u"You can't clone this instance because it's not running."
+            return HttpResponse(msg, status=412)
+        if not request.POST.get("name"):
+            return HttpResponse("Instance name is missing", status=400)
+        # The clone is created like any other instance and filled by a job
+        # once it's running.
+        instance = Instance(name=canonicalize_db_name(request.POST["name"]))
+        ec2_client = self.client if uses_ec2() else None
+        try:
+            create_database(instance, ec2_client)
+        except Exception as e:
+            return HttpResponse(e.args[-1], status=500)
+        return start_job(instance, "clone", source=source.name)
+
+
+class JobStatus(View):
+
+    def get(self, request, name, id, *args, **kwargs):
+        name = canonicalize_db_name(name)
+        try:
+            job = Job.objects.get(pk=id, instance_name=name)
+        except Job.DoesNotExist:
+            return HttpResponse("Job not found", status=404)
+        return json_response(job.as_dict())
@@ -140,7 +140,8 @@ LOGGING = {
     }
 }
 
-RESERVED_NAMES = ("mysql", "test", "information_schema", "mysqlapi")
+RESERVED_NAMES = ("mysql", "test", "information_schema", "mysqlapi",
+                  "status")
 SHARED_SERVER = os.environ.get("MYSQLAPI_SHARED_SERVER")
 SHARED_SERVER_PUBLIC_HOST = os.environ.get(
     "MYSQLAPI_SHARED_SERVER_PUBLIC_HOST",
@@ -148,9 +149,25 @@ SHARED_SERVER_PUBLIC_HOST = os.environ.get(
 )
 SHARED_USER = os.environ.get("MYSQLAPI_SHARED_USER", "root")
 SHARED_PASSWORD = os.environ.get("MYSQLAPI_SHARED_PASSWORD", "")
+# Comma separated read replicas of the shared server, returned by binds as
+# MYSQL_READ_HOSTS. They're reached with the shared server credentials.
+SHARED_READ_HOSTS = [h for h in os.environ.get(
+    "MYSQLAPI_SHARED_READ_HOSTS", "").split(",") if h]
+# Binds wait up to REPLICA_GRANT_TIMEOUT seconds for the app user to reach
+# every read replica through replication.
+REPLICA_GRANT_TIMEOUT = int(os.environ.get("MYSQLAPI_REPLICA_GRANT_TIMEOUT",
+                                           10))
 
 USE_POOL = os.environ.get("MYSQLAPI_USE_POOL", "False") in \
     ("True", "true", "1")
+# With POOL_MAX_DATABASES above 1, pool hosts hold several instances each:
+# new ones go to the fullest host with room for them. A host is full when
+# it has POOL_MAX_DATABASES databases, POOL_MAX_DISK bytes of data or
+# POOL_MAX_CONNECTIONS connections (0 for no limit), unless the host sets
+# its own limits. Usage is measured by "python manage.py poolusage".
+POOL_MAX_DATABASES = int(os.environ.get("MYSQLAPI_POOL_MAX_DATABASES", 1))
+POOL_MAX_DISK = int(os.environ.get("MYSQLAPI_POOL_MAX_DISK", 0))
+POOL_MAX_CONNECTIONS = int(os.environ.get("MYSQLAPI_POOL_MAX_CONNECTIONS", 0))
 
 EC2_ENDPOINT = os.environ.get("MYSQLAPI_EC2_ENDPOINT")
 EC2_PORT = os.environ.get("MYSQLAPI_EC2_PORT")
@@ -161,12 +178,164 @@ EC2_AMI = os.environ.get("MYSQLAPI_EC2_AMI")
 EC2_KEY_NAME = os.environ.get("MYSQLAPI_EC2_KEY_NAME")
 EC2_POLL_INTERVAL = int(os.environ.get("MYSQLAPI_EC2_POLL_INTERVAL", 10))
 
+# Instances still not running EC2_BOOT_TIMEOUT seconds after they were
+# requested are terminated and marked as failed (0 waits forever).
+EC2_BOOT_TIMEOUT = int(os.environ.get("MYSQLAPI_EC2_BOOT_TIMEOUT", 900))
+
+# "inline" starts the EC2 creator thread inside each web worker, while
+# "standalone" leaves it to a single "python manage.py runcreator" process.
+CREATOR_MODE = os.environ.get("MYSQLAPI_CREATOR_MODE", "inline")
+
 S3_ACCESS_KEY = os.environ.get("TSURU_S3_ACCESS_KEY_ID")
 S3_SECRET_KEY = os.environ.get("TSURU_S3_SECRET_KEY")
 S3_BUCKET = os.environ.get("TSURU_S3_BUCKET")
 
+# "manage.py prunebackups" always keeps the newest BACKUP_KEEP backups and
+# deletes those older than BACKUP_MAX_AGE_DAYS beyond them.
+BACKUP_KEEP = int(os.environ.get("MYSQLAPI_BACKUP_KEEP", 7))
+BACKUP_MAX_AGE_DAYS = int(os.environ.get("MYSQLAPI_BACKUP_MAX_AGE_DAYS", 30))
+
+# Chunks no backup references are only deleted once they are older than
+# BACKUP_CHUNK_GRACE_HOURS, so exports still uploading keep theirs. Exports
+# refresh the chunks they reuse once they are half that old, so it must be
+# more than twice as long as the longest export.
+BACKUP_CHUNK_GRACE_HOURS = int(
+    os.environ.get("MYSQLAPI_BACKUP_CHUNK_GRACE_HOURS", 48))
+
+# Default "manage.py export" engine: "snapshot" (parallel dump of a single
+# consistent snapshot), "logical" (mysqldump) or "physical" (xtrabackup hot
+# backups, for dedicated servers). BACKUP_PARALLEL is the number of tables
+# or files dumped and chunks compressed and uploaded at once.
+BACKUP_ENGINE = os.environ.get("MYSQLAPI_BACKUP_ENGINE", "snapshot")
+BACKUP_PARALLEL = int(os.environ.get("MYSQLAPI_BACKUP_PARALLEL", 4))
+
+# Snapshot exports pause between tables while the server runs more than
+# BACKUP_MAX_THREADS_RUNNING threads (the dump's own included), spends more
+# than BACKUP_MAX_IOWAIT of its CPU time waiting for I/O or lags more than
+# BACKUP_MAX_REPLICATION_LAG seconds behind its master, for at most
+# BACKUP_MAX_PAUSE seconds at a time, and slow down for a while after.
+# Snapshot and physical exports never read more than BACKUP_RATE_LIMIT bytes
+# per second (0 for no limit).
+BACKUP_RATE_LIMIT = int(os.environ.get("MYSQLAPI_BACKUP_RATE_LIMIT", 0))
+BACKUP_MAX_THREADS_RUNNING = int(
+    os.environ.get("MYSQLAPI_BACKUP_MAX_THREADS_RUNNING", 24))
+BACKUP_MAX_IOWAIT = float(os.environ.get("MYSQLAPI_BACKUP_MAX_IOWAIT", 0.3))
+BACKUP_MAX_REPLICATION_LAG = int(
+    os.environ.get("MYSQLAPI_BACKUP_MAX_REPLICATION_LAG", 30))
+BACKUP_MAX_PAUSE = int(os.environ.get("MYSQLAPI_BACKUP_MAX_PAUSE", 600))
+
+# Per-instance backup and restore jobs are run by a single "python manage.py
+# runjobs" process ("standalone") polling for them every JOB_POLL_INTERVAL
+# seconds, or by a thread in each web worker ("inline"), which ties up the
+# worker while a job runs. Their progress is saved, and their lease renewed,
+# every JOB_PROGRESS_INTERVAL seconds: running jobs not renewed for
+# JOB_LEASE_TIMEOUT seconds were left by a runner that died and are run again.
+JOBS_MODE = os.environ.get("MYSQLAPI_JOBS_MODE", "standalone")
+JOB_POLL_INTERVAL = int(os.environ.get("MYSQLAPI_JOB_POLL_INTERVAL", 5))
+JOB_PROGRESS_INTERVAL = int(os.environ.get("MYSQLAPI_JOB_PROGRESS_INTERVAL",
+                                           5))
+JOB_LEASE_TIMEOUT = int(os.environ.get("MYSQLAPI_JOB_LEASE_TIMEOUT", 120))
+# Clones of databases on the same server copy this many tables at once.
+CLONE_PARALLEL = int(os.environ.get("MYSQLAPI_CLONE_PARALLEL", 4))
+# Databases dropped from the shared server are purged by a job dropping
+# their tables at up to PURGE_RATE bytes per second (0 for no limit),
+# pausing while the server is as busy as BACKUP_MAX_* allow.
+PURGE_RATE = int(os.environ.get("MYSQLAPI_PURGE_RATE", 64 * 1024 * 1024))
+
+# When PROXY_HOST is set, apps are bound to shared instances through a
+# ProxySQL proxy at PROXY_HOST:PROXY_PORT. Binds register their user in the
+# proxy admin interface, at PROXY_ADMIN_HOST:PROXY_ADMIN_PORT, with queries
+# going to PROXY_HOSTGROUP (the shared server) and at most
+# PROXY_MAX_CONNECTIONS connections from the units of each app. The proxy
+# multiplexes them over its own pool of connections to the server.
+PROXY_HOST = os.environ.get("MYSQLAPI_PROXY_HOST")
+PROXY_PORT = int(os.environ.get("MYSQLAPI_PROXY_PORT", 6033))
+PROXY_ADMIN_HOST = os.environ.get("MYSQLAPI_PROXY_ADMIN_HOST", PROXY_HOST)
+PROXY_ADMIN_PORT = int(os.environ.get("MYSQLAPI_PROXY_ADMIN_PORT", 6032))
+PROXY_ADMIN_USER = os.environ.get("MYSQLAPI_PROXY_ADMIN_USER", "admin")
+PROXY_ADMIN_PASSWORD = os.environ.get("MYSQLAPI_PROXY_ADMIN_PASSWORD", "")
+PROXY_HOSTGROUP = int(os.environ.get("MYSQLAPI_PROXY_HOSTGROUP", 0))
+PROXY_MAX_CONNECTIONS = int(
+    os.environ.get("MYSQLAPI_PROXY_MAX_CONNECTIONS", 1000))
+
+# Comma separated users "manage.py collectusers" never drops, besides the
+# ones the API connects with (replication or monitoring users, say).
+KEEP_USERS = [u for u in os.environ.get("MYSQLAPI_KEEP_USERS",
+                                        "").split(",") if u]
+
 SALT = os.environ.get("MYSQLAPI_SALT", "")
 
+# Seconds to cache resolved backend hostnames, 0 disables the cache.
+DNS_CACHE_TTL = int(os.environ.get("MYSQLAPI_DNS_CACHE_TTL", 60))
+
+# When KEEPALIVE_INTERVAL is set, each worker keeps KEEPALIVE_POOL_SIZE warm
+# connections to every backend it used in the last KEEPALIVE_IDLE_TIMEOUT
+# seconds, pinging them about every KEEPALIVE_INTERVAL seconds. Backends
+# that don't answer in KEEPALIVE_CONNECT_TIMEOUT seconds are skipped.
+KEEPALIVE_INTERVAL = int(os.environ.get("MYSQLAPI_KEEPALIVE_INTERVAL", 0))
+KEEPALIVE_POOL_SIZE = int(os.environ.get("MYSQLAPI_KEEPALIVE_POOL_SIZE", 1))
+KEEPALIVE_IDLE_TIMEOUT = int(os.environ.get("MYSQLAPI_KEEPALIVE_IDLE_TIMEOUT",
+                                            600))
+KEEPALIVE_CONNECT_TIMEOUT = int(
+    os.environ.get("MYSQLAPI_KEEPALIVE_CONNECT_TIMEOUT", 5))
+
+# When HEALTH_SWEEP_INTERVAL is set, a single "python manage.py runhealth"
+# process ("standalone") probes every instance on that schedule with
+# HEALTH_SWEEP_WORKERS concurrent probes, and status calls are answered from
+# results younger than HEALTH_SNAPSHOT_MAX_AGE (twice the interval by
+# default). "inline" sweeps in every web worker instead.
+HEALTH_SWEEP_INTERVAL = int(os.environ.get("MYSQLAPI_HEALTH_SWEEP_INTERVAL",
+                                           0))
+HEALTH_MODE = os.environ.get("MYSQLAPI_HEALTH_MODE", "standalone")
+HEALTH_SWEEP_WORKERS = int(os.environ.get("MYSQLAPI_HEALTH_SWEEP_WORKERS", 16))
+HEALTH_PROBE_TIMEOUT = int(os.environ.get("MYSQLAPI_HEALTH_PROBE_TIMEOUT", 2))
+HEALTH_SNAPSHOT_MAX_AGE = int(
+    os.environ.get("MYSQLAPI_HEALTH_SNAPSHOT_MAX_AGE", 0))
+# Deep checks (status?deep=1) are cached per backend for this many seconds.
+HEALTH_DEEP_CACHE_TTL = int(os.environ.get("MYSQLAPI_HEALTH_DEEP_CACHE_TTL",
+                                           30))
+
+# Per-endpoint guardrails for expensive operations: at most max_global of
+# them run at once (max_per_host against a single backend), up to queue
+# callers wait for timeout seconds (503 afterwards) and the rest get a 429.
+# The counts are kept in the memory of each web worker, so the limits set
+# below are totals for the deployment, split among the WEB_CONCURRENCY
+# workers gunicorn starts (1 unless set) and rounded down to at least 1.
+WEB_WORKERS = max(int(os.environ.get("WEB_CONCURRENCY", 1)), 1)
+
+
+def per_worker(name, total):
+    return max(int(os.environ.get(name, total)) // WEB_WORKERS, 1)
+
+
+CONCURRENCY_LIMITS = {
+    "export": {
+        "max_global": per_worker("MYSQLAPI_EXPORT_CONCURRENCY", 4),
+        "max_per_host": per_worker("MYSQLAPI_EXPORT_PER_HOST", 2),
+        "queue": 16,
+        "timeout": 30,
+        "retry_after": 30,
+    },
+    "drop": {
+        "max_global": per_worker("MYSQLAPI_DROP_CONCURRENCY", 8),
+        "max_per_host": per_worker("MYSQLAPI_DROP_PER_HOST", 2),
+        "queue": 32,
+        "timeout": 30,
+        "retry_after": 10,
+    },
+    "import": {
+        "max_global": per_worker("MYSQLAPI_IMPORT_CONCURRENCY", 4),
+        "max_per_host": per_worker("MYSQLAPI_IMPORT_PER_HOST", 1),
+        "queue": 8,
+        "timeout": 30,
+        "retry_after": 30,
+    },
+}
+
+# Rendered schema exports are cached for EXPORT_CACHE_TTL seconds under a
+# fingerprint of the schema, 0 disables the cache.
+EXPORT_CACHE_TTL = int(os.environ.get("MYSQLAPI_EXPORT_CACHE_TTL", 3600))
+
 ALLOWED_HOSTS = [
     os.environ.get("MYSQLAPI_ALLOWED_HOST", "localhost"),
 ]
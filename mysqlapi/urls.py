@@ -5,12 +5,20 @@
 from django.conf.urls import patterns, url
 
 from mysqlapi.api.decorators import basic_auth_required
-from mysqlapi.api.views import (BindApp, BindUnit, CreateDatabase,
-                                DropDatabase, Healthcheck)
+from mysqlapi.api.views import (Backups, BindApp, BindUnit, Clone,
+                                CreateDatabase, DropDatabase,
+                                FleetHealthcheck, Healthcheck, Import,
+                                JobStatus, Restore)
 
 urlpatterns = patterns('',
+                       url(r'^metrics$', 'mysqlapi.api.views.metrics'),
+                       url(r'^metrics/provisioning$',
+                           'mysqlapi.api.views.provisioning_report'),
+                       url(r'^ec2/events$', 'mysqlapi.api.views.ec2_event'),
                        url(r'^resources$',
                            basic_auth_required(CreateDatabase.as_view())),
+                       url(r'^resources/status$',
+                           basic_auth_required(FleetHealthcheck.as_view())),
                        url(r'^resources/(?P<name>[\w-]+)$',
                            basic_auth_required(DropDatabase.as_view())),
                        url(r'^resources/(?P<name>[\w-]+)/bind$',
@@ -19,6 +27,16 @@ urlpatterns = patterns('',
                            basic_auth_required(BindApp.as_view())),
                        url(r'^resources/(?P<name>[\w-]+)/export$',
                            'mysqlapi.api.views.export'),
+                       url(r'^resources/(?P<name>[\w-]+)/import$',
+                           basic_auth_required(Import.as_view())),
                        url(r'^resources/(?P<name>[\w-]+)/status$',
                            basic_auth_required(Healthcheck.as_view())),
+                       url(r'^resources/(?P<name>[\w-]+)/backups$',
+                           basic_auth_required(Backups.as_view())),
+                       url(r'^resources/(?P<name>[\w-]+)/restore$',
+                           basic_auth_required(Restore.as_view())),
+                       url(r'^resources/(?P<name>[\w-]+)/clone$',
+                           basic_auth_required(Clone.as_view())),
+                       url(r'^resources/(?P<name>[\w-]+)/jobs/(?P<id>\d+)$',
+                           basic_auth_required(JobStatus.as_view())),
                        )
@@ -5,33 +5,39 @@
 # license that can be found in the LICENSE file.
 
 import os
-import signal
+import sys
+import time
 
-import crane_ec2
-
-from mysqlapi.api import creator
-from mysqlapi.api.models import DatabaseManager, Instance
+_boot_started = time.time()
 
 os.environ["DJANGO_SETTINGS_MODULE"] = "mysqlapi.settings"
 
+from django.conf import settings  # noqa
+from django.core.wsgi import get_wsgi_application  # noqa
+
+from mysqlapi.api import creator, health, jobs, keepalive  # noqa
+from mysqlapi.api.models import DatabaseManager, Instance, uses_ec2  # noqa
 
-def huphandler(signum, frame):
-    creator.reset_queue()
 
+def start():
+    import crane_ec2
 
-def termhandler(signum, frame):
-    creator.close_queue()
+    return creator.start(DatabaseManager, Instance, crane_ec2.Client())
 
 
-def start():
-    client = crane_ec2.Client()
-    signal.signal(signal.SIGHUP, huphandler)
-    signal.signal(signal.SIGTERM, termhandler)
-    creator.set_model(Instance)
-    creator.build_queue()
-    creator.start_creator(DatabaseManager, client)
+if settings.CREATOR_MODE == "inline" and uses_ec2():
+    start()
 
-start()
+if settings.KEEPALIVE_INTERVAL:
+    keepalive.start()
+
+if settings.HEALTH_SWEEP_INTERVAL and settings.HEALTH_MODE == "inline":
+    health.start(Instance)
+
+if settings.JOBS_MODE == "inline":
+    jobs.start()
 
-from django.core.wsgi import get_wsgi_application
 application = get_wsgi_application()
+
+sys.stderr.write("mysqlapi worker {0} booted in {1:.3f}s\n".format(
+    os.getpid(), time.time() - _boot_started))